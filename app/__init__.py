@@ -2,7 +2,6 @@ import logging
 from logging.handlers import SMTPHandler, RotatingFileHandler
 from flask import Flask, request, current_app
 from config import Config
-from flask_sqlalchemy import SQLAlchemy #ORM module
 from flask_migrate import Migrate #DB migrations
 from flask_login import LoginManager #Users logging in
 from flask_bootstrap import Bootstrap
@@ -10,12 +9,20 @@ from flask_mail import Mail
 from flask_moment import Moment #timezone
 from flask_babel import Babel, lazy_gettext as _l #i18n and l10n support
 import os
-from elasticsearch import Elasticsearch
-from redis import Redis
-import rq
-
-# use SQLAlchemy for database management
-db = SQLAlchemy()
+from app import clients
+from app.json_provider import JSONProvider
+from app.compress import Compress
+from app.ratelimit import RateLimiter
+from app.fragments import FragmentCache
+from app.routing import RoutingSQLAlchemy #ORM module with read replicas
+from app.sqlstats import SQLInstrumentation
+from app.metrics import Metrics
+from app.assets import Assets
+from app.trends import Trends
+
+# use SQLAlchemy for database management, reads of GET requests can
+# go to SQLALCHEMY_REPLICAS
+db = RoutingSQLAlchemy()
 
 # use flask_migrate for migration
 migrate = Migrate()
@@ -39,13 +46,45 @@ moment = Moment()
 #use flask_babel for gettext translation etc
 babel = Babel()
 
+# orjson-backed jsonify (stdlib json if orjson isn`t installed)
+json_provider = JSONProvider()
+
+# gzip/brotli for JSON responses
+compress = Compress()
+
+# token buckets for expensive endpoints (RATELIMITS in config.py)
+limiter = RateLimiter()
+
+# rendered _post.html fragments, see render_posts() in templates
+fragment_cache = FragmentCache()
+
+# per-request query count and time, N+1 warnings
+sql_stats = SQLInstrumentation()
+
+# prometheus metrics at /metrics
+metrics = Metrics()
+
+# fingerprinted, precompressed css/js at /assets (flask assets build)
+assets = Assets()
+
+# trending terms and hot posts from count-min sketches (app/trends.py)
+trends = Trends()
+
+class Microblog(Flask):
+    '''Flask app whose external clients are created on first use and
+    re-created in forked processes'''
+    elasticsearch = clients.fork_safe_client(clients.elasticsearch)
+    redis = clients.fork_safe_client(clients.redis)
+    task_queues = clients.fork_safe_client(clients.task_queues)
+    task_queue = clients.fork_safe_client(clients.task_queue)
+
 def create_app(config_class = Config):
     '''application factory for building app instances'''
     # initiate the Flask app
-    app = Flask(__name__)
+    app = Microblog(__name__)
 
     # use config.py for configuration
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
 
     # init all instances from above
     db.init_app(app)
@@ -55,14 +94,17 @@ def create_app(config_class = Config):
     bootstrap.init_app(app)
     moment.init_app(app)
     babel.init_app(app)
-
-    # init elasticsearch instance
-    app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) \
-        if app.config['ELASTICSEARCH_URL'] else None
-
-    # init RQ
-    app.redis = Redis.from_url(app.config['REDIS_URL'])
-    app.task_queue = rq.Queue('microblog-tasks', connection = app.redis)
+    metrics.init_app(app)
+    json_provider.init_app(app)
+    compress.init_app(app)
+    limiter.init_app(app)
+    fragment_cache.init_app(app)
+    sql_stats.init_app(app)
+    assets.init_app(app)
+    trends.init_app(app)
+
+    # app.elasticsearch, app.redis and app.task_queue are built lazily,
+    # see app/clients.py
 
     # blueprint reg for errors module
     from app.errors import bp as errors_bp
@@ -1,3 +1,4 @@
+from flask import g
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
 from app.models import User
 from app.api.errors import error_response
@@ -17,7 +18,13 @@ def basic_auth_error(status):
 
 @token_auth.verify_token
 def verify_token(token):
-    return User.check_token(token) if token else None
+    '''the token`s user, looked up once per request as the rate limiter
+    verifies tokens before the view does'''
+    if not token:
+        return None
+    if g.get('token') != token:
+        g.token, g.token_user = token, User.check_token(token)
+    return g.token_user
 
 @token_auth.error_handler
 def token_auth_error(status):
@@ -1,4 +1,4 @@
-from flask import jsonify
+from app.json_provider import jsonify
 from werkzeug.http import HTTP_STATUS_CODES
 
 def error_response(status_code, message = None):
@@ -10,4 +10,11 @@ def error_response(status_code, message = None):
     return response
 
 def bad_request(message):
-    return error_response(400, message)
\ No newline at end of file
+    return error_response(400, message)
+
+def too_many_requests(retry_after, status_code = 429, message = None):
+    '''429 (rate limited) or 503 (load shed) with a Retry-After header'''
+    response = error_response(status_code, message)
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
\ No newline at end of file
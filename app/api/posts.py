@@ -0,0 +1,148 @@
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+import json
+from flask import current_app, request
+from app.json_provider import jsonify
+from app.api import bp
+from app import db, timelines
+from app.api.auth import token_auth
+from app.api.errors import bad_request, error_response
+from app.models import Post
+from app.pipeline import BITS, submit_posts
+from app.search import bulk_index
+
+TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+def parse_timestamp(value):
+    '''ISO 8601 in UTC, e.g. 2020-05-17T10:00:00Z'''
+    if value.endswith('Z'):
+        value = value[:-1]
+    for format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    return None
+
+def read_items():
+    '''the posts of a JSON list, a {"posts": [...]} object or NDJSON (a
+    post per line). NDJSON lines that aren`t JSON become error strings'''
+    text = request.get_data(as_text = True)
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = []
+        for line in text.splitlines():
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append('invalid JSON')
+        return items
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        data = data.get('posts')
+    return data if isinstance(data, list) else None
+
+def validate(item, user_id, now):
+    '''(row, None) for a valid post, (None, error message) otherwise'''
+    if isinstance(item, str):
+        return None, item
+    if not isinstance(item, dict):
+        return None, 'a post must be an object'
+    body = item.get('body')
+    if not isinstance(body, str) or not body.strip():
+        return None, 'body must be a non-empty string'
+    body = body.strip()
+    if len(body) > 140:
+        return None, 'body must be 140 characters or less'
+    timestamp = now
+    if item.get('timestamp') is not None:
+        timestamp = parse_timestamp(str(item['timestamp']))
+        if timestamp is None:
+            return None, 'timestamp must be ISO 8601 in UTC'
+        if timestamp > now + timedelta(minutes = 5):
+            return None, 'timestamp is in the future'
+    language = item.get('language')
+    if language is not None and (not isinstance(language, str) or
+            len(language) > 5):
+        return None, 'language must be a code of up to 5 characters'
+    # whole seconds, as MySQL`s DATETIME stores them, so the new rows
+    # match their items on every database
+    return {'body': body, 'timestamp': timestamp.replace(microsecond = 0),
+        'user_id': user_id, 'language': language, 'pipeline': 0}, None
+
+@bp.route('/posts/bulk', methods = ['POST'])
+@token_auth.login_required
+def create_posts_bulk():
+    '''create up to API_BULK_MAX_POSTS posts of the token`s user from
+    JSON or NDJSON in one INSERT, returns a result per item in order:
+    {"index", "status": 201, "id"} or {"index", "status": 400, "error"}.
+    Posts may carry a timestamp (imports, kept to the second) and a
+    language, the pipeline`s language stage detects the others. The
+    search index gets them in one bulk request, the rest is left to the
+    ingestion pipeline'''
+    config = current_app.config
+    if (request.content_length or 0) > config['API_BULK_MAX_BYTES']:
+        return error_response(413, 'no more than {} bytes per request'.format(
+            config['API_BULK_MAX_BYTES']))
+    items = read_items()
+    if items is None:
+        return bad_request('expected a JSON list of posts, {"posts": [...]} '
+            'or NDJSON')
+    if not items:
+        return bad_request('no posts')
+    if len(items) > config['API_BULK_MAX_POSTS']:
+        return bad_request('no more than {} posts per request'.format(
+            config['API_BULK_MAX_POSTS']))
+    user = token_auth.current_user()
+    now = datetime.utcnow()
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        row, error = validate(item, user.id, now)
+        if error:
+            results.append({'index': index, 'status': 400, 'error': error})
+        else:
+            results.append({'index': index, 'status': 201})
+            rows.append(row)
+    if rows:
+        last_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+        db.session.execute(Post.__table__.insert(), rows)
+        # executemany gives no ids back, match the new rows to the items
+        ids = defaultdict(deque)
+        for id, body, timestamp in db.session.query(Post.id, Post.body,
+                Post.timestamp).filter(Post.user_id == user.id,
+                Post.id > last_id).order_by(Post.id):
+            ids[body, timestamp].append(id)
+        db.session.commit()
+        created = [result for result in results if result['status'] == 201]
+        for row, result in zip(rows, created):
+            row['id'] = result['id'] = ids[row['body'],
+                row['timestamp']].popleft()
+        posts = [Post(id = row['id'], body = row['body']) for row in rows]
+        if current_app.elasticsearch:
+            try:
+                bulk_index(Post.__search_index__, posts)
+            except Exception:
+                # the posts are saved, the pipeline`s search stage indexes
+                # them without the bit
+                current_app.logger.exception('Bulk indexing of %d posts '
+                    'failed', len(posts))
+            else:
+                table = Post.__table__
+                # chunks stay under SQLite`s 999 bound parameters
+                for start in range(0, len(posts), 500):
+                    db.session.execute(table.update().where(table.c.id.in_(
+                        [post.id for post in posts[start:start + 500]])).values(
+                            pipeline = table.c.pipeline.op('|')(
+                                BITS['search'])))
+                db.session.commit()
+        timelines.invalidate(user.id)
+        submit_posts(current_app._get_current_object(), posts)
+    return jsonify({
+        'created': len(rows),
+        'errors': len(results) - len(rows),
+        'items': results
+    })
@@ -1,4 +1,4 @@
-from flask import jsonify
+from app.json_provider import jsonify
 from app import db
 from app.api import bp
 from app.api.auth import basic_auth, token_auth
@@ -0,0 +1,17 @@
+from flask import request
+from app.json_provider import jsonify
+from app.api import bp
+from app.api.auth import token_auth
+from app.trends import trending
+
+@bp.route('/trends', methods = ['GET'])
+@token_auth.login_required
+def get_trends():
+    '''trending terms and hot posts, ?limit= up to 100 of each'''
+    limit = min(max(request.args.get('limit', 20, type = int), 1), 100)
+    terms, posts = trending(limit)
+    return jsonify({
+        'terms': [{'term': term, 'score': score} for term, score in terms],
+        'posts': [dict(post.to_dict(), score = score)
+            for post, score in posts]
+    })
@@ -1,24 +1,65 @@
-from flask import current_app, jsonify, request, url_for, abort
+from flask import current_app, request, url_for, abort
+from app.json_provider import jsonify
 from app.api import bp
 from app import db
 from app.api.errors import bad_request
 from app.models import User
 from app.api.auth import token_auth
 
+def get_fields():
+    '''parse ?fields=username,post_count into a set, None means all fields.
+    See User.API_FIELDS for what each field costs'''
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    fields = set(field.strip() for field in fields.split(',') if field.strip())
+    unknown = fields - set(User.API_FIELDS)
+    if unknown:
+        abort(bad_request('unknown fields: ' + ', '.join(sorted(unknown))))
+    return fields
+
 @bp.route('/users/<int:id>', methods = ['GET'])
 @token_auth.login_required
 def get_user(id):
-    return jsonify(User.query.get_or_404(id).to_dict())
+    return jsonify(User.query.get_or_404(id).to_dict(fields = get_fields()))
 
 @bp.route('/users', methods = ['GET'])
 @token_auth.login_required
 def get_users():
-    '''get all users` info'''
+    '''get all users` info, or a batch of them with ?ids=1,2,3'''
+    if 'ids' in request.args:
+        return get_users_batch(request.args['ids'])
     page = request.args.get('page', 1, type = int)
     per_page = min(request.args.get('per_page', 10, type = int), 100)
-    data = User.to_collection_dict(User.query, page, per_page, 'api.get_users')
+    data = User.to_collection_dict(User.query, page, per_page, 'api.get_users',
+        fields = get_fields())
     return jsonify(data)
 
+def get_users_batch(ids):
+    '''one IN query and grouped counts for up to API_BATCH_MAX_IDS users,
+    returned as a map keyed by id'''
+    try:
+        ids = list(dict.fromkeys(int(id) for id in ids.split(',') if id))
+    except ValueError:
+        return bad_request('ids must be a comma separated list of integers')
+    if not ids:
+        return bad_request('ids must not be empty')
+    max_ids = current_app.config['API_BATCH_MAX_IDS']
+    if len(ids) > max_ids:
+        return bad_request('no more than {} ids per request'.format(max_ids))
+    fields = get_fields()
+    users = User.query.filter(User.id.in_(ids)).all()
+    if fields is None or fields & set(User.COUNT_FIELDS):
+        counts = User.get_counts([user.id for user in users])
+    else:
+        counts = {}
+    items = dict((str(user.id), user.to_dict(counts = counts.get(user.id),
+        fields = fields)) for user in users)
+    return jsonify({
+        'items': items,
+        'missing': [id for id in ids if str(id) not in items]
+    })
+
 @bp.route('/users/<int:id>/followers', methods = ['GET'])
 @token_auth.login_required
 def get_followers(id):
@@ -26,7 +67,7 @@ def get_followers(id):
     page = request.args.get('page', 1, type = int)
     per_page = min(request.args.get('per_page', 10, type = int), 100)
     data = User.to_collection_dict(user.followers, page, per_page, 
-        'api.get_followers', id = id)
+        'api.get_followers', fields = get_fields(), id = id)
     return jsonify(data)
 
 @bp.route('/users/<int:id>/followed', methods = ['GET'])
@@ -36,7 +77,7 @@ def get_followed(id):
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
     data = User.to_collection_dict(user.followed, page, per_page, 
-        'api.get_followed', id = id)
+        'api.get_followed', fields = get_fields(), id = id)
     return jsonify(data)
 
 @bp.route('/users', methods = ['POST'])
@@ -72,5 +113,5 @@ def update_user(id):
         return bad_request('please use a different email address')
     user.from_dict(data, new_user=False)
     db.session.commit()
-    return jsonify(user.to_dict())
+    return jsonify(user.to_dict(fields = get_fields()))
 
@@ -0,0 +1,224 @@
+'''fingerprinted, precompressed static files. `flask assets build`
+writes every bundle in BUNDLES to ASSETS_OUTPUT as name.<hash>.ext with
+.gz/.br copies next to it and a manifest.json of name -> file.
+Templates link them with asset_url(name), /assets/ serves them with a
+year long immutable Cache-Control'''
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from collections import OrderedDict
+from flask import abort, current_app, request, safe_join, \
+    send_from_directory, url_for
+import flask_bootstrap
+
+try:
+    import brotli
+except ImportError: # .gz only
+    brotli = None
+
+# bundle: source files, relative to app/static or, with a bootstrap/
+# prefix, to Flask-Bootstrap`s static folder. Files referenced by url()
+# in CSS are fingerprinted too
+BUNDLES = OrderedDict([
+    ('vendor.css', ['bootstrap/css/bootstrap.min.css']),
+    ('vendor.js', ['bootstrap/jquery.min.js',
+        'bootstrap/js/bootstrap.min.js']),
+    ('app.js', ['js/translate.js', 'js/popup.js', 'js/notifications.js']),
+    ('loading.gif', ['loading.gif'])
+])
+
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ttf')
+# (Content-Encoding, file suffix), best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+CSS_URL = re.compile(r'url\(([\'"]?)([^)\'"]+)\1\)')
+SOURCE_MAP = re.compile(r'^\s*(//|/\*)# sourceMappingURL=.*$', re.M)
+
+def source_path(app, name):
+    if name.startswith('bootstrap/'):
+        return os.path.join(os.path.dirname(flask_bootstrap.__file__),
+            'static', *name.split('/')[1:])
+    return os.path.join(app.static_folder, *name.split('/'))
+
+def minify_js(text):
+    '''drops indentation, blank lines and // comment lines. Sources
+    keep to one statement per line, so line breaks still end them'''
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines
+        if line and not line.startswith('//'))
+
+def gzip_compress(data):
+    '''level 9 without a timestamp, rebuilds give identical files'''
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj = buffer, mode = 'wb', compresslevel = 9,
+            mtime = 0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+def compressors():
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality = 11)
+    yield '.gz', gzip_compress
+
+def variants(filename):
+    return [filename] + [filename + suffix for encoding, suffix in ENCODINGS]
+
+class Builder(object):
+    def __init__(self, app, output):
+        self.app = app
+        self.output = output
+        self.manifest = {}
+
+    def read(self, name):
+        with open(source_path(self.app, name), 'rb') as f:
+            return f.read()
+
+    def write(self, name, data):
+        '''name.<hash>.ext and its compressed copies, returns the file'''
+        if name in self.manifest:
+            return self.manifest[name]
+        root, ext = posixpath.splitext(name)
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        filename = '{}.{}{}'.format(root, digest, ext)
+        path = os.path.join(self.output, *filename.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if ext in COMPRESSIBLE:
+            for suffix, compress in compressors():
+                compressed = compress(data)
+                if len(compressed) < len(data):
+                    with open(path + suffix, 'wb') as f:
+                        f.write(compressed)
+        self.manifest[name] = filename
+        return filename
+
+    def rewrite_urls(self, bundle, source, text):
+        '''point relative url()s at fingerprinted copies'''
+        def replace(match):
+            url = match.group(2)
+            if re.match(r'[\w+.-]+:|/|#', url):
+                return match.group(0)
+            path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+            name = posixpath.normpath(posixpath.join(
+                posixpath.dirname(source), path))
+            filename = self.write(name, self.read(name))
+            return 'url({}{})'.format(posixpath.relpath(filename,
+                posixpath.dirname(bundle) or '.'), suffix)
+        return CSS_URL.sub(replace, text)
+
+    def bundle(self, name, sources):
+        root, ext = posixpath.splitext(name)
+        if ext not in ('.js', '.css'):
+            return self.write(name, b''.join(self.read(source)
+                for source in sources))
+        parts = []
+        for source in sources:
+            text = SOURCE_MAP.sub('', self.read(source).decode('utf-8'))
+            if ext == '.css':
+                text = self.rewrite_urls(name, source, text)
+            elif '.min.' not in source:
+                text = minify_js(text)
+            parts.append(text.strip())
+        return self.write(name, ('\n'.join(parts) + '\n').encode('utf-8'))
+
+def load_manifest(output):
+    try:
+        with open(os.path.join(output, MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def build(app, output = None, bundles = BUNDLES):
+    '''write every bundle and manifest.json, remove the files of the
+    previous build that aren`t used any more. Returns the manifest'''
+    output = output or app.config['ASSETS_OUTPUT']
+    previous = load_manifest(output) or {}
+    builder = Builder(app, output)
+    for name, sources in bundles.items():
+        builder.bundle(name, sources)
+    path = os.path.join(output, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(builder.manifest, f, indent = 2, sort_keys = True)
+    os.replace(path + '.tmp', path)
+    for filename in set(previous.values()) - set(builder.manifest.values()):
+        for variant in variants(filename):
+            path = os.path.join(output, *variant.split('/'))
+            if os.path.exists(path):
+                os.remove(path)
+    return builder.manifest
+
+def asset_url(name):
+    '''template global: {{ asset_url('app.js') }}'''
+    return current_app.extensions['assets'].url(name)
+
+class Assets(object):
+    '''serves ASSETS_OUTPUT at ASSETS_URL_PATH. Without a manifest the
+    assets are built on first use if ASSETS_AUTO_BUILD is set. In debug
+    mode the manifest is read again on every lookup, so a new build shows
+    up without a restart'''
+    def __init__(self, app = None):
+        self.manifests = {}
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_OUTPUT',
+            os.path.join(app.static_folder, 'dist'))
+        app.config.setdefault('ASSETS_URL_PATH', '/assets')
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        app.config.setdefault('ASSETS_AUTO_BUILD', True)
+        app.extensions['assets'] = self
+        app.add_url_rule(app.config['ASSETS_URL_PATH'] + '/<path:filename>',
+            'assets', self.send_asset)
+        app.add_template_global(asset_url)
+
+    def manifest(self, app):
+        output = app.config['ASSETS_OUTPUT']
+        manifest = None if app.debug else self.manifests.get(output)
+        if manifest is None:
+            with self.lock:
+                manifest = load_manifest(output)
+                if manifest is None:
+                    if not app.config['ASSETS_AUTO_BUILD']:
+                        raise RuntimeError('{} is missing, run flask assets '
+                            'build'.format(os.path.join(output, MANIFEST)))
+                    app.logger.warning('Building assets in {}, run flask '
+                        'assets build before starting the app'.format(output))
+                    manifest = build(app, output)
+                self.manifests[output] = manifest
+        return manifest
+
+    def url(self, name):
+        return url_for('assets', filename = self.manifest(current_app)[name])
+
+    def send_asset(self, filename):
+        '''the best precompressed copy the client accepts'''
+        config = current_app.config
+        directory = config['ASSETS_OUTPUT']
+        path = safe_join(directory, filename)
+        if filename == MANIFEST or not os.path.isfile(path):
+            abort(404)
+        available = dict((encoding, suffix) for encoding, suffix in ENCODINGS
+            if os.path.isfile(path + suffix))
+        encoding = request.accept_encodings.best_match(list(available))
+        response = send_from_directory(directory,
+            filename + available.get(encoding, ''),
+            mimetype = mimetypes.guess_type(filename)[0] or
+                'application/octet-stream',
+            cache_timeout = config['ASSETS_MAX_AGE'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if available:
+            response.vary.add('Accept-Encoding')
+        # the name changes with the content, clients never revalidate
+        response.headers['Cache-Control'] = 'public, max-age={}, ' \
+            'immutable'.format(config['ASSETS_MAX_AGE'])
+        return response
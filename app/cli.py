@@ -1,4 +1,7 @@
 import os
+import re
+import subprocess
+import sys
 import click
 
 def register(app):
@@ -34,4 +37,254 @@ def register(app):
     def compile():
         """Compile all languages."""
         if os.system('pybabel compile -d app/translations'):
-            raise RuntimeError('compile command failed')
\ No newline at end of file
+            raise RuntimeError('compile command failed')
+
+
+    @app.cli.command('startup-profile')
+    @click.option('--limit', default = 20, help = 'Number of rows to show.')
+    @click.option('--module', default = 'microblog',
+        help = 'Module that builds the app.')
+    def startup_profile(limit, module):
+        """Show which imports make worker startup slow."""
+        if sys.version_info < (3, 7):
+            # the Docker image runs 3.6, profile from a newer Python
+            raise click.ClickException('startup-profile needs Python 3.7 '
+                'or newer for -X importtime, this is {}.{}'.format(
+                    *sys.version_info[:2]))
+        code = 'import time; t = time.time(); import {}; ' \
+            'print(time.time() - t)'.format(module)
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+            code], stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+            universal_newlines = True)
+        if result.returncode:
+            raise RuntimeError('import failed:\n' + result.stderr)
+        rows = []
+        for line in result.stderr.splitlines():
+            match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(.+)',
+                line)
+            if match:
+                rows.append((int(match.group(1)), int(match.group(2)),
+                    len(match.group(3)) // 2, match.group(4)))
+        click.echo('import {} took {:.0f}ms'.format(module,
+            float(result.stdout.split()[-1]) * 1000))
+        packages = {}
+        for own, total, level, name in rows:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + own
+        click.echo('\npackages by import time:')
+        for package, own in sorted(packages.items(),
+                key = lambda item: -item[1])[:limit]:
+            click.echo('{:>9.1f}ms  {}'.format(own / 1000.0, package))
+        click.echo('\nmodules by own time:')
+        for own, total, level, name in sorted(rows,
+                key = lambda row: -row[0])[:limit]:
+            click.echo('{:>9.1f}ms  {}'.format(own / 1000.0, name))
+
+
+    @app.cli.command('warm-up')
+    def warm_up_command():
+        """Run the warm-up steps and show how long each one takes."""
+        from app.warmup import warm_up
+        for name, count, seconds in warm_up(app):
+            click.echo('{:<20} {:>6} {:>9.1f}ms'.format(name,
+                'failed' if count is None else count, seconds * 1000))
+
+
+    @app.cli.group()
+    def seed():
+        """Synthetic data commands."""
+        pass
+
+
+    @seed.command()
+    @click.option('--users', default = 1000, help = 'Number of users.')
+    @click.option('--posts', default = 10, help = 'Mean posts per user.')
+    @click.option('--degree', default = 20,
+        help = 'Mean number of followed accounts.')
+    @click.option('--chunk', default = 10000, help = 'Rows per insert.')
+    @click.option('--random-seed', type = int, help = 'For repeatable data.')
+    @click.option('--index/--no-index', default = False,
+        help = 'Add the posts to Elasticsearch afterwards.')
+    def data(users, posts, degree, chunk, random_seed, index):
+        """Bulk insert users, follows and posts."""
+        import time
+        from app.models import Post, ArchivedPost
+        from app.seed import seed as seed_data
+        start = time.time()
+
+        def progress(table, rows):
+            click.echo('\r{:<8} {:>10} rows {:>8.1f}s'.format(table, rows,
+                time.time() - start), nl = False)
+
+        counts = seed_data(users, posts, degree, chunk, random_seed,
+            progress)
+        click.echo('\n' + ', '.join('{} {}'.format(rows, table)
+            for table, rows in counts.items()))
+        if index:
+            click.echo('indexed {} posts'.format(Post.reindex() +
+                ArchivedPost.reindex()))
+
+
+    @seed.command()
+    @click.option('--chunk', default = 1000, help = 'Posts per bulk request.')
+    def index(chunk):
+        """Add all posts of both tiers to Elasticsearch."""
+        from app.models import Post, ArchivedPost
+        click.echo('indexed {} posts'.format(Post.reindex(chunk) +
+            ArchivedPost.reindex(chunk)))
+
+
+    @app.cli.group()
+    def notifications():
+        """Notification maintenance commands."""
+        pass
+
+
+    @notifications.command()
+    def compact():
+        """Delete stale task progress notifications now."""
+        from datetime import datetime, timedelta
+        from app.models import Notification
+        deleted = Notification.compact(datetime.utcnow() - timedelta(
+            seconds = app.config['NOTIFICATION_RETENTION']),
+            app.config['NOTIFICATION_COMPACT_BATCH'])
+        click.echo('deleted {} notifications'.format(deleted))
+
+
+    @notifications.command('schedule')
+    def schedule_compaction():
+        """Start the periodic compaction job."""
+        from app.tasks import schedule
+        if schedule(app, 'compact_notifications',
+                app.config['NOTIFICATION_COMPACT_INTERVAL']):
+            click.echo('compaction scheduled every {}s'.format(
+                app.config['NOTIFICATION_COMPACT_INTERVAL']))
+        else:
+            click.echo('compaction is scheduled already')
+
+
+    @app.cli.group()
+    def janitor():
+        """Task and RQ job cleanup commands."""
+        pass
+
+
+    @janitor.command()
+    @click.option('--dry-run', is_flag = True,
+        help = 'Only count what would be cleaned.')
+    def run(dry_run):
+        """Close dead tasks and purge old ones now."""
+        from app.janitor import run as run_janitor
+        for kind, count in run_janitor(app, dry_run).items():
+            click.echo('{:<16} {:>8}'.format(kind, count))
+
+
+    @janitor.command('schedule')
+    def schedule_janitor():
+        """Start the periodic janitor job."""
+        from app.tasks import schedule
+        if schedule(app, 'janitor', app.config['JANITOR_INTERVAL']):
+            click.echo('janitor scheduled every {}s'.format(
+                app.config['JANITOR_INTERVAL']))
+        else:
+            click.echo('janitor is scheduled already')
+
+
+    @app.cli.group()
+    def suggestions():
+        """Who to follow commands."""
+        pass
+
+
+    @suggestions.command()
+    @click.option('--full', is_flag = True,
+        help = 'Recompute every user, not only those whose follows changed.')
+    def refresh(full):
+        """Recompute who to follow suggestions now."""
+        from app.suggestions import refresh as refresh_suggestions
+        click.echo('refreshed {} users'.format(refresh_suggestions(full)))
+
+
+    @suggestions.command('schedule')
+    def schedule_suggestions():
+        """Start the periodic suggestions job."""
+        from app.tasks import schedule
+        if schedule(app, 'refresh_suggestions',
+                app.config['SUGGESTIONS_INTERVAL']):
+            click.echo('suggestions refreshed every {}s'.format(
+                app.config['SUGGESTIONS_INTERVAL']))
+        else:
+            click.echo('suggestions are scheduled already')
+
+
+    @app.cli.group()
+    def posts():
+        """Hot and archive post tier commands."""
+        pass
+
+
+    @posts.command()
+    @click.option('--days', type = int,
+        help = 'Archive posts older than this, POST_HOT_DAYS by default.')
+    @click.option('--batch', type = int, help = 'Posts per transaction.')
+    def rollover(days, batch):
+        """Move old posts to the archive now."""
+        from datetime import datetime, timedelta
+        from app.partitions import rollover as rollover_posts
+        cutoff = datetime.utcnow() - timedelta(days = days) \
+            if days is not None else None
+        click.echo('archived {} posts'.format(rollover_posts(cutoff, batch)))
+
+
+    @posts.command('schedule')
+    def schedule_rollover():
+        """Start the periodic rollover job."""
+        from app.tasks import schedule
+        if schedule(app, 'rollover_posts',
+                app.config['POST_ROLLOVER_INTERVAL']):
+            click.echo('rollover scheduled every {}s'.format(
+                app.config['POST_ROLLOVER_INTERVAL']))
+        else:
+            click.echo('rollover is scheduled already')
+
+
+    @app.cli.group()
+    def rq():
+        """Background worker commands."""
+        pass
+
+
+    @rq.command()
+    @click.option('--queue', '-q', multiple = True,
+        help = 'Only run workers for this queue (repeatable).')
+    def supervise(queue):
+        """Run RQ workers for every queue, scaled by queue depth."""
+        from app.queues import Supervisor
+        Supervisor(app, list(queue) or None).run()
+
+
+    @rq.command()
+    def status():
+        """Show queue depths and how many workers they call for."""
+        from app.queues import Supervisor, listens_to
+        supervisor = Supervisor(app)
+        for name, queue in app.task_queues.items():
+            depth = len(queue)
+            click.echo('{:<12} {:>6} jobs {:>3} workers  ({})'.format(name,
+                depth, supervisor.wanted(name, depth),
+                ', '.join(listens_to(app, name))))
+
+
+    @app.cli.group()
+    def assets():
+        """Static asset commands."""
+        pass
+
+
+    @assets.command()
+    def build():
+        """Bundle, fingerprint and precompress css/js for /assets."""
+        from app.assets import build as build_assets
+        manifest = build_assets(app)
+        for name, filename in sorted(manifest.items()):
+            click.echo('{:<48} {}'.format(name, filename))
@@ -0,0 +1,90 @@
+import os
+import random
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+
+class fork_safe_client(object):
+    '''app attribute built by factory(app) on first access. The instance
+    is remembered together with the pid that made it, so a forked worker
+    builds its own connections instead of sharing the parent`s sockets'''
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.__doc__ = factory.__doc__
+
+    def __get__(self, app, owner):
+        if app is None:
+            return self
+        clients = app.__dict__.setdefault('_clients', {})
+        pid = os.getpid()
+        client = clients.get(self.name)
+        if client is None or client[0] != pid:
+            client = clients[self.name] = (pid, self.factory(app))
+        return client[1]
+
+    def __set__(self, app, value):
+        app.__dict__.setdefault('_clients', {})[self.name] = \
+            (os.getpid(), value)
+
+def reset_clients(app):
+    '''forget every client, the next access builds new ones'''
+    app.__dict__.pop('_clients', None)
+
+@event.listens_for(Engine, 'connect')
+def _remember_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+@event.listens_for(Engine, 'checkout')
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    '''a pooled connection opened before a fork is dropped, not used by
+    two processes at once'''
+    if connection_record.info.get('pid', os.getpid()) != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError('connection belongs to pid {}'.format(
+            connection_record.info['pid']))
+
+def engines(app):
+    '''the primary and SQLALCHEMY_BINDS engines'''
+    from app import db
+    return [db.get_engine(app, bind) for bind in
+        [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())]
+
+def before_fork(app):
+    '''in the preloaded master: close its connections so workers start
+    with empty pools'''
+    for engine in engines(app):
+        engine.dispose()
+
+def after_fork(app):
+    '''in a new worker: own clients, own random state, and an open
+    connection pool if WARM_UP is set'''
+    reset_clients(app)
+    random.seed()
+    if app.config.get('WARM_UP'):
+        from app.warmup import prime_db_pool
+        with app.app_context():
+            prime_db_pool(app)
+
+def elasticsearch(app):
+    '''Elasticsearch client or None if ELASTICSEARCH_URL isn`t set'''
+    if not app.config['ELASTICSEARCH_URL']:
+        return None
+    from elasticsearch import Elasticsearch
+    return Elasticsearch([app.config['ELASTICSEARCH_URL']])
+
+def redis(app):
+    '''Redis connection (pool) used by RQ and the caches'''
+    from redis import Redis
+    return Redis.from_url(app.config['REDIS_URL'])
+
+def task_queues(app):
+    '''RQ queues by TASK_QUEUES name, most urgent first'''
+    from collections import OrderedDict
+    import rq
+    from app.queues import queue_name
+    return OrderedDict((name, rq.Queue(queue_name(name),
+        connection = app.redis)) for name in app.config['TASK_QUEUES'])
+
+def task_queue(app):
+    '''the most urgent RQ queue, app.queues.enqueue picks one by task'''
+    return app.task_queues[app.config['TASK_QUEUES'][0]]
@@ -0,0 +1,55 @@
+import gzip
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+
+class Compress(object):
+    '''negotiates gzip/brotli with Accept-Encoding and compresses
+    responses bigger than COMPRESS_MIN_SIZE'''
+    def __init__(self, app = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIMETYPES', ['application/json'])
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_LEVEL', 4)
+        if app.config.get('COMPRESS_ENABLED', True):
+            app.after_request(self.after_request)
+
+    @staticmethod
+    def encodings():
+        '''encodings we can produce, best first'''
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def choose_encoding(self, accept_encodings):
+        return accept_encodings.best_match(self.encodings())
+
+    def compress(self, data, encoding, config):
+        if encoding == 'br':
+            return brotli.compress(data, quality = config['COMPRESS_BR_LEVEL'])
+        return gzip.compress(data, compresslevel = config['COMPRESS_LEVEL'])
+
+    def after_request(self, response):
+        config = current_app.config
+        if response.mimetype not in config['COMPRESS_MIMETYPES'] or \
+                response.status_code < 200 or \
+                response.status_code in (204, 206, 304) or \
+                response.direct_passthrough or \
+                'Content-Encoding' in response.headers or \
+                'no-transform' in response.headers.get('Cache-Control', ''):
+            return response
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        encoding = self.choose_encoding(request.accept_encodings)
+        if not encoding:
+            return response
+        response.set_data(self.compress(data, encoding, config))
+        response.headers['Content-Encoding'] = encoding
+        return response
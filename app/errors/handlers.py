@@ -1,7 +1,8 @@
 from flask import render_template, request
 from app import db
 from app.errors import bp
-from app.api.errors import error_response as api_error_response
+from app.api.errors import error_response as api_error_response, \
+    too_many_requests as api_too_many_requests
 
 def wants_json_response():
     return request.accept_mimetypes['application/json'] >= \
@@ -18,4 +19,15 @@ def internal_error(error):
     db.session.rollback()
     if wants_json_response():
         return api_error_response(500)
-    return render_template('errors/500.html', title = 'Internal Error'), 500
\ No newline at end of file
+    return render_template('errors/500.html', title = 'Internal Error'), 500
+
+@bp.app_errorhandler(429)
+@bp.app_errorhandler(503)
+def too_many_requests_error(error):
+    '''rate limit or load shedding by app.ratelimit'''
+    if wants_json_response():
+        return api_too_many_requests(error.retry_after, error.code)
+    headers = {'Retry-After': str(error.retry_after)} \
+        if error.retry_after else {}
+    return render_template('errors/429.html', title = 'Too Many Requests'), \
+        error.code, headers
\ No newline at end of file
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, render_template
+from markupsafe import Markup
+from redis.exceptions import RedisError
+from app.metrics import cache_lookups, observe
+
+class MemoryBackend(object):
+    '''per-worker LRU with TTL. Author versions are per worker too, so
+    other workers see a profile change only when their entries expire'''
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        values = []
+        with self.lock:
+            for key in keys:
+                item = self.items.get(key)
+                if item is None or item[0] < now:
+                    self.items.pop(key, None)
+                    values.append(None)
+                else:
+                    self.items.move_to_end(key)
+                    values.append(item[1])
+        return values
+
+    def set_many(self, mapping):
+        expires = time.time() + self.ttl
+        with self.lock:
+            for key, value in mapping.items():
+                self.items[key] = (expires, value)
+                self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last = False)
+
+    def get_versions(self, ids):
+        return [self.versions.get(id, 0) for id in ids]
+
+    def bump_versions(self, ids):
+        with self.lock:
+            for id in ids:
+                self.versions[id] = self.versions.get(id, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.versions.clear()
+
+class RedisBackend(object):
+    '''fragments shared by all workers. Redis evicts them by TTL (and by
+    LRU if maxmemory-policy is allkeys-lru)'''
+    VERSIONS_KEY = 'fragment:author-versions'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        with observe('redis', 'fragments'):
+            values = current_app.redis.mget(keys)
+        return [value.decode('utf-8') if value is not None else None
+            for value in values]
+
+    def set_many(self, mapping):
+        pipe = current_app.redis.pipeline(transaction = False)
+        for key, value in mapping.items():
+            pipe.setex(key, self.ttl, value)
+        with observe('redis', 'fragments'):
+            pipe.execute()
+
+    def get_versions(self, ids):
+        with observe('redis', 'fragments'):
+            versions = current_app.redis.hmget(self.VERSIONS_KEY, ids)
+        return [int(version or 0) for version in versions]
+
+    def bump_versions(self, ids):
+        pipe = current_app.redis.pipeline(transaction = False)
+        for id in ids:
+            pipe.hincrby(self.VERSIONS_KEY, id, 1)
+        pipe.execute()
+
+    def clear(self):
+        for key in current_app.redis.scan_iter('fragment:*'):
+            current_app.redis.delete(key)
+
+class FragmentCache(object):
+    '''caches rendered _post.html by (post.id, post.language, locale,
+    author version). The fragment doesn`t depend on the viewer, only on
+    the post (its language is set later by the pipeline), its author`s
+    username/email and the locale'''
+    def __init__(self, app = None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE', 'memory')
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+        app.config.setdefault('FRAGMENT_CACHE_TTL', 3600)
+        kind = app.config['FRAGMENT_CACHE']
+        if kind == 'memory':
+            self.backend = MemoryBackend(app.config['FRAGMENT_CACHE_SIZE'],
+                app.config['FRAGMENT_CACHE_TTL'])
+        elif kind == 'redis':
+            self.backend = RedisBackend(app.config['FRAGMENT_CACHE_TTL'])
+        elif kind:
+            raise ValueError('unknown FRAGMENT_CACHE {}'.format(kind))
+        app.extensions['fragment_cache'] = self
+        app.add_template_global(render_posts)
+
+    @staticmethod
+    def key(post_id, language, locale, version):
+        return 'fragment:post:{}:{}:{}:{}'.format(post_id, language or '',
+            locale, version)
+
+    def render_posts(self, posts, template = '_post.html'):
+        '''rendered template for each post, one cache round trip per page'''
+        posts = list(posts)
+        if self.backend is None or not posts:
+            return [Markup(render_template(template, post = post))
+                for post in posts]
+        try:
+            versions = dict(zip([post.user_id for post in posts],
+                self.backend.get_versions([post.user_id for post in posts])))
+            keys = [self.key(post.id, post.language, g.locale,
+                versions[post.user_id]) for post in posts]
+            cached = self.backend.get_many(keys)
+        except RedisError:
+            current_app.logger.warning('Fragment cache is unavailable')
+            return [Markup(render_template(template, post = post))
+                for post in posts]
+        rendered = []
+        missing = {}
+        for post, key, html in zip(posts, keys, cached):
+            if html is None:
+                html = render_template(template, post = post)
+                missing[key] = html
+            rendered.append(Markup(html))
+        cache_lookups('fragments', len(posts) - len(missing), len(missing))
+        if missing:
+            try:
+                self.backend.set_many(missing)
+            except RedisError:
+                pass
+        return rendered
+
+    def invalidate_authors(self, ids):
+        '''new fragments for every post of these users'''
+        if self.backend is None or not ids:
+            return
+        try:
+            self.backend.bump_versions(list(ids))
+        except RedisError:
+            current_app.logger.warning('Can`t invalidate fragment cache')
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+def render_posts(posts):
+    '''template global: {% for html in render_posts(posts) %}'''
+    return current_app.extensions['fragment_cache'].render_posts(posts)
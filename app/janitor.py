@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from redis.exceptions import RedisError
+from rq.job import Job
+from rq.registry import DeferredJobRegistry, FailedJobRegistry, \
+    FinishedJobRegistry, ScheduledJobRegistry, StartedJobRegistry
+from app import db
+from app.metrics import janitor_cleaned
+from app.models import Task
+from app.pipeline import sweep
+
+# RQ states after which a task won`t make progress any more
+DONE = ('finished', 'failed', 'stopped', 'canceled')
+
+def clean_registries(queue):
+    '''moves jobs of dead workers to the failed registry and drops
+    expired entries from all registries. Returns how many were dropped'''
+    registries = [cls(queue = queue) for cls in (StartedJobRegistry,
+        FinishedJobRegistry, FailedJobRegistry, DeferredJobRegistry,
+        ScheduledJobRegistry)]
+    before = sum(registry.count for registry in registries)
+    for registry in registries:
+        registry.cleanup()
+    return max(0, before - sum(registry.count for registry in registries))
+
+def reconcile_tasks(batch_size = 500):
+    '''mark tasks complete whose job finished, failed or expired without
+    _set_task_progress(100) running, e.g. because its worker crashed'''
+    closed = 0
+    last_id = ''
+    while True:
+        tasks = Task.query.filter(Task.complete == False,
+            Task.id > last_id).order_by(Task.id).limit(batch_size).all()
+        if not tasks:
+            return closed
+        last_id = tasks[-1].id
+        jobs = Job.fetch_many([task.id for task in tasks],
+            connection = current_app.redis)
+        for task, job in zip(tasks, jobs):
+            if job is None or job.get_status(refresh = False) in DONE:
+                task.complete = True
+                task.user.add_notification('task_progress',
+                    {'task_id': task.id, 'progress': 100})
+                closed += 1
+        db.session.commit()
+
+def purge_tasks(older_than, batch_size = 500):
+    '''delete complete tasks created before older_than, with whatever
+    RQ still keeps of their jobs'''
+    purged = 0
+    while True:
+        ids = [id for id, in db.session.query(Task.id).filter(
+            Task.complete == True, Task.timestamp < older_than).limit(
+                batch_size)]
+        if not ids:
+            return purged
+        try:
+            pipe = current_app.redis.pipeline(transaction = False)
+            for id in ids:
+                pipe.delete(Job.key_for(id), Job.dependents_key_for(id))
+            pipe.execute()
+        except RedisError:
+            pass # failed jobs expire after their failure_ttl anyway
+        Task.query.filter(Task.id.in_(ids)).delete(
+            synchronize_session = False)
+        db.session.commit()
+        purged += len(ids)
+
+def run(app, dry_run = False):
+    '''one janitor pass, returns {kind: count}. With dry_run only counts
+    the tasks that would be closed and purged'''
+    config = app.config
+    older_than = datetime.utcnow() - timedelta(
+        seconds = config['TASK_RETENTION'])
+    if dry_run:
+        return {
+            'open_tasks': Task.query.filter_by(complete = False).count(),
+            'tasks_to_purge': Task.query.filter(Task.complete == True,
+                Task.timestamp < older_than).count()
+        }
+    counts = {'rq_jobs': 0}
+    try:
+        for queue in app.task_queues.values():
+            counts['rq_jobs'] += clean_registries(queue)
+        counts['closed_tasks'] = reconcile_tasks(config['JANITOR_BATCH'])
+        counts['resubmitted_posts'] = sweep(app)
+    except RedisError:
+        app.logger.warning('Janitor can`t reach redis, tasks are left open')
+        counts.setdefault('closed_tasks', 0)
+        counts.setdefault('resubmitted_posts', 0)
+    counts['purged_tasks'] = purge_tasks(older_than, config['JANITOR_BATCH'])
+    janitor_cleaned(counts)
+    app.logger.info('Janitor: %s', counts)
+    return counts
@@ -0,0 +1,82 @@
+import json
+from datetime import date, datetime
+from flask import current_app
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+try:
+    import orjson
+except ImportError: # fall back to the stdlib encoder
+    orjson = None
+
+def _isoformat(value):
+    '''naive datetimes in the models are UTC, so mark them with "Z"'''
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.isoformat() + 'Z'
+    return value.isoformat()
+
+class JSONEncoder(FlaskJSONEncoder):
+    '''stdlib encoder that writes datetimes the same way orjson does'''
+    def default(self, o):
+        if isinstance(o, (datetime, date)):
+            return _isoformat(o)
+        return super(JSONEncoder, self).default(o)
+
+def _orjson_default(o):
+    '''called by orjson for types it can`t serialize natively'''
+    if hasattr(o, '__html__'): # Markup and lazy strings
+        return str(o.__html__())
+    return str(o)
+
+class JSONProvider(object):
+    '''pluggable JSON backend: orjson when it is installed and allowed
+    by JSON_PROVIDER config, the stdlib json module otherwise'''
+    def __init__(self, app = None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        choice = app.config.get('JSON_PROVIDER', 'auto')
+        if choice not in ('auto', 'orjson', 'json'):
+            raise ValueError('unknown JSON_PROVIDER {}'.format(choice))
+        if choice == 'orjson' and orjson is None:
+            raise RuntimeError('JSON_PROVIDER is orjson but it isn`t installed')
+        self.backend = 'orjson' if orjson is not None and choice != 'json' \
+            else 'json'
+        # flask.jsonify and the test client use the same datetime format
+        app.json_encoder = JSONEncoder
+        app.extensions['json_provider'] = self
+
+    def dumps(self, obj):
+        '''serialize obj into bytes'''
+        if self.backend == 'orjson':
+            return orjson.dumps(obj, default = _orjson_default,
+                option = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z |
+                    orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, cls = JSONEncoder, separators = (',', ':'),
+            ensure_ascii = False).encode('utf-8')
+
+    def loads(self, s):
+        if self.backend == 'orjson':
+            return orjson.loads(s)
+        return json.loads(s)
+
+    def response(self, *args, **kwargs):
+        '''same call signature as flask.jsonify'''
+        if args and kwargs:
+            raise TypeError('response() behavior undefined when passed both '
+                'args and kwargs')
+        elif len(args) == 1:
+            data = args[0]
+        else:
+            data = args or kwargs
+        return current_app.response_class(self.dumps(data) + b'\n',
+            mimetype = current_app.config['JSONIFY_MIMETYPE'])
+
+def jsonify(*args, **kwargs):
+    '''drop-in replacement for flask.jsonify that uses the app`s provider'''
+    provider = current_app.extensions.get('json_provider')
+    if provider is None:
+        from flask import jsonify as flask_jsonify
+        return flask_jsonify(*args, **kwargs)
+    return provider.response(*args, **kwargs)
@@ -1,24 +1,36 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from hashlib import md5
+import json
 from flask import render_template, flash, redirect, url_for, request, g, \
-    jsonify, current_app
+    current_app, make_response
+from flask_wtf.csrf import generate_csrf
 from flask_login import current_user, login_required
 from flask_babel import _, get_locale
 from app import db
 from app.main.forms import EditProfileForm, EmptyForm, PostForm, SearchForm, \
     MessageForm
-from app.models import User, Post, Message, Notification
+from app.models import User, Post, ArchivedPost, Notification, Conversation
+from app.partitions import paginate
 from app.translate import translate
+from app.trends import trending
+from app.pipeline import submit_posts
+from app import timelines
+from app.json_provider import jsonify
 from app.main import bp
-from langdetect import detect #language detection
-#from textblob import TextBlob #analogue to google`s langdetect
 
 @bp.before_app_request
 def before_request():
     '''to do before executing user request'''
+    if request.endpoint in ('static', 'assets'):
+        return
     if current_user.is_authenticated:
-        current_user.last_seen =  datetime.utcnow()
-        db.session.commit()
+        # one write per LAST_SEEN_INTERVAL instead of one per request
+        now = datetime.utcnow()
+        if current_user.last_seen is None or (now - current_user.last_seen) \
+                .total_seconds() >= current_app.config['LAST_SEEN_INTERVAL']:
+            current_user.last_seen = now
+            db.session.commit()
         g.search_form = SearchForm()
     g.locale = str(get_locale())
 
@@ -29,47 +41,61 @@ def index():
     form = PostForm()
 
     if form.validate_on_submit(): #add new posts
-        try:
-            language = detect(form.post.data)
-            #language = TextBlob(form.post.data).detect_language()
-        except: #except TranslatorError:
-            language = ''
-
-        post = Post(body = form.post.data, author = current_user, 
-            language = language)
+        # language, search, timelines, trends and mentions are done by
+        # app/pipeline.py
+        post = Post(body = form.post.data, author = current_user)
         db.session.add(post)
         db.session.commit()
+        # the author`s timeline is rebuilt with the post on the redirect
+        timelines.invalidate(current_user.id)
+        submit_posts(current_app._get_current_object(), [post])
         flash(_('Your post has been uploaded.'))
         return redirect(url_for('main.index'))
 
     page = request.args.get('page', 1, type = int) #paginate messages to show
+    per_page = current_app.config['POSTS_PER_PAGE']
+
+    timeline = timelines.page(current_user, page, per_page)
+    if timeline is not None:
+        ids, has_next = timeline
+        # cached ids of posts moved to the archive since are found there
+        items = Post.hydrate(ids)
+    else:
+        items, has_next = paginate(current_user.followed_posts(),
+            current_user.followed_posts(ArchivedPost), page, per_page)
 
-    posts = current_user.followed_posts().paginate(
-        page, current_app.config['POSTS_PER_PAGE'], False )
+    next_url = url_for('main.index', page = page + 1) if has_next else None
+    prev_url = url_for('main.index', page = page - 1) if page > 1 else None
 
-    next_url = url_for('main.index', page = posts.next_num) if posts.has_next \
-        else None
-    prev_url = url_for('main.index', page = posts.prev_num) if posts.has_prev \
-        else None
+    # precomputed by app/suggestions.py, no graph queries here
+    suggestions = current_user.suggestions()
 
     return render_template('index.html', title = _('Home'), form = form, 
-        posts = posts.items, next_url = next_url, prev_url = prev_url)
+        posts = items, next_url = next_url, prev_url = prev_url,
+        suggestions = suggestions)
 
 @bp.route('/explore')
 @login_required
 def explore():
     '''Shows posts of every user in blog'''
     page = request.args.get('page', 1, type = int)
-    posts = Post.query.order_by(Post.timestamp.desc()).paginate( page, 
-        current_app.config['POSTS_PER_PAGE'], False )
+    posts, has_next = paginate(Post.query.order_by(Post.timestamp.desc()),
+        ArchivedPost.query.order_by(ArchivedPost.timestamp.desc()), page,
+        current_app.config['POSTS_PER_PAGE'])
 
-    next_url = url_for('main.explore', page = posts.next_num) if posts.has_next \
-        else None
-    prev_url = url_for('main.explore', page = posts.prev_num) if posts.has_prev \
-        else None
+    next_url = url_for('main.explore', page = page + 1) if has_next else None
+    prev_url = url_for('main.explore', page = page - 1) if page > 1 else None
 
     return render_template('index.html', title = _('Explore'), 
-        posts = posts.items, next_url = next_url, prev_url = prev_url)
+        posts = posts, next_url = next_url, prev_url = prev_url)
+
+@bp.route('/explore/trending')
+@login_required
+def explore_trending():
+    '''terms and posts trending over the last TRENDS_WINDOWS windows'''
+    terms, posts = trending(current_app.config['POSTS_PER_PAGE'])
+    return render_template('trending.html', title = _('Trending'),
+        terms = terms, posts = [post for post, score in posts])
 
 @bp.route('/user/<username>') # <..> has dynamic content inside
 @login_required
@@ -77,26 +103,62 @@ def user(username):
     '''profile page'''
     user = User.query.filter_by(username = username).first_or_404()
     page = request.args.get('page', 1, type = int)
-    posts = user.posts.order_by(Post.timestamp.desc()).paginate(page,
-        current_app.config['POSTS_PER_PAGE'], False)
+    posts, has_next = paginate(user.posts.order_by(Post.timestamp.desc()),
+        ArchivedPost.query.filter_by(user_id = user.id).order_by(
+            ArchivedPost.timestamp.desc()), page,
+        current_app.config['POSTS_PER_PAGE'])
 
-    next_url = url_for('main.user', username = user.username, page = posts.next_num) \
-        if posts.has_next else None
+    next_url = url_for('main.user', username = user.username, page = page + 1) \
+        if has_next else None
     
-    prev_url = url_for('main.user', username = user.username, page = posts.prev_num) \
-        if posts.has_prev else None
+    prev_url = url_for('main.user', username = user.username, page = page - 1) \
+        if page > 1 else None
 
     form = EmptyForm()
 
-    return render_template('user.html', user = user, posts = posts.items,
+    return render_template('user.html', user = user, posts = posts,
         next_url = next_url, prev_url = prev_url, form = form)
 
 @bp.route('/user/<username>/popup')
 @login_required
 def user_popup(username):
+    '''the part of the hover popup that is the same for every viewer.
+    Browsers keep it for USER_POPUP_MAX_AGE, then revalidate it with the
+    ETag. The follow button comes from follow_state()'''
     user = User.query.filter_by(username = username).first_or_404()
-    form = EmptyForm()
-    return render_template('user_popup.html', user = user, form = form)
+    counts = User.get_counts([user.id])[user.id]
+    etag = md5(json.dumps([user.username, user.email, user.about_me,
+        user.last_seen and user.last_seen.isoformat(), counts, g.locale],
+        sort_keys = True).encode('utf-8')).hexdigest()
+    if etag in request.if_none_match:
+        response = current_app.response_class(status = 304)
+    else:
+        response = make_response(render_template('user_popup.html',
+            user = user, counts = counts))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['USER_POPUP_MAX_AGE']
+    response.vary.add('Accept-Language')
+    return response
+
+@bp.route('/user/<username>/follow_state')
+@login_required
+def follow_state(username):
+    '''the viewer`s part of the popup: the follow/unfollow form'''
+    user = User.query.filter_by(username = username).first_or_404()
+    state = {'self': user == current_user}
+    if not state['self']:
+        following = current_user.is_following(user)
+        state.update({
+            'following': following,
+            'url': url_for('main.unfollow' if following else 'main.follow',
+                username = user.username),
+            'label': _('Unfollow') if following else _('Follow'),
+            'csrf_token': generate_csrf()
+        })
+    response = jsonify(state)
+    response.cache_control.no_store = True
+    return response
 
 @bp.route('/edit_profile', methods = ['GET', 'POST'])
 @login_required
@@ -129,6 +191,7 @@ def follow(username):
             return redirect(url_for('main.user', username = username))
         current_user.follow(user)
         db.session.commit()
+        timelines.invalidate(current_user.id)
         flash(_('You are following %(username)s!', username = username))
         return redirect(url_for('main.user', username = username))
     else:
@@ -148,6 +211,7 @@ def unfollow(username):
             return redirect(url_for('main.user', username = username))
         current_user.unfollow(user)
         db.session.commit()
+        timelines.invalidate(current_user.id)
         flash(_('You are not following %(username)s anymore.', 
             username = username))
         return redirect(url_for('main.user', username = username))
@@ -195,45 +259,74 @@ def send_message(recipient):
     user = User.query.filter_by(username=recipient).first_or_404()
     form = MessageForm()
     if form.validate_on_submit():
-        msg = Message(author = current_user, recipient = user,
-            body = form.message.data)
-        db.session.add(msg)
+        current_user.send_message(user, form.message.data)
         user.add_notification('unread_message_count', user.new_messages())
         db.session.commit()
         flash(_('Your message has been sent.'))
-        return redirect(url_for('main.user', username = recipient))
+        return redirect(url_for('main.conversation', username = recipient))
     return render_template('send_message.html', title = _('Send Message'), 
         recipient = recipient, form = form)
 
 @bp.route('/messages')
 @login_required
 def messages():
-    '''show and paginate private messages'''
+    '''inbox: one row per conversation, most recent first'''
     current_user.last_message_read_time = datetime.utcnow()
     current_user.add_notification('unread_message_count', 0)
     db.session.commit()
     page = request.args.get('page', 1, type = int)
-    messages = current_user.messages_received.order_by( 
-        Message.timestamp.desc()).paginate(
-            page, current_app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('main.messages', page = messages.next_num) \
-        if messages.has_next else None
-    prev_url = url_for('main.messages', page = messages.prev_num) \
-        if messages.has_prev else None
-    return render_template('messages.html', messages = messages.items, 
-        next_url = next_url, prev_url = prev_url)
+    conversations = current_user.inbox().paginate(
+        page, current_app.config['POSTS_PER_PAGE'], False)
+    next_url = url_for('main.messages', page = conversations.next_num) \
+        if conversations.has_next else None
+    prev_url = url_for('main.messages', page = conversations.prev_num) \
+        if conversations.has_prev else None
+    return render_template('messages.html', title = _('Messages'),
+        conversations = conversations.items, next_url = next_url,
+        prev_url = prev_url)
+
+@bp.route('/messages/<username>')
+@login_required
+def conversation(username):
+    '''messages with one user, newest first. ?before=<timestamp> and
+    ?before_id=<id> page back from the oldest message shown'''
+    user = User.query.filter_by(username = username).first_or_404()
+    conversation = Conversation.between(current_user, user, create = False)
+    before = request.args.get('before')
+    try:
+        before = datetime.strptime(before, '%Y-%m-%dT%H:%M:%S.%f') \
+            if before else None
+    except ValueError:
+        before = None
+    per_page = current_app.config['POSTS_PER_PAGE']
+    messages = []
+    if conversation is not None:
+        participant = conversation.participants.filter_by(
+            user_id = current_user.id).first()
+        if participant.unread:
+            participant.unread = 0
+            db.session.commit()
+        messages = conversation.page(before, per_page + 1,
+            request.args.get('before_id', type = int))
+    next_url = url_for('main.conversation', username = username,
+        before = messages[per_page - 1].timestamp.strftime(
+            '%Y-%m-%dT%H:%M:%S.%f'), before_id = messages[per_page - 1].id) \
+        if len(messages) > per_page else None
+    return render_template('conversation.html', title = _('Messages'),
+        user = user, messages = messages[:per_page], next_url = next_url)
 
 @bp.route('/notifications')
 @login_required
 def notifications():
-    '''show new notiifcations since the defined moment of time'''
-    since = request.args.get('since', 0.0, type = float)
-    notifications = current_user.notifications.filter( Notification.timestamp \
-        > since).order_by(Notification.timestamp.asc())
+    '''show notifications updated since the version the page last saw'''
+    since = request.args.get('since', 0, type = int)
+    notifications = current_user.notifications.filter(Notification.version \
+        > since).order_by(Notification.version.asc())
     return jsonify([{
             'name': n.name,
             'data': n.get_data(),
-            'timestamp': n.timestamp
+            'timestamp': n.timestamp,
+            'version': n.version
             } for n in notifications])
 
 @bp.route('/export_posts')
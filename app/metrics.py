@@ -0,0 +1,151 @@
+import os
+import time
+from contextlib import contextmanager
+from flask import Response, abort, current_app, g, request
+from redis.exceptions import RedisError
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+    from prometheus_client.core import GaugeMetricFamily
+    from prometheus_client.multiprocess import MultiProcessCollector, \
+        mark_process_dead
+except ImportError: # metrics are disabled
+    prometheus_client = None
+
+def multiprocess_mode():
+    '''gunicorn and rq workers write their samples to files in this
+    directory, /metrics adds them up'''
+    return 'prometheus_multiproc_dir' in os.environ
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = Histogram('microblog_request_duration_seconds',
+        'Request latency by endpoint', ['endpoint', 'method'])
+    REQUESTS = Counter('microblog_requests_total',
+        'Requests by endpoint and status', ['endpoint', 'method', 'status'])
+    IN_FLIGHT = Gauge('microblog_requests_in_flight',
+        'Requests being handled', multiprocess_mode = 'livesum')
+    DB_QUERIES = Histogram('microblog_db_queries_per_request',
+        'SQL queries per request', ['endpoint'],
+        buckets = (1, 2, 5, 10, 20, 50, 100, float('inf')))
+    DB_TIME = Histogram('microblog_db_seconds_per_request',
+        'Time spent in SQL per request', ['endpoint'])
+    EXTERNAL_LATENCY = Histogram('microblog_external_call_seconds',
+        'Elasticsearch, redis and translator calls', ['service', 'operation'])
+    TASK_DURATION = Histogram('microblog_task_duration_seconds',
+        'Background task run time', ['task'],
+        buckets = (1, 5, 15, 30, 60, 120, 300, 600, 1800, float('inf')))
+    CACHE_REQUESTS = Counter('microblog_cache_requests_total',
+        'Cache lookups by result', ['cache', 'result'])
+    JANITOR_CLEANED = Counter('microblog_janitor_cleaned_total',
+        'Tasks and RQ jobs fixed or removed by the janitor', ['kind'])
+
+    class QueueDepthCollector(object):
+        '''RQ queue length, read from redis at scrape time'''
+        def __init__(self, app):
+            self.app = app
+
+        def collect(self):
+            depth = GaugeMetricFamily('microblog_rq_queue_depth',
+                'Jobs waiting in RQ queues', labels = ['queue'])
+            try:
+                for queue in self.app.task_queues.values():
+                    depth.add_metric([queue.name], len(queue))
+            except RedisError:
+                pass
+            yield depth
+
+@contextmanager
+def observe(service, operation):
+    '''time a call to an external service'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if prometheus_client is not None:
+            EXTERNAL_LATENCY.labels(service, operation).observe(
+                time.perf_counter() - start)
+
+@contextmanager
+def task_timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if prometheus_client is not None:
+            TASK_DURATION.labels(name).observe(time.perf_counter() - start)
+
+def cache_lookups(cache, hits, misses):
+    if prometheus_client is not None:
+        if hits:
+            CACHE_REQUESTS.labels(cache, 'hit').inc(hits)
+        if misses:
+            CACHE_REQUESTS.labels(cache, 'miss').inc(misses)
+
+def janitor_cleaned(counts):
+    if prometheus_client is not None:
+        for kind, count in counts.items():
+            if count:
+                JANITOR_CLEANED.labels(kind).inc(count)
+
+def worker_exit(pid):
+    '''call from gunicorn`s child_exit so dead workers` gauges go away'''
+    if prometheus_client is not None and multiprocess_mode():
+        mark_process_dead(pid)
+
+class Metrics(object):
+    '''request metrics and the /metrics endpoint'''
+    def __init__(self, app = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_TOKEN', None)
+        if prometheus_client is None or not app.config['METRICS_ENABLED']:
+            return
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def before_request(self):
+        if request.endpoint != 'metrics':
+            g.metrics_start = time.perf_counter()
+            IN_FLIGHT.inc()
+
+    def after_request(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(
+            time.perf_counter() - start)
+        REQUESTS.labels(endpoint, request.method,
+            str(response.status_code)).inc()
+        stats = g.get('sql_stats')
+        if stats is not None:
+            DB_QUERIES.labels(endpoint).observe(stats.count)
+            DB_TIME.labels(endpoint).observe(stats.duration)
+        return response
+
+    def teardown_request(self, exc = None):
+        if g.pop('metrics_start', None) is not None:
+            IN_FLIGHT.dec()
+
+    def metrics_view(self):
+        token = current_app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != \
+                'Bearer ' + token:
+            abort(403)
+        extra = prometheus_client.CollectorRegistry()
+        extra.register(QueueDepthCollector(current_app._get_current_object()))
+        if multiprocess_mode():
+            registry = prometheus_client.CollectorRegistry()
+            MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        data = prometheus_client.generate_latest(registry) + \
+            prometheus_client.generate_latest(extra)
+        return Response(data,
+            content_type = prometheus_client.CONTENT_TYPE_LATEST)
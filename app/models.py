@@ -6,7 +6,9 @@ from time import time
 import jwt
 from flask import current_app, url_for
 from app import db, login
-from app.search import add_to_index, remove_from_index, query_index
+from app.search import add_to_index, bulk_index, remove_from_index, query_index
+from app.metrics import observe
+from app.queues import enqueue
 import json
 from time import time
 import redis
@@ -18,17 +20,23 @@ import os
 # @classmethod is assigned to class and 
 # can use class properties within method code
 class SearchableMixin(object):
+	__search_async__ = False
+
 	@classmethod
 	def search(cls, expression, page, per_page):
-		ids, total = query_index(cls.__tablename__, expression, page, 
+		'''(objects in relevance order, total)'''
+		ids, total = query_index(cls.__search_index__, expression, page,
 			per_page)
 		if total == 0:
-			return cls.query.filter_by(id = 0), 0
-		when = []
-		for i in range(len(ids)):
-			when.append((ids[i], i))
-		return cls.query.filter(cls.id.in_(ids)).order_by(
-			db.case(when, value = cls.id)), total
+			return [], 0
+		return cls.hydrate(ids), total
+
+	@classmethod
+	def hydrate(cls, ids):
+		'''the objects of ids in that order, missing ones skipped'''
+		found = dict((obj.id, obj) for obj in
+			cls.query.filter(cls.id.in_(ids)))
+		return [found[id] for id in ids if id in found]
 
 	@classmethod
 	def before_commit(cls, session):
@@ -41,21 +49,30 @@ class SearchableMixin(object):
 	@classmethod
 	def after_commit(cls, session):
 		'''apply session changes to ElasticSearch'''
-		for obj in session._changes['add']:
-			if isinstance(obj, SearchableMixin):
-				add_to_index(obj.__tablename__, obj)
-		for obj in session._changes['update']:
-			if isinstance(obj, SearchableMixin):
-				add_to_index(obj.__tablename__, obj)
+		for obj in session._changes['add'] + session._changes['update']:
+			# __search_async__ models are indexed by app/pipeline.py
+			if isinstance(obj, SearchableMixin) and \
+					not obj.__search_async__:
+				add_to_index(obj.__search_index__, obj)
 		for obj in session._changes['delete']:
 			if isinstance(obj, SearchableMixin):
-				remove_from_index(obj.__tablename__, obj)
+				remove_from_index(obj.__search_index__, obj)
 		session._changes = None
 
 	@classmethod
-	def reindex(cls):
-		for obj in cls.query:
-			add_to_index(cls.__tablename__, obj)
+	def reindex(cls, chunk = 1000):
+		'''index every row, one bulk request per chunk. Returns the
+		number of indexed rows'''
+		indexed = 0
+		last_id = 0
+		while current_app.elasticsearch:
+			objs = cls.query.filter(cls.id > last_id).order_by(
+				cls.id).limit(chunk).all()
+			if not objs:
+				break
+			indexed += bulk_index(cls.__search_index__, objs)
+			last_id = objs[-1].id
+		return indexed
 
 # SQLAlchemy events listener function registration for the given target
 # listen(<target>, <identifier>, <method>)
@@ -64,11 +81,16 @@ db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
 
 class PaginatedAPIMixin(object):
 	@staticmethod
-	def to_collection_dict(query, page, per_page, endpoint, **kwargs):
-		'''collect info about each page content for api'''
+	def to_collection_dict(query, page, per_page, endpoint, fields = None,
+			**kwargs):
+		'''collect info about each page content for api. fields is a set
+		of field names passed on to each item`s to_dict()'''
 		resources = query.paginate(page, per_page, False)
+		if fields is not None:
+			# keep the sparse fieldset in the pagination links
+			kwargs['fields'] = ','.join(sorted(fields))
 		data = {
-			'items': [item.to_dict() for item in resources.items],
+			'items': [item.to_dict(fields = fields) for item in resources.items],
 			'_meta': {
 				'page': page,
 				'per_page': per_page,
@@ -90,7 +112,13 @@ class PaginatedAPIMixin(object):
 followers = db.Table(
 	'followers',
 	db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-	db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+	db.Column('followed_id', db.Integer, db.ForeignKey('user.id')),
+	# is_following/followed_posts look up by follower, followers lists
+	# and counts by followed
+	db.Index('ix_followers_follower_id_followed_id', 'follower_id',
+		'followed_id', unique = True),
+	db.Index('ix_followers_followed_id_follower_id', 'followed_id',
+		'follower_id')
 )
 
 class User(PaginatedAPIMixin, UserMixin, db.Model):
@@ -145,9 +173,19 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 	token = db.Column(db.String(32), index = True, unique = True)
 	token_expiration = db.Column(db.DateTime)
 
+	# when app/suggestions.py last computed the user`s suggestions, None
+	# after the user follows or unfollows someone
+	suggested_at = db.Column(db.DateTime, index = True)
+
+	# _post.html shows these (username and the email`s avatar), changing
+	# them invalidates the user`s cached post fragments
+	__fragment_fields__ = ['username', 'email']
+
+	# updated on every request, a replica may lag behind on it
+	__replica_lag_ok__ = ['last_seen']
+
 	def launch_task(self, name, description, *args, **kwargs):
-		rq_job = current_app.task_queue.enqueue('app.tasks.' + name, self.id,
-			*args, **kwargs)
+		rq_job = enqueue(current_app, name, self.id, *args, **kwargs)
 		task = Task(id = rq_job.get_id(), name = name, description = description,
 			user = self)
 		db.session.add(task)
@@ -177,23 +215,36 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 	def follow(self, user):
 		if not self.is_following(user):
 			self.followed.append(user)
+			self.suggested_at = None
+			Suggestion.query.filter_by(user_id = self.id,
+				suggested_id = user.id).delete()
 
 	def unfollow(self, user):
 		if self.is_following(user):
 			self.followed.remove(user)
+			self.suggested_at = None
+
+	def suggestions(self, limit = 5):
+		'''precomputed accounts to follow, best first'''
+		return User.query.join(Suggestion,
+			Suggestion.suggested_id == User.id).filter(
+				Suggestion.user_id == self.id).order_by(
+					Suggestion.score.desc()).limit(limit).all()
 
 	def is_following(self, user):
 		return self.followed.filter( 
 			followers.c.followed_id == user.id ).count() > 0
 
-	def followed_posts(self):
-		'''show posts of user`s followings and his/her own, too'''
-		followed =  Post.query.join(
-			followers, (followers.c.followed_id == Post.user_id)).filter(
+	def followed_posts(self, model = None):
+		'''show posts of user`s followings and his/her own, too. model is
+		Post (the hot tier, default) or ArchivedPost'''
+		model = model or Post
+		followed =  model.query.join(
+			followers, (followers.c.followed_id == model.user_id)).filter(
 				followers.c.follower_id == self.id)
 
-		own = Post.query.filter_by(user_id = self.id)
-		return followed.union(own).order_by(Post.timestamp.desc())
+		own = model.query.filter_by(user_id = self.id)
+		return followed.union(own).order_by(model.timestamp.desc())
 
 	def get_reset_password_token(self, expires_in = 600):
 		'''get jwt token to reset pass'''
@@ -203,6 +254,22 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 			algorithm = 'HS256'
 		).decode('utf-8')
 
+	def send_message(self, recipient, body):
+		conversation = Conversation.between(self, recipient)
+		message = Message(author = self, recipient = recipient, body = body,
+			conversation = conversation, timestamp = datetime.utcnow())
+		db.session.add(message)
+		conversation.add_message(message)
+		return message
+
+	def inbox(self):
+		'''conversations, most recent first, with the other user and the
+		last message loaded'''
+		return Participant.query.filter_by(user_id = self.id).options(
+			db.joinedload(Participant.other),
+			db.joinedload(Participant.last_message)).order_by(
+				Participant.timestamp.desc())
+
 	def new_messages(self):
 		'''define unread messages by the last read time and return 
 		their amount'''
@@ -212,10 +279,7 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 
 	def add_notification(self, name, data):
 		'''add new notification and upgrade one with same name'''
-		self.notifications.filter_by(name = name).delete()
-		n = Notification(name=name, payload_json=json.dumps(data), user=self)
-		db.session.add(n)
-		return n
+		Notification.upsert(self.id, name, data)
 
 	@staticmethod
 	def verify_reset_password_token(token):
@@ -229,23 +293,69 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 			return
 		return User.query.get(id)
 
-	def to_dict(self, include_email = False):
-		'''convert data for api into dict {}'''
-		data = {
-			'id': self.id,
-			'username': self.username,
-			'last_seen': self.last_seen.isoformat() + 'Z',
-			'about_me': self.about_me,
-			'post_count': self.posts.count(),
-			'follower_count': self.followers.count(),
-			'followed_count': self.followed.count(),
-			'_links': {
+	def post_count(self):
+		'''posts in both tiers'''
+		return self.posts.count() + ArchivedPost.query.filter_by(
+			user_id = self.id).count()
+
+	@staticmethod
+	def get_counts(ids):
+		'''post, follower and followed counts for many users at once:
+		three GROUP BY queries instead of three COUNTs per user'''
+		counts = dict((id, {'post_count': 0, 'follower_count': 0,
+			'followed_count': 0}) for id in ids)
+		if not counts:
+			return counts
+		queries = [
+			('post_count', Post.user_id, Post.id),
+			('post_count', ArchivedPost.user_id, ArchivedPost.id),
+			('follower_count', followers.c.followed_id,
+				followers.c.follower_id),
+			('followed_count', followers.c.follower_id,
+				followers.c.followed_id)
+		]
+		for field, key, column in queries:
+			rows = db.session.query(key, db.func.count(column)).filter(
+				key.in_(counts.keys())).group_by(key)
+			for id, count in rows:
+				counts[id][field] += count
+		return counts
+
+	# fields of to_dict() and what each one costs:
+	#   id, username, last_seen, about_me - columns, free
+	#   post_count, follower_count, followed_count - one COUNT query each
+	#   _links - three url_for() builds and an md5 for the avatar
+	# id is always returned
+	API_FIELDS = ['id', 'username', 'last_seen', 'about_me', 'post_count',
+		'follower_count', 'followed_count', '_links']
+	COUNT_FIELDS = ['post_count', 'follower_count', 'followed_count']
+
+	def to_dict(self, include_email = False, counts = None, fields = None):
+		'''convert data for api into dict {}. counts comes from
+		User.get_counts() when serializing many users. fields limits the
+		output to a subset of API_FIELDS so the expensive ones are skipped'''
+		if fields is None:
+			fields = User.API_FIELDS
+		data = {'id': self.id}
+		for field in ['username', 'last_seen', 'about_me']:
+			if field in fields:
+				data[field] = getattr(self, field)
+		relationships = {
+			'post_count': self.post_count,
+			'follower_count': self.followers.count,
+			'followed_count': self.followed.count
+		}
+		for field in User.COUNT_FIELDS:
+			if field in fields:
+				data[field] = counts[field] if counts is not None \
+					else relationships[field]()
+		if '_links' in fields:
+			data['_links'] = {
 				'self': url_for('api.get_user', id = self.id),
 				'followers': url_for('api.get_followers', id = self.id),
 				'followed': url_for('api.get_followed', id = self.id),
 				'avatar': self.avatar(128)
 			}
-		}
 		if include_email:
 			data['email'] = self.email
 		return data
@@ -277,19 +387,109 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 			return None
 		return user
 
+	@staticmethod
+	def after_flush(session, context):
+		'''remember users whose cached post fragments are now stale'''
+		for obj in session.dirty:
+			if isinstance(obj, User):
+				state = db.inspect(obj)
+				if any(state.attrs[field].history.has_changes()
+						for field in User.__fragment_fields__):
+					session.info.setdefault('fragment_authors', set()).add(
+						obj.id)
+
+	@staticmethod
+	def after_commit(session):
+		ids = session.info.pop('fragment_authors', None)
+		cache = current_app.extensions.get('fragment_cache')
+		if ids and cache is not None:
+			cache.invalidate_authors(ids)
+
+	@staticmethod
+	def after_rollback(session):
+		session.info.pop('fragment_authors', None)
+
+db.event.listen(db.session, 'after_flush', User.after_flush)
+db.event.listen(db.session, 'after_commit', User.after_commit)
+db.event.listen(db.session, 'after_rollback', User.after_rollback)
+
 class Post(SearchableMixin, db.Model):
 	"""posts table"""
 	__searchable__ = ['body'] # this field will be indexed
+	__search_index__ = 'post'
+	__search_async__ = True
 
 	id = db.Column(db.Integer, primary_key = True)
 	body = db.Column(db.String(140))
 	timestamp = db.Column(db.DateTime, index = True, default = datetime.utcnow)
 	user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 	language = db.Column(db.String(5))
+	# a bit per finished stage of app/pipeline.py
+	pipeline = db.Column(db.Integer, default = 0)
+
+	__table_args__ = (
+		# a user`s timeline, newest first
+		db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),
+		# the janitor`s sweep for unfinished posts
+		db.Index('ix_post_pipeline_timestamp', 'pipeline', 'timestamp')
+	)
 
 	def __repr__(self):
 		return '< Post '"{}"'>'.format(self.body)
 
+	def to_dict(self):
+		return {
+			'id': self.id,
+			'body': self.body,
+			'timestamp': self.timestamp,
+			'language': self.language,
+			'user_id': self.user_id,
+			'_links': {
+				'author': url_for('api.get_user', id = self.user_id)
+			}
+		}
+
+	@classmethod
+	def hydrate(cls, ids):
+		'''search hits can be in either tier'''
+		posts = super(Post, cls).hydrate(ids)
+		if len(posts) < len(ids):
+			found = dict((post.id, post) for post in posts)
+			found.update((post.id, post) for post in
+				ArchivedPost.hydrate([id for id in ids if id not in found]))
+			posts = [found[id] for id in ids if id in found]
+		return posts
+
+class ArchivedPost(SearchableMixin, db.Model):
+	'''the cold tier: posts older than POST_HOT_DAYS, moved out of post
+	by app/partitions.py with their ids, so links and search documents
+	stay valid. Partitioned by month on Postgres and MySQL, which is why
+	user_id has no foreign key (MySQL has none on partitioned tables)'''
+	__tablename__ = 'post_archive'
+	__searchable__ = ['body']
+	__search_index__ = 'post'
+	__search_async__ = True
+
+	id = db.Column(db.Integer, primary_key = True, autoincrement = False)
+	body = db.Column(db.String(140))
+	timestamp = db.Column(db.DateTime, index = True, nullable = False)
+	user_id = db.Column(db.Integer)
+	language = db.Column(db.String(5))
+	pipeline = db.Column(db.Integer)
+
+	author = db.relationship('User',
+		primaryjoin = 'foreign(ArchivedPost.user_id) == User.id')
+
+	__table_args__ = (
+		db.Index('ix_post_archive_user_id_timestamp', 'user_id',
+			'timestamp'),
+	)
+
+	def __repr__(self):
+		return '<ArchivedPost {}>'.format(self.body)
+
+	to_dict = Post.to_dict
+
 class Message(db.Model):
 	'''private messages table'''
 	__tablename__ = 'messages'
@@ -299,10 +499,101 @@ class Message(db.Model):
 	recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 	body = db.Column(db.String(280))
 	timestamp = db.Column(db.DateTime, index = True, default = datetime.utcnow)
+	conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'))
+
+	# new_messages, and the pages of a conversation
+	__table_args__ = (
+		db.Index('ix_messages_recipient_id_timestamp', 'recipient_id',
+			'timestamp'),
+		db.Index('ix_messages_conversation_id_timestamp', 'conversation_id',
+			'timestamp')
+	)
 
 	def __repr__(self):
 		return '<Message {}>'.format(self.body)
 
+class Conversation(db.Model):
+	'''private messages between two users, user1_id < user2_id'''
+	__tablename__ = 'conversations'
+
+	id = db.Column(db.Integer, primary_key = True)
+	user1_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+	user2_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+	messages = db.relationship('Message', backref = 'conversation',
+		lazy = 'dynamic')
+	participants = db.relationship('Participant', backref = 'conversation',
+		lazy = 'dynamic')
+
+	__table_args__ = (db.Index('ix_conversations_user1_id_user2_id',
+		'user1_id', 'user2_id', unique = True),)
+
+	@staticmethod
+	def between(user, other, create = True):
+		'''the conversation of two users, created with both inbox rows
+		on the first message. Notes to oneself get a single inbox row'''
+		user1_id, user2_id = sorted([user.id, other.id])
+		conversation = Conversation.query.filter_by(user1_id = user1_id,
+			user2_id = user2_id).first()
+		if conversation is None and create:
+			conversation = Conversation(user1_id = user1_id,
+				user2_id = user2_id)
+			db.session.add(conversation)
+			db.session.add(Participant(conversation = conversation,
+				user = user, other = other, unread = 0))
+			if user.id != other.id:
+				db.session.add(Participant(conversation = conversation,
+					user = other, other = user, unread = 0))
+			db.session.flush()
+		return conversation
+
+	def add_message(self, message):
+		'''update the inbox rows, the recipient has one more unread
+		unless they wrote it themselves'''
+		for participant in self.participants:
+			participant.last_message = message
+			participant.timestamp = message.timestamp
+			if participant.user_id == message.recipient_id and \
+					message.sender_id != message.recipient_id:
+				participant.unread = Participant.unread + 1
+
+	def page(self, before = None, per_page = 25, before_id = None):
+		'''messages older than the (before, before_id) cursor, newest
+		first. Seeks on the (conversation_id, timestamp) index instead of
+		OFFSET, the id breaks ties between messages of the same time'''
+		query = self.messages
+		if before is not None:
+			if before_id is None:
+				query = query.filter(Message.timestamp < before)
+			else:
+				query = query.filter(db.or_(Message.timestamp < before,
+					db.and_(Message.timestamp == before,
+						Message.id < before_id)))
+		return query.order_by(Message.timestamp.desc(),
+			Message.id.desc()).limit(per_page).all()
+
+class Participant(db.Model):
+	'''one inbox row per user and conversation: the other user, the last
+	message and how many are unread'''
+	__tablename__ = 'participants'
+
+	conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'),
+		primary_key = True)
+	user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+		primary_key = True)
+	other_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+	last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id'))
+	timestamp = db.Column(db.DateTime, default = datetime.utcnow)
+	unread = db.Column(db.Integer, default = 0)
+
+	user = db.relationship('User', foreign_keys = [user_id])
+	other = db.relationship('User', foreign_keys = [other_id])
+	last_message = db.relationship('Message')
+
+	# the inbox, most recent conversation first
+	__table_args__ = (db.Index('ix_participants_user_id_timestamp',
+		'user_id', 'timestamp'),)
+
 class Notification(db.Model):
 	__tablename__ = 'notifications'
 
@@ -311,10 +602,76 @@ class Notification(db.Model):
 	user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 	timestamp = db.Column(db.DateTime, index = True, default = datetime.utcnow)
 	payload_json = db.Column(db.Text)
+	# grows on every update, clients poll for versions above the last seen
+	version = db.Column(db.BigInteger, default = 0)
+
+	__table_args__ = (
+		db.Index('ix_notifications_user_id_name', 'user_id', 'name',
+			unique = True),
+		db.Index('ix_notifications_user_id_version', 'user_id', 'version')
+	)
 
 	def get_data(self):
 		return json.loads(str(self.payload_json))
 
+	@staticmethod
+	def upsert(user_id, name, data):
+		'''insert or update the (user_id, name) notification in one
+		statement. The version is the time in microseconds, or one more
+		than the previous version if the clock is behind it'''
+		table = Notification.__table__
+		version = int(time() * 1000000)
+		values = {'user_id': user_id, 'name': name,
+			'payload_json': json.dumps(data), 'timestamp': datetime.utcnow(),
+			'version': version}
+		dialect = db.engine.dialect.name
+		if dialect == 'postgresql':
+			from sqlalchemy.dialects.postgresql import insert
+			statement = insert(table).values(**values)
+			statement = statement.on_conflict_do_update(
+				index_elements = ['user_id', 'name'], set_ = {
+					'payload_json': statement.excluded.payload_json,
+					'timestamp': statement.excluded.timestamp,
+					'version': db.func.greatest(table.c.version + 1,
+						statement.excluded.version)})
+		elif dialect == 'mysql':
+			from sqlalchemy.dialects.mysql import insert
+			statement = insert(table).values(**values)
+			statement = statement.on_duplicate_key_update(
+				payload_json = statement.inserted.payload_json,
+				timestamp = statement.inserted.timestamp,
+				version = db.func.greatest(table.c.version + 1,
+					statement.inserted.version))
+		else:
+			# SQLAlchemy 1.3 has no ON CONFLICT for SQLite. SQLite allows
+			# a single writer, so UPDATE then INSERT in one transaction is
+			# atomic
+			update = table.update().where(db.and_(
+				table.c.user_id == user_id, table.c.name == name)).values(
+					payload_json = values['payload_json'],
+					timestamp = values['timestamp'],
+					version = db.func.max(table.c.version + 1, version))
+			if db.session.execute(update).rowcount:
+				return
+			statement = table.insert().values(**values)
+		db.session.execute(statement)
+
+	@staticmethod
+	def compact(older_than, batch_size = 1000, name = 'task_progress'):
+		'''delete name notifications last updated before older_than,
+		committing every batch_size rows. Returns the number deleted'''
+		deleted = 0
+		while True:
+			ids = [id for id, in db.session.query(Notification.id).filter(
+				Notification.name == name,
+				Notification.timestamp < older_than).limit(batch_size)]
+			if not ids:
+				return deleted
+			Notification.query.filter(Notification.id.in_(ids)).delete(
+				synchronize_session = False)
+			db.session.commit()
+			deleted += len(ids)
+
 class Task(db.Model):
 	__tablename__ = 'tasks'
 
@@ -323,10 +680,17 @@ class Task(db.Model):
 	description = db.Column(db.String(128))
 	user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 	complete = db.Column(db.Boolean, default = False)
+	timestamp = db.Column(db.DateTime, index = True, default = datetime.utcnow)
+
+	# tasks in progress, on every page of a logged in user
+	__table_args__ = (db.Index('ix_tasks_user_id_complete', 'user_id',
+		'complete'),)
 
 	def get_rq_job(self):
 		try:
-			rq_job = rq.job.Job.fetch(self.id, connection = current_app.redis)
+			with observe('redis', 'fetch_job'):
+				rq_job = rq.job.Job.fetch(self.id,
+					connection = current_app.redis)
 		except (redis.exceptions.RedisError, rq.exceptions.NoSuchJobError):
 			return None
 		return rq_job
@@ -335,6 +699,21 @@ class Task(db.Model):
 		job = self.get_rq_job()
 		return job.meta.get('progress', 0) if job is not None else 100
 
+class Suggestion(db.Model):
+	'''top "who to follow" accounts per user, rewritten in batches by
+	app/suggestions.py'''
+	__tablename__ = 'suggestions'
+
+	user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+		primary_key = True)
+	suggested_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+		primary_key = True)
+	# friend-of-friend paths to the account, below 1 for popular accounts
+	score = db.Column(db.Float, default = 0)
+
+	__table_args__ = (db.Index('ix_suggestions_user_id_score', 'user_id',
+		'score'),)
+
 @login.user_loader
 def load_user(id):
 	'''reloads a user from the session'''
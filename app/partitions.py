@@ -0,0 +1,124 @@
+'''hot and cold tiers of posts. post (Post) holds the last POST_HOT_DAYS
+days, rollover() moves older posts to post_archive (ArchivedPost) in
+batches of POST_ROLLOVER_BATCH. Recent pages only read post and its
+small indexes, paginate() reaches into the archive for pages past the
+end of the hot tier.
+
+On Postgres post_archive is partitioned by range of month with a
+default partition, on MySQL by RANGE COLUMNS with a MAXVALUE partition
+(see the migration). rollover() adds the monthly partitions for the
+posts it moves before moving them. SQLite has no partitions, the
+archive is a plain table'''
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models import Post, ArchivedPost
+
+def month_start(when):
+    return datetime(when.year, when.month, 1)
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def months(first, last):
+    '''the first day of every month from first`s to last`s'''
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = next_month(month)
+
+def mysql_bounds(connection):
+    '''upper bounds of post_archive`s monthly partitions'''
+    rows = connection.execute(
+        "SELECT partition_description FROM information_schema.partitions "
+        "WHERE table_schema = DATABASE() AND table_name = 'post_archive' "
+        "AND partition_description != 'MAXVALUE'")
+    return set(row[0].strip("'")[:10] for row in rows)
+
+def add_partitions(first, last):
+    '''monthly post_archive partitions covering first to last, returns
+    the names of new ones. A no-op without native partitions'''
+    added = []
+    with db.engine.begin() as connection:
+        dialect = connection.dialect.name
+        if dialect == 'postgresql':
+            existing = set(row[0] for row in connection.execute(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                "WHERE parent.relname = 'post_archive'"))
+            for month in months(first, last):
+                name = 'post_archive_{:%Y%m}'.format(month)
+                if name not in existing:
+                    connection.execute("CREATE TABLE {} PARTITION OF "
+                        "post_archive FOR VALUES FROM ('{:%Y-%m-%d}') TO "
+                        "('{:%Y-%m-%d}')".format(name, month,
+                            next_month(month)))
+                    added.append(name)
+        elif dialect == 'mysql':
+            # new partitions split the MAXVALUE one, so only months after
+            # the last bound can be added. Older rows fall into the first
+            # partition
+            bounds = mysql_bounds(connection)
+            last_bound = max(bounds) if bounds else ''
+            new = [month for month in months(first, last)
+                if '{:%Y-%m-%d}'.format(next_month(month)) > last_bound]
+            if new:
+                connection.execute("ALTER TABLE post_archive REORGANIZE "
+                    "PARTITION p_max INTO ({}, PARTITION p_max VALUES LESS "
+                    "THAN (MAXVALUE))".format(', '.join("PARTITION p{:%Y%m} "
+                        "VALUES LESS THAN ('{:%Y-%m-%d}')".format(month,
+                        next_month(month)) for month in new)))
+                added.extend('p{:%Y%m}'.format(month) for month in new)
+    return added
+
+def rollover(cutoff = None, batch_size = None):
+    '''move posts older than cutoff (POST_HOT_DAYS ago by default) to the
+    archive, oldest first, one transaction per batch. Ids are kept, the
+    search index and rendered fragments stay valid. Returns the number
+    of posts moved'''
+    config = current_app.config
+    cutoff = cutoff or datetime.utcnow() - timedelta(
+        days = config['POST_HOT_DAYS'])
+    batch_size = batch_size or config['POST_ROLLOVER_BATCH']
+    oldest = db.session.query(db.func.min(Post.timestamp)).scalar()
+    db.session.commit()
+    if oldest is None or oldest >= cutoff:
+        return 0
+    added = add_partitions(oldest, cutoff)
+    if added:
+        current_app.logger.info('Added post_archive partitions %s',
+            ', '.join(added))
+    hot = Post.__table__
+    archive = ArchivedPost.__table__
+    columns = [column.name for column in archive.columns]
+    moved = 0
+    while True:
+        ids = [id for id, in db.session.query(Post.id).filter(
+            Post.timestamp < cutoff).order_by(Post.timestamp).limit(
+                batch_size)]
+        if not ids:
+            break
+        db.session.execute(archive.insert().from_select(columns,
+            db.select([hot.c[name] for name in columns]).where(
+                hot.c.id.in_(ids))))
+        db.session.execute(hot.delete().where(hot.c.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+    current_app.logger.info('Moved %d posts older than %s to the archive',
+        moved, cutoff)
+    return moved
+
+def paginate(hot, archive, page, per_page):
+    '''(items, has next) of a page of hot followed by archive, both
+    queries sorted newest first. Pages within the hot tier never touch
+    the archive or count rows'''
+    start = (max(page, 1) - 1) * per_page
+    items = hot.offset(start).limit(per_page + 1).all()
+    if len(items) <= per_page:
+        # ran past the end of the hot tier
+        hot_total = start + len(items) if items else \
+            hot.order_by(None).count()
+        items += archive.offset(max(0, start - hot_total)).limit(
+            per_page + 1 - len(items)).all()
+    return items[:per_page], len(items) > per_page
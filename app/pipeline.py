@@ -0,0 +1,211 @@
+'''post ingestion: a new post is one INSERT, everything else runs later
+in batches. Each stage has a redis list of post ids and up to
+PIPELINE_DRAINERS[stage] RQ jobs (app.tasks.pipeline_<stage>) taking
+PIPELINE_BATCH ids at a time off it, so every stage keeps up with its
+own backlog on the queue TASK_ROUTES gives it. Finished ids go on to
+the next stage.
+
+post.pipeline has a bit per finished stage. A stage skips posts that
+have its bit, so ids can be queued more than once, and the janitor
+queues posts that are still unfinished after PIPELINE_STALL seconds
+again (ids lost with a crashed job or while redis was down)'''
+import math
+import re
+from datetime import datetime, timedelta
+from flask import current_app
+from langdetect import detect
+from redis.exceptions import RedisError
+from app import db
+from app.metrics import observe
+from app.models import Post, User, Notification, followers
+from app.queues import enqueue
+from app.search import bulk_index
+from app import timelines
+
+STAGES = ['language', 'search', 'timeline', 'trends', 'notify']
+BITS = dict((stage, 1 << i) for i, stage in enumerate(STAGES))
+DONE = (1 << len(STAGES)) - 1
+MENTION = re.compile(r'@(\w{1,64})', re.U)
+
+# KEYS[1] drainer count, ARGV - the most drainers, ttl. Returns 1 if
+# one more drainer may start
+CLAIM_LUA = '''
+local running = tonumber(redis.call('GET', KEYS[1]) or '0')
+if running >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+'''
+_claim = None
+
+def queue_key(stage):
+    return 'pipeline:{}'.format(stage)
+
+def drainers_key(stage):
+    return 'pipeline:{}:drainers'.format(stage)
+
+def detect_language(text):
+    '''langdetect`s code for text, '' if it can`t tell'''
+    try:
+        return detect(text)[:5]
+    except Exception: # LangDetectException, no features in text
+        return ''
+
+def detect_languages(posts):
+    rows = [{'post_id': post.id, 'language': detect_language(post.body)}
+        for post in posts if post.language is None]
+    if rows:
+        table = Post.__table__
+        db.session.execute(table.update().where(
+            table.c.id == db.bindparam('post_id')).values(
+                language = db.bindparam('language')), rows)
+
+def index_posts(posts):
+    if current_app.elasticsearch:
+        bulk_index(Post.__search_index__, posts)
+
+def fan_out(posts):
+    '''push each post to its author`s and followers` timelines'''
+    if not current_app.config['TIMELINE_LENGTH']:
+        return
+    audience = dict((post.user_id, {post.user_id}) for post in posts)
+    for followed_id, follower_id in db.session.query(followers.c.followed_id,
+            followers.c.follower_id).filter(
+            followers.c.followed_id.in_(list(audience))):
+        audience[followed_id].add(follower_id)
+    for post in posts:
+        timelines.push(post, audience[post.user_id])
+
+def count_trends(posts):
+    trends = current_app.extensions['trends']
+    for post in posts:
+        trends.count(post.id, post.body, timelines.score(post))
+
+def notify_mentions(posts):
+    '''a "mention" notification for every @username in a post, shown
+    as an alert by notifications.js'''
+    mentions = dict((post, set(MENTION.findall(post.body)))
+        for post in posts)
+    names = set().union(*mentions.values())
+    if not names:
+        return
+    users = dict((user.username, user) for user in
+        User.query.filter(User.username.in_(names)))
+    for post, names in mentions.items():
+        for name in names:
+            user = users.get(name)
+            if user is not None and user.id != post.user_id:
+                Notification.upsert(user.id, 'mention', {
+                    'post_id': post.id, 'username': post.author.username})
+
+HANDLERS = {
+    'language': detect_languages,
+    'search': index_posts,
+    'timeline': fan_out,
+    'trends': count_trends,
+    'notify': notify_mentions
+}
+
+def run(stage, ids):
+    '''do stage for the posts of ids that haven`t had it and set its
+    bit. Returns the number of posts'''
+    bit = BITS[stage]
+    posts = Post.query.filter(Post.id.in_(ids),
+        Post.pipeline.op('&')(bit) == 0).all()
+    if posts:
+        try:
+            HANDLERS[stage](posts)
+        except:
+            db.session.rollback()
+            raise
+        table = Post.__table__
+        db.session.execute(table.update().where(table.c.id.in_(
+            [post.id for post in posts])).values(
+                pipeline = table.c.pipeline.op('|')(bit)))
+    db.session.commit()
+    return len(posts)
+
+def submit(app, ids, stage = STAGES[0]):
+    '''queue post ids for stage and start another drainer if the backlog
+    needs one. Returns the backlog'''
+    global _claim
+    config = app.config
+    redis = app.redis
+    pipe = redis.pipeline(transaction = False)
+    if ids:
+        pipe.rpush(queue_key(stage), *ids)
+    pipe.llen(queue_key(stage))
+    with observe('redis', 'pipeline'):
+        backlog = pipe.execute()[-1]
+    wanted = min(config['PIPELINE_DRAINERS'].get(stage, 1),
+        int(math.ceil(backlog / float(config['PIPELINE_BATCH']))))
+    if wanted:
+        if _claim is None:
+            _claim = redis.register_script(CLAIM_LUA)
+        with observe('redis', 'pipeline'):
+            claimed = _claim(keys = [drainers_key(stage)], args = [wanted,
+                config['PIPELINE_DRAINER_TTL']], client = redis)
+        if claimed:
+            try:
+                enqueue(app, 'pipeline_' + stage)
+            except RedisError:
+                redis.decr(drainers_key(stage))
+                raise
+    return backlog
+
+def take(app, stage, count):
+    '''pop up to count distinct ids off stage`s list'''
+    pipe = app.redis.pipeline()
+    pipe.lrange(queue_key(stage), 0, count - 1)
+    pipe.ltrim(queue_key(stage), count, -1)
+    with observe('redis', 'pipeline'):
+        ids = pipe.execute()[0]
+    return sorted(set(int(id) for id in ids))
+
+def drain(app, stage):
+    '''run stage on batches off its list for at most PIPELINE_MAX_BATCHES
+    batches, pass them on to the next stage. Returns the number of ids'''
+    config = app.config
+    following = STAGES.index(stage) + 1
+    done = 0
+    try:
+        for i in range(config['PIPELINE_MAX_BATCHES']):
+            ids = take(app, stage, config['PIPELINE_BATCH'])
+            if not ids:
+                break
+            run(stage, ids)
+            if following < len(STAGES):
+                submit(app, ids, STAGES[following])
+            done += len(ids)
+    finally:
+        app.redis.decr(drainers_key(stage))
+    # ids queued after the last batch, or the rest after max batches
+    submit(app, [], stage)
+    return done
+
+def submit_posts(app, posts):
+    '''hand new posts to the pipeline. Without redis they wait for the
+    janitor`s next sweep'''
+    try:
+        submit(app, [post.id for post in posts])
+    except RedisError:
+        app.logger.warning('Post pipeline is unavailable, %d posts wait for '
+            'the janitor', len(posts))
+
+def sweep(app):
+    '''queue posts from the last PIPELINE_SWEEP_AGE seconds that are
+    still unfinished PIPELINE_STALL seconds after posting. Returns the
+    number of posts'''
+    config = app.config
+    now = datetime.utcnow()
+    since = now - timedelta(seconds = config['PIPELINE_SWEEP_AGE'])
+    until = now - timedelta(seconds = config['PIPELINE_STALL'])
+    ids = [id for id, in db.session.query(Post.id).filter(
+        Post.pipeline < DONE, Post.timestamp > since,
+        Post.timestamp < until).limit(config['JANITOR_BATCH'])]
+    db.session.commit()
+    if ids:
+        submit(app, ids)
+    return len(ids)
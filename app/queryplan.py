@@ -0,0 +1,91 @@
+import json
+import re
+from contextlib import contextmanager
+from app import db
+from app.sqlstats import QueryStats, statement_shape
+
+class PlanCapture(QueryStats):
+    '''SELECT statements run on this thread, with their parameters'''
+    def __init__(self):
+        super(PlanCapture, self).__init__()
+        self.statements = []
+
+    def record(self, statement, duration, parameters = None):
+        super(PlanCapture, self).record(statement, duration, parameters)
+        if statement.lstrip().upper().startswith('SELECT') and \
+                (statement, parameters) not in self.statements:
+            self.statements.append((statement, parameters))
+
+def _table_names():
+    return set(db.metadata.tables)
+
+def _sqlite_scans(connection, statement, parameters):
+    '''"SCAN post" or "SCAN post USING INDEX ..." reads the whole table
+    or index, "SEARCH post USING INDEX ..." is a lookup'''
+    rows = connection.execute('EXPLAIN QUERY PLAN ' + statement,
+        parameters).fetchall()
+    plan = [row[-1] for row in rows]
+    scans = []
+    for line in plan:
+        match = re.match(r'SCAN (?:TABLE )?(\w+)', line)
+        if match and match.group(1) in _table_names():
+            scans.append(match.group(1))
+    return scans, plan
+
+def _mysql_scans(connection, statement, parameters):
+    '''type ALL is a full table scan, index a full index scan'''
+    rows = [dict(row) for row in connection.execute('EXPLAIN ' + statement,
+        parameters)]
+    scans = [row['table'] for row in rows if row['type'] in ('ALL', 'index')
+        and row['table'] in _table_names()]
+    return scans, ['{table} {type} {key}'.format(**row) for row in rows]
+
+def _postgresql_scans(connection, statement, parameters):
+    '''Seq Scan nodes. Sequential scans are disabled while explaining,
+    otherwise small test tables are always read sequentially'''
+    with connection.begin():
+        connection.execute('SET LOCAL enable_seqscan = off')
+        plan = connection.execute('EXPLAIN (FORMAT JSON) ' + statement,
+            parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans = []
+    lines = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        lines.append('{} {}'.format(node['Node Type'],
+            node.get('Relation Name', '')))
+        if node['Node Type'] == 'Seq Scan':
+            scans.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return scans, lines
+
+EXPLAIN = {
+    'sqlite': _sqlite_scans,
+    'mysql': _mysql_scans,
+    'postgresql': _postgresql_scans
+}
+
+def full_scans(statement, parameters = None):
+    '''(tables read in full, plan lines) for a statement'''
+    with db.engine.connect() as connection:
+        explain = EXPLAIN[connection.dialect.name]
+        return explain(connection, statement, parameters or ())
+
+@contextmanager
+def assert_no_full_scans(allow = ()):
+    '''for tests.py: EXPLAIN every SELECT the block runs and fail when one
+    reads a whole table that isn`t in allow'''
+    with PlanCapture() as capture:
+        yield capture
+    failures = []
+    for statement, parameters in capture.statements:
+        scans, plan = full_scans(statement, parameters)
+        scans = [table for table in scans if table not in allow]
+        if scans:
+            failures.append('full scan of {} in {}\n  {}'.format(
+                ', '.join(scans), statement_shape(statement),
+                '\n  '.join(plan)))
+    if failures:
+        raise AssertionError('\n'.join(failures))
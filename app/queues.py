@@ -0,0 +1,101 @@
+import math
+import multiprocessing
+import signal
+import subprocess
+import sys
+import time
+from redis.exceptions import RedisError
+from app.metrics import observe
+
+def queue_name(name):
+    return 'microblog-' + name
+
+def route(app, name):
+    '''(queue, enqueue options) for the task app.tasks.<name>'''
+    queue, timeout, result_ttl = app.config['TASK_ROUTES'].get(name,
+        app.config['TASK_DEFAULT_ROUTE'])
+    return app.task_queues[queue], {'job_timeout': timeout,
+        'result_ttl': result_ttl}
+
+def enqueue(app, name, *args, **kwargs):
+    queue, options = route(app, name)
+    options.update(kwargs)
+    with observe('redis', 'enqueue'):
+        return queue.enqueue('app.tasks.' + name, *args, **options)
+
+def enqueue_in(app, delay, name, *args, **kwargs):
+    '''run after delay (a timedelta), workers need --with-scheduler'''
+    queue, options = route(app, name)
+    options.update(kwargs)
+    with observe('redis', 'enqueue'):
+        return queue.enqueue_in(delay, 'app.tasks.' + name, *args, **options)
+
+def listens_to(app, name):
+    '''queues a worker of this queue takes jobs from, most urgent first.
+    Idle bulk workers help with interactive jobs, but interactive
+    workers never pick up a long bulk job'''
+    queues = app.config['TASK_QUEUES']
+    return queues[:queues.index(name) + 1]
+
+class Supervisor(object):
+    '''keeps RQ_WORKERS[queue] = (min, max) `rq worker` processes per
+    queue, one per RQ_JOBS_PER_WORKER waiting jobs. A max of 0 means one
+    per CPU core'''
+    def __init__(self, app, queues = None):
+        self.app = app
+        self.queues = queues or app.config['TASK_QUEUES']
+        self.workers = dict((name, []) for name in self.queues)
+        self.retiring = []
+        self.stopping = False
+
+    def limits(self, name):
+        low, high = self.app.config['RQ_WORKERS'].get(name, (1, 1))
+        return low, max(low, high or multiprocessing.cpu_count())
+
+    def wanted(self, name, depth):
+        low, high = self.limits(name)
+        return max(low, min(high,
+            math.ceil(depth / float(self.app.config['RQ_JOBS_PER_WORKER']))))
+
+    def spawn(self, name):
+        command = [sys.executable, '-m', 'rq.cli', 'worker', '--url',
+            self.app.config['REDIS_URL'], '--with-scheduler'] + \
+            [queue_name(queue) for queue in listens_to(self.app, name)]
+        return subprocess.Popen(command)
+
+    def scale(self):
+        '''start or stop workers to match each queue`s depth. Stopped
+        workers get SIGTERM, which lets them finish their current job'''
+        self.retiring = [p for p in self.retiring if p.poll() is None]
+        for name in self.queues:
+            workers = [p for p in self.workers[name] if p.poll() is None]
+            try:
+                wanted = self.wanted(name, len(self.app.task_queues[name]))
+            except RedisError:
+                wanted = max(len(workers), self.limits(name)[0])
+            while len(workers) < wanted:
+                workers.append(self.spawn(name))
+            while len(workers) > wanted:
+                worker = workers.pop()
+                worker.terminate()
+                self.retiring.append(worker)
+            self.workers[name] = workers
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping:
+            self.scale()
+            deadline = time.time() + self.app.config['RQ_SCALE_INTERVAL']
+            while not self.stopping and time.time() < deadline:
+                time.sleep(0.5)
+        workers = self.retiring + [p for name in self.queues
+            for p in self.workers[name]]
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in workers:
+            worker.wait()
@@ -0,0 +1,126 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, request
+from flask_login import current_user
+from redis.exceptions import RedisError
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from app.metrics import observe
+
+# token bucket in a redis hash. KEYS[1] - bucket key,
+# ARGV - refill rate (tokens/sec), capacity, now, cost
+TOKEN_BUCKET_LUA = '''
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+'''
+
+class LocalBuckets(object):
+    '''in-process token buckets, used when redis is unavailable'''
+    def __init__(self, max_keys = 10000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, rate, capacity, now, cost = 1):
+        '''returns seconds to wait, 0 if the request is allowed'''
+        with self.lock:
+            tokens, ts = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - ts) * rate)
+            wait = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last = False)
+            return wait
+
+class RateLimiter(object):
+    '''per-endpoint token buckets keyed by user or address, plus a
+    per-worker cap on concurrent requests to the limited endpoints'''
+    def __init__(self, app = None):
+        self.local = LocalBuckets()
+        self.redis_down_until = 0
+        self._script = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMITS', {})
+        app.config.setdefault('RATELIMIT_MAX_CONCURRENT', 0)
+        app.config.setdefault('RATELIMIT_REDIS_RETRY', 30)
+        if not app.config['RATELIMIT_ENABLED']:
+            return
+        if app.config['RATELIMIT_MAX_CONCURRENT']:
+            self._slots = threading.BoundedSemaphore(
+                app.config['RATELIMIT_MAX_CONCURRENT'])
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    @staticmethod
+    def identity():
+        '''logged in user, the user of a valid API token or remote
+        address. Unverified tokens share their address`s bucket'''
+        if current_user.is_authenticated:
+            return 'user:{}'.format(current_user.id)
+        if request.blueprint == 'api':
+            from app.api.auth import token_auth
+            user = token_auth.authenticate(token_auth.get_auth(), None)
+            if user:
+                return 'user:{}'.format(user.id)
+        return 'ip:{}'.format(request.remote_addr)
+
+    def consume(self, key, rate, capacity):
+        now = time.time()
+        redis = getattr(current_app, 'redis', None)
+        if redis is not None and now >= self.redis_down_until:
+            try:
+                if self._script is None:
+                    self._script = redis.register_script(TOKEN_BUCKET_LUA)
+                with observe('redis', 'ratelimit'):
+                    return float(self._script(keys = [key],
+                        args = [rate, capacity, now, 1], client = redis))
+            except RedisError:
+                current_app.logger.warning(
+                    'Rate limiter can`t reach redis, using local buckets')
+                self.redis_down_until = now + \
+                    current_app.config['RATELIMIT_REDIS_RETRY']
+        return self.local.consume(key, rate, capacity, now)
+
+    def before_request(self):
+        budget = current_app.config['RATELIMITS'].get(request.endpoint)
+        if budget is None:
+            return
+        capacity, period = budget
+        key = 'ratelimit:{}:{}'.format(request.endpoint, self.identity())
+        wait = self.consume(key, float(capacity) / period, capacity)
+        if wait > 0:
+            raise TooManyRequests(retry_after = int(math.ceil(wait)))
+        if self._slots is not None:
+            if not self._slots.acquire(False):
+                # shed load instead of queueing behind slow backends
+                raise ServiceUnavailable(retry_after = 1)
+            g.ratelimit_slot = True
+
+    def teardown_request(self, exc = None):
+        if g.pop('ratelimit_slot', None):
+            self._slots.release()
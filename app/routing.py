@@ -0,0 +1,159 @@
+import hashlib
+import random
+import time
+from flask import has_request_context, request, session as cookie
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect, orm, text
+from app import sqlite
+from app.metrics import observe
+
+# replication lag in seconds, by dialect
+LAG_QUERIES = {
+    'postgresql': text(
+        'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+        'THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM now() - '
+        'pg_last_xact_replay_timestamp()), 0) END'),
+    'mysql': text('SHOW SLAVE STATUS')
+}
+
+class ReplicaMonitor(object):
+    '''remembers each replica`s lag for REPLICA_LAG_CHECK_INTERVAL seconds'''
+    def __init__(self):
+        self.lag = {}
+
+    def check(self, engine):
+        query = LAG_QUERIES.get(engine.dialect.name)
+        if query is None: # sqlite has no replication
+            return 0
+        with engine.connect() as connection:
+            row = connection.execute(query).first()
+        if engine.dialect.name == 'mysql':
+            if row is None or row['Seconds_Behind_Master'] is None:
+                return float('inf') # not replicating
+            return row['Seconds_Behind_Master']
+        return float(row[0] or 0)
+
+    def lag_of(self, app, engine):
+        now = time.time()
+        checked, lag = self.lag.get(engine.url, (0, None))
+        if now - checked > app.config['REPLICA_LAG_CHECK_INTERVAL']:
+            try:
+                lag = self.check(engine)
+            except Exception:
+                app.logger.warning('Replica %s is unavailable',
+                    engine.url.host or engine.url.database)
+                lag = float('inf')
+            self.lag[engine.url] = (now, lag)
+        return lag
+
+def token_key():
+    '''redis key for the last write of this request`s API token, None
+    without one. API clients don`t keep the session cookie'''
+    auth = request.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return None
+    # don`t keep raw tokens in redis
+    return 'db_primary:' + hashlib.sha1(auth[7:].encode('utf-8')).hexdigest()
+
+def token_primary_until(session):
+    '''until when this request`s API token reads from the primary, looked
+    up once per session (request). Without redis it always does'''
+    app = session.app
+    if 'primary_until' not in session.info:
+        key = token_key()
+        until = 0
+        if key is not None:
+            try:
+                with observe('redis', 'routing'):
+                    until = float(app.redis.get(key) or 0)
+            except RedisError:
+                app.logger.warning('Can`t tell when the API token last '
+                    'wrote, reading from the primary')
+                until = float('inf')
+        session.info['primary_until'] = until
+    return session.info['primary_until']
+
+def reads_from_replica(session):
+    '''safe requests read from a replica unless this session, this user
+    or this API token (within REPLICA_STICKY_SECONDS of their last write)
+    wrote'''
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    if session._flushing or session.info.get('wrote'):
+        return False
+    now = time.time()
+    return cookie.get('db_primary_until', 0) < now and \
+        token_primary_until(session) < now
+
+class RoutingSession(SignallingSession):
+    '''sends reads of read-only requests to SQLALCHEMY_REPLICAS binds'''
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper = None, clause = None):
+        if getattr(clause, 'is_dml', False):
+            # INSERT/UPDATE/DELETE run through session.execute()
+            self.info['wrote'] = True
+        replicas = self.app.config.get('SQLALCHEMY_REPLICAS')
+        if replicas and reads_from_replica(self):
+            engine = self.db.replica_engine(self.app)
+            if engine is not None:
+                return engine
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+def _after_flush(session, context):
+    '''any write except to __replica_lag_ok__ columns pins the session
+    (and the user, after commit) to the primary'''
+    if session.new or session.deleted:
+        session.info['wrote'] = True
+        return
+    for obj in session.dirty:
+        lag_ok = getattr(obj, '__replica_lag_ok__', ())
+        state = inspect(obj)
+        if any(attr.history.has_changes() for attr in state.attrs
+                if attr.key not in lag_ok):
+            session.info['wrote'] = True
+            return
+
+def _after_commit(session):
+    app = session.app
+    if session.info.get('wrote') and has_request_context() and \
+            app.config.get('SQLALCHEMY_REPLICAS'):
+        sticky = app.config['REPLICA_STICKY_SECONDS']
+        until = time.time() + sticky
+        cookie['db_primary_until'] = until
+        key = token_key()
+        if key is not None:
+            session.info['primary_until'] = until
+            try:
+                with observe('redis', 'routing'):
+                    app.redis.setex(key, int(sticky) + 1, until)
+            except RedisError:
+                app.logger.warning('Can`t pin the API token to the primary')
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''SQLAlchemy with a RoutingSession and pooled, tuned SQLite engines'''
+    def __init__(self, *args, **kwargs):
+        self.replicas = ReplicaMonitor()
+        super(RoutingSQLAlchemy, self).__init__(*args, **kwargs)
+        event.listen(self.session, 'after_flush', _after_flush)
+        event.listen(self.session, 'after_commit', _after_commit)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_ = RoutingSession, db = self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        rv = super(RoutingSQLAlchemy, self).apply_driver_hacks(app, sa_url,
+            options)
+        sqlite.driver_options(app, sa_url, options)
+        return rv
+
+    def replica_engine(self, app):
+        '''a random replica that lags less than REPLICA_MAX_LAG seconds'''
+        engines = [self.get_engine(app, bind) for bind in
+            app.config['SQLALCHEMY_REPLICAS']]
+        engines = [engine for engine in engines if self.replicas.lag_of(
+            app, engine) <= app.config['REPLICA_MAX_LAG']]
+        return random.choice(engines) if engines else None
@@ -1,4 +1,5 @@
 from flask import current_app
+from app.metrics import observe
 
 def add_to_index(index, model):
     '''add all searchable notes to search'''
@@ -7,26 +8,45 @@ def add_to_index(index, model):
     payload = {}
     for field in model.__searchable__:
         payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index = index, doc_type = index,
-        id = model.id, body = payload)
+    with observe('elasticsearch', 'index'):
+        current_app.elasticsearch.index(index = index, doc_type = index,
+            id = model.id, body = payload)
+
+def bulk_index(index, models):
+    '''add many notes in one request, returns how many were indexed'''
+    if not current_app.elasticsearch:
+        return 0
+    from elasticsearch.helpers import bulk
+    actions = [{
+        '_index': index,
+        '_type': index,
+        '_id': model.id,
+        '_source': dict((field, getattr(model, field))
+            for field in model.__searchable__)
+    } for model in models]
+    with observe('elasticsearch', 'bulk'):
+        indexed, errors = bulk(current_app.elasticsearch, actions)
+    return indexed
 
 def remove_from_index(index, model):
     if not current_app.elasticsearch:
         return
-    current_app.elasticsearch.delete(index = index, doct_type = index,
-        id = model.id)
+    with observe('elasticsearch', 'delete'):
+        current_app.elasticsearch.delete(index = index, doct_type = index,
+            id = model.id)
 
 def query_index(index, query, page, per_page):
     '''execute search query and paginate the 
     results depending on how many posts per page'''
     if not current_app.elasticsearch:
         return [], 0
-    search = current_app.elasticsearch.search(
-        index = index, 
-        doc_type = index,
-        body = {'query': {'multi_match': {'query': query, 'fields': ['*']}},
-                'from': (page - 1) * per_page, 'size': per_page 
-                }
-    )
+    with observe('elasticsearch', 'search'):
+        search = current_app.elasticsearch.search(
+            index = index, 
+            doc_type = index,
+            body = {'query': {'multi_match': {'query': query, 'fields': ['*']}},
+                    'from': (page - 1) * per_page, 'size': per_page 
+                    }
+        )
     ids = [int(hit['_id']) for hit in search['hits']['hits']]
     return ids, search['hits']['total']
\ No newline at end of file
@@ -0,0 +1,133 @@
+import time
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from werkzeug.security import generate_password_hash
+from app import db
+from app.models import User, Post, followers
+from app.pipeline import DONE
+
+SEED_PASSWORD = 'seed'
+
+# (language, words) for post bodies
+VOCABULARY = [
+    ('en', 'the quick brown fox jumps over lazy dog today flask python '
+        'microblog coffee weather music travel'.split()),
+    ('ru', 'привет мир сегодня погода кофе музыка город работа книга '
+        'друзья вечер утро'.split()),
+    ('es', 'hola mundo hoy tiempo cafe musica ciudad trabajo libro '
+        'amigos noche manana'.split()),
+    ('de', 'hallo welt heute wetter kaffee musik stadt arbeit buch '
+        'freunde abend morgen'.split())
+]
+LANGUAGE_WEIGHTS = [0.6, 0.25, 0.1, 0.05]
+
+def pareto(rng, alpha, mean, size, maximum):
+    '''heavy tailed integers with the given mean, capped at maximum'''
+    minimum = mean * (alpha - 1) / alpha
+    values = minimum * (1 + rng.pareto(alpha, size))
+    return np.minimum(values, maximum).astype(np.int64)
+
+def timestamps(rng, size, days):
+    '''uniform over the last days, as python datetimes'''
+    now = np.datetime64(datetime.utcnow(), 's')
+    offsets = rng.integers(0, days * 86400, size).astype('timedelta64[s]')
+    return (now - offsets).astype(datetime).tolist()
+
+def insert(table, rows):
+    '''one executemany per chunk, each in its own transaction'''
+    if not rows:
+        return
+    with db.engine.begin() as connection:
+        connection.execute(table.insert(), rows)
+
+def reset_sequence(connection, table):
+    '''inserts with explicit ids don`t advance Postgres sequences, move
+    table`s id sequence past its rows so the ORM`s next insert doesn`t
+    reuse an id. MySQL and SQLite do this themselves'''
+    if connection.dialect.name == 'postgresql':
+        name = connection.dialect.identifier_preparer.quote(table.name)
+        connection.execute(db.text("SELECT setval(pg_get_serial_sequence("
+            ":table, 'id'), (SELECT max(id) FROM {}))".format(name)),
+            table = name)
+
+def seed_users(rng, first_id, count, chunk):
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    for start in range(first_id, first_id + count, chunk):
+        ids = np.arange(start, min(start + chunk, first_id + count))
+        seen = timestamps(rng, len(ids), 7)
+        insert(User.__table__, [{
+            'id': id,
+            'username': 'seed{}'.format(id),
+            'email': 'seed{}@example.com'.format(id),
+            'password_hash': password_hash,
+            'last_seen': last_seen
+        } for id, last_seen in zip(ids.tolist(), seen)])
+        yield len(ids)
+    with db.engine.begin() as connection:
+        reset_sequence(connection, User.__table__)
+
+def seed_follows(rng, first_id, count, mean_degree, chunk, alpha = 1.1):
+    '''power-law graph: account popularity ~ 1 / rank^alpha, out-degree
+    is pareto distributed'''
+    popularity = 1.0 / np.arange(1, count + 1) ** alpha
+    popularity /= popularity.sum()
+    ranked = rng.permutation(count) + first_id
+    for start in range(first_id, first_id + count, chunk):
+        ids = np.arange(start, min(start + chunk, first_id + count))
+        degrees = pareto(rng, 1.5, mean_degree, len(ids), count - 1)
+        follower = np.repeat(ids, degrees)
+        followed = ranked[rng.choice(count, len(follower), p = popularity)]
+        # followers of this chunk are disjoint from other chunks, so
+        # deduplicating within the chunk is enough
+        edges = np.unique(np.stack([follower, followed], axis = 1), axis = 0)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        insert(followers, [{'follower_id': a, 'followed_id': b}
+            for a, b in edges.tolist()])
+        yield len(edges)
+
+def seed_posts(rng, first_id, count, mean_posts, chunk, days = 365):
+    '''skewed posting rates, most users post rarely and a few a lot'''
+    counts = pareto(rng, 1.2, mean_posts, count, 100000)
+    user_ids = np.repeat(np.arange(first_id, first_id + count), counts)
+    for start in range(0, len(user_ids), chunk):
+        authors = user_ids[start:start + chunk]
+        size = len(authors)
+        languages = rng.choice(len(VOCABULARY), size, p = LANGUAGE_WEIGHTS)
+        lengths = rng.integers(3, 19, size)
+        words = rng.integers(0, 12, (size, 18))
+        rows = []
+        for author, language, length, indexes, timestamp in zip(
+                authors.tolist(), languages.tolist(), lengths.tolist(),
+                words.tolist(), timestamps(rng, size, days)):
+            code, vocabulary = VOCABULARY[language]
+            body = ' '.join(vocabulary[i] for i in indexes[:length])
+            rows.append({'body': body.capitalize()[:140],
+                'timestamp': timestamp, 'user_id': author,
+                'language': code, 'pipeline': DONE})
+        insert(Post.__table__, rows)
+        yield size
+
+def seed(users, mean_posts = 10, mean_degree = 20, chunk = 10000,
+        random_seed = None, progress = None):
+    '''bulk insert users, their follows and posts next to existing rows.
+    Core inserts skip the ORM session events and posts are marked done
+    for the ingestion pipeline, so they aren`t sent to Elasticsearch,
+    run Post.reindex() afterwards for that.
+    progress(table, rows so far) is called after every chunk'''
+    rng = np.random.default_rng(random_seed)
+    first_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    db.session.remove()
+    counts = {}
+    for name, steps in [
+            ('users', seed_users(rng, first_id, users, chunk)),
+            ('follows', seed_follows(rng, first_id, users, mean_degree,
+                chunk)),
+            ('posts', seed_posts(rng, first_id, users, mean_posts, chunk))]:
+        counts[name] = 0
+        for rows in steps:
+            counts[name] += rows
+            if progress is not None:
+                progress(name, counts[name])
+    current_app.logger.info('Seeded {}'.format(counts))
+    return counts
@@ -0,0 +1,35 @@
+import sqlite3
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# used for connections opened outside of an app context
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000
+}
+
+def driver_options(app, sa_url, options):
+    '''pool file databases so each connection keeps its page cache and
+    mmap between requests (SQLAlchemy uses NullPool for them)'''
+    if sa_url.drivername != 'sqlite' or \
+            sa_url.database in (None, '', ':memory:') or \
+            not app.config.get('SQLITE_POOL_SIZE'):
+        return
+    options['poolclass'] = QueuePool
+    options['pool_size'] = app.config['SQLITE_POOL_SIZE']
+    options.setdefault('connect_args', {})['check_same_thread'] = False
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    '''apply SQLITE_PRAGMAS to every new SQLite connection'''
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    pragmas = current_app.config.get('SQLITE_PRAGMAS', DEFAULT_PRAGMAS) \
+        if has_app_context() else DEFAULT_PRAGMAS
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
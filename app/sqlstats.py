@@ -0,0 +1,119 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+def _collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+def statement_shape(statement):
+    '''collapse whitespace and IN (?, ?, ...) lists so the same query
+    with different parameters has one shape'''
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    return re.sub(r'IN \((?:[?%]s?|:\w+)(?:, (?:[?%]s?|:\w+))*\)', 'IN (?)',
+        statement)
+
+class QueryStats(object):
+    '''statements run on this thread while the collector is active'''
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, duration, parameters = None):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold):
+        '''shapes run at least threshold times, most frequent first'''
+        return [(shape, count) for shape, count in self.shapes.most_common()
+            if count >= threshold]
+
+    def __enter__(self):
+        _collectors().append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _collectors().remove(self)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+        executemany):
+    if _collectors():
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+        executemany):
+    collectors = _collectors()
+    if not collectors or not conn.info.get('query_start'):
+        return
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    for collector in collectors:
+        collector.record(statement, duration, parameters)
+
+class SQLInstrumentation(object):
+    '''per-request query count, DB time and N+1 warnings'''
+    def __init__(self, app = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_STATS_ENABLED', True)
+        app.config.setdefault('SQL_STATS_HEADER', False)
+        app.config.setdefault('SQL_QUERY_THRESHOLD', 30)
+        app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 5)
+        if not app.config['SQL_STATS_ENABLED']:
+            return
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        g.sql_stats = QueryStats().__enter__()
+
+    def after_request(self, response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+        config = current_app.config
+        if stats.count > config['SQL_QUERY_THRESHOLD']:
+            current_app.logger.warning('%s %s ran %d queries in %.1fms',
+                request.method, request.path, stats.count,
+                stats.duration * 1000)
+        for shape, count in stats.repeated(config['SQL_N_PLUS_ONE_THRESHOLD']):
+            current_app.logger.warning('Possible N+1 in %s %s: %dx %s',
+                request.method, request.path, count, shape)
+        if config['SQL_STATS_HEADER'] or current_app.debug:
+            response.headers['X-DB-Queries'] = str(stats.count)
+            response.headers['Server-Timing'] = 'db;dur={:.1f};desc="{} ' \
+                'queries"'.format(stats.duration * 1000, stats.count)
+        return response
+
+    def teardown_request(self, exc = None):
+        stats = g.pop('sql_stats', None)
+        if stats is not None:
+            stats.__exit__(None, None, None)
+
+@contextmanager
+def assert_max_queries(limit, n_plus_one = None):
+    '''for tests.py: fail when the block runs more than limit queries or
+    repeats one statement shape n_plus_one times'''
+    with QueryStats() as stats:
+        yield stats
+    if stats.count > limit:
+        raise AssertionError('{} queries, expected at most {}:\n{}'.format(
+            stats.count, limit, '\n'.join('{}x {}'.format(count, shape)
+                for shape, count in stats.shapes.most_common())))
+    if n_plus_one is not None and stats.repeated(n_plus_one):
+        shape, count = stats.repeated(n_plus_one)[0]
+        raise AssertionError('possible N+1: {}x {}'.format(count, shape))
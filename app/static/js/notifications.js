@@ -0,0 +1,55 @@
+// function for enabling new messages badge
+function set_message_count(n) {
+    $('#message_count').text(n);
+    $('#message_count').css('visibility', n ? 'visible' : 'hidden');
+}
+
+// function for dynamic update of percentage export status
+function set_task_progress(task_id, progress) {
+    $('#' + task_id + '-progress').text(progress);
+}
+
+// alert for a mention by another user, once per browser. Older
+// mentions come back on every page`s first poll
+function show_mention(version, data) {
+    var seen = Number(localStorage.getItem('mention_version') || 0);
+    if (version <= seen) {
+        return;
+    }
+    localStorage.setItem('mention_version', version);
+    $('#mentions').append($('<div class="alert alert-info" role="alert">')
+        .html(microblog.mentioned.replace('{username}',
+            $('<a>').attr('href', '/user/' + encodeURIComponent(data.username))
+                .text(data.username).prop('outerHTML'))));
+}
+
+// polls microblog.notifications (set by base.html for logged in users)
+$(function() {
+    if (!microblog.notifications) {
+        return;
+    }
+    var since = 0;
+    // setInterval enables a function delay for 10 secs
+    setInterval(function() {
+        $.ajax(microblog.notifications + '?since=' + since).done(
+            function(notifications) {
+                for (var i = 0; i < notifications.length; i++) {
+                    switch (notifications[i].name) {
+                        case 'unread_message_count':
+                            set_message_count(notifications[i].data);
+                            break;
+                        case 'task_progress':
+                            set_task_progress(notifications[i].data.task_id,
+                                notifications[i].data.progress);
+                            break;
+                        case 'mention':
+                            show_mention(notifications[i].version,
+                                notifications[i].data);
+                            break;
+                    }
+                    since = notifications[i].version;
+                }
+            }
+        );
+    }, 10000);
+});
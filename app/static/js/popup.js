@@ -0,0 +1,72 @@
+// popup contents by username, loaded once per page. user_popup is
+// also kept in the browser cache, follow_state is always fresh
+var popups = {};
+
+function follow_form(state) {
+    if (state.self) {
+        return '';
+    }
+    return $('<form method="post">').attr('action', state.url).append(
+        $('<input type="hidden" name="csrf_token">').val(state.csrf_token),
+        $('<input type="submit" name="submit" class="btn btn-default btn-sm">')
+            .val(state.label)
+    ).prop('outerHTML');
+}
+
+function load_popup(username) {
+    if (!popups[username]) {
+        var base = '/user/' + encodeURIComponent(username);
+        popups[username] = $.when(
+            $.ajax(base + '/popup'),
+            $.ajax(base + '/follow_state')
+        ).then(function(popup, state) {
+            var content = $('<div>').html(popup[0]);
+            content.find('.follow_state').html(follow_form(state[0]));
+            return content.html();
+        });
+        popups[username].fail(function() {
+            // try again on the next hover
+            delete popups[username];
+        });
+    }
+    return popups[username];
+}
+
+// function for creating a user profile`s popover
+$(function () {
+    $('.user_popup').hover(
+        function(event) {
+            // mouse in event handler
+            var elem = $(event.currentTarget);
+            elem.data('hovered', true);
+            elem.data('timer', setTimeout(function() {
+                elem.removeData('timer');
+                load_popup(elem.first().text().trim()).done(function(content) {
+                    if (!elem.data('hovered')) {
+                        return;
+                    }
+                    // creating pop-up window
+                    elem.popover({
+                        trigger: 'manual',
+                        html: true,
+                        animation: false,
+                        container: elem,
+                        content: content
+                    }).popover('show');
+                    flask_moment_render_all();
+                });
+            }, 1000));
+        },
+        function(event) {
+            // mouse out event handler
+            var elem = $(event.currentTarget);
+            elem.data('hovered', false);
+            if (elem.data('timer')) {
+                clearTimeout(elem.data('timer'));
+                elem.removeData('timer');
+            }
+            // destroying pop-up window
+            elem.popover('destroy');
+        }
+    );
+});
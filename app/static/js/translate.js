@@ -0,0 +1,18 @@
+// translates a post with AJAX, microblog.loading and microblog.error
+// come from base.html
+function translate(sourceElem, destElem, sourceLang, destLang) {
+    $(destElem).html('<img src="' + microblog.loading + '">');
+
+    // $.post(<url>, <data>).done().fail()
+    $.post('/translate', {
+        text: $(sourceElem).text(),
+        source_language: sourceLang,
+        dest_language: destLang
+    }).done(function(response) {
+        // promise for success callback
+        $(destElem).text(response['text']);
+    }).fail(function() {
+        // promise for error callback
+        $(destElem).text(microblog.error);
+    });
+}
@@ -0,0 +1,151 @@
+'''"who to follow": the followers table is loaded into a sparse
+adjacency matrix and every stale user gets the accounts most of the
+people they follow follow (friend-of-friend paths), best
+SUGGESTIONS_PER_USER kept in the suggestions table'''
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from app import db
+from app.models import User, Suggestion, followers
+
+class Graph(object):
+    '''follow graph in CSR form: user u follows
+    indices[indptr[u]:indptr[u + 1]], users are rows by id'''
+    def __init__(self, follower, followed, size):
+        order = np.argsort(follower, kind = 'stable')
+        self.indices = followed[order]
+        self.indptr = np.zeros(size + 1, np.int64)
+        np.cumsum(np.bincount(follower, minlength = size),
+            out = self.indptr[1:])
+        self.size = size
+
+    @classmethod
+    def load(cls, chunk = 100000):
+        '''the whole followers table, streamed in chunks'''
+        parts = [np.zeros((0, 2), np.int64)]
+        statement = db.select([followers.c.follower_id,
+            followers.c.followed_id])
+        with db.engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results = True).execute(statement)
+            while True:
+                rows = result.fetchmany(chunk)
+                if not rows:
+                    break
+                parts.append(np.array([tuple(row) for row in rows],
+                    np.int64))
+        edges = np.concatenate(parts)
+        size = max(db.session.query(db.func.max(User.id)).scalar() or 0,
+            edges.max() if len(edges) else 0) + 1
+        return cls(edges[:, 0], edges[:, 1], size)
+
+    def neighbours(self, rows, cap = None, rng = None):
+        '''(owner, account, weight) for the accounts rows follow, owner
+        indexes rows. A row following more than cap accounts keeps cap
+        random ones, each weighted degree / cap so sums stay unbiased'''
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        owner = np.repeat(np.arange(len(rows)), lengths)
+        first = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + np.arange(len(owner)) - first
+        weight = np.ones(len(rows))
+        if cap is not None and (lengths > cap).any():
+            # rank each row`s entries in random order, keep the first cap
+            order = np.lexsort((rng.random(len(owner)), owner))
+            keep = np.sort(order[np.arange(len(owner)) - first < cap])
+            owner, positions = owner[keep], positions[keep]
+            weight = np.maximum(1.0, lengths / float(cap))
+        return owner, self.indices[positions], weight[owner]
+
+    def popular(self, count):
+        '''the most followed accounts'''
+        degree = np.bincount(self.indices, minlength = self.size)
+        top = np.argsort(-degree, kind = 'stable')[:count]
+        return top[degree[top] > 0]
+
+def suggest(graph, rows, count, sample, fanout, rng):
+    '''(rows index, account, score) of the best count friend-of-friend
+    accounts for each row user, best first. Scores are the number of
+    followed accounts that follow the account, estimated from sample
+    followed accounts per user and fanout of theirs'''
+    owner, friend, weight = graph.neighbours(rows, sample, rng)
+    via, account, fanout_weight = graph.neighbours(friend, fanout, rng)
+    keys = owner[via] * graph.size + account
+    keys, inverse = np.unique(keys, return_inverse = True)
+    scores = np.bincount(inverse.ravel(),
+        weights = weight[via] * fanout_weight)
+    user, account = keys // graph.size, keys % graph.size
+
+    # not the users themselves or accounts they follow already
+    owner, followed, weight = graph.neighbours(rows)
+    keep = (account != rows[user]) & \
+        ~np.isin(keys, owner * graph.size + followed)
+    user, account, scores = user[keep], account[keep], scores[keep]
+
+    # keys were sorted by user, order each user`s accounts by score
+    order = np.lexsort((-scores, user))
+    user, account, scores = user[order], account[order], scores[order]
+    rank = np.arange(len(user)) - np.searchsorted(user, user)
+    top = rank < count
+    return user[top], account[top], scores[top]
+
+def store(graph, rows, user, account, scores, count, popular):
+    '''replace the suggestions of rows. Users short of count get popular
+    accounts they don`t follow, scored below 1 in order of popularity'''
+    values = []
+    bounds = np.searchsorted(user, np.arange(len(rows) + 1)).tolist()
+    for i, id in enumerate(rows.tolist()):
+        picked = account[bounds[i]:bounds[i + 1]].tolist()
+        values.extend({'user_id': id, 'suggested_id': suggested,
+            'score': score} for suggested, score in zip(picked,
+            scores[bounds[i]:bounds[i + 1]].tolist()))
+        if len(picked) < count:
+            follows = set(graph.indices[
+                graph.indptr[id]:graph.indptr[id + 1]].tolist())
+            skip = follows | set(picked) | {id}
+            values.extend({'user_id': id, 'suggested_id': suggested,
+                'score': score} for suggested, score in [p for p in popular
+                if p[0] not in skip][:count - len(picked)])
+    table = Suggestion.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.delete().where(
+            table.c.user_id.in_(rows.tolist())))
+        if values:
+            connection.execute(table.insert(), values)
+    return len(values)
+
+def refresh(full = False, random_seed = None):
+    '''recompute the suggestions of users whose follows changed since
+    their last run, or of everyone. Users are marked as computed before
+    the graph is read, so a follow during the run marks them stale again
+    for the next one. Returns the number of users'''
+    config = current_app.config
+    query = db.session.query(User.id)
+    if not full:
+        query = query.filter(User.suggested_at.is_(None))
+    ids = np.array([id for id, in query], np.int64)
+    db.session.commit()
+    if not len(ids):
+        return 0
+    now = datetime.utcnow()
+    batch_size = config['SUGGESTIONS_BATCH']
+    for start in range(0, len(ids), batch_size):
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.update().where(
+                User.id.in_(ids[start:start + batch_size].tolist())).values(
+                    suggested_at = now))
+
+    graph = Graph.load()
+    rng = np.random.default_rng(random_seed)
+    count = config['SUGGESTIONS_PER_USER']
+    popular = graph.popular(count * 10).tolist()
+    popular = [(id, 1 - (i + 1.0) / (len(popular) + 1))
+        for i, id in enumerate(popular)]
+    for start in range(0, len(ids), batch_size):
+        rows = ids[start:start + batch_size]
+        user, account, scores = suggest(graph, rows, count,
+            config['SUGGESTIONS_SAMPLE'], config['SUGGESTIONS_FANOUT'], rng)
+        store(graph, rows, user, account, scores, count, popular)
+    current_app.logger.info('Suggestions for {} users ({} follows)'.format(
+        len(ids), len(graph.indices)))
+    return len(ids)
@@ -1,17 +1,29 @@
 import time
 import sys
+from itertools import chain
+from datetime import datetime, timedelta
 from rq import get_current_job
 from app import create_app, db
-from app.models import Task, User, Post
+from app.models import Task, User, Post, ArchivedPost, Notification
 import json
 from flask import render_template
 from app.email import send_email
+from app.metrics import task_timer
+from app.queues import enqueue_in
 
-app = create_app()
-app.app_context().push()
+# built by the first job rather than when the worker imports this module
+app = None
+
+def _get_app():
+    global app
+    if app is None:
+        app = create_app()
+        app.app_context().push()
+    return app
 
 # underscore means the function is for internal use
 def _set_task_progress(progress):
+    _get_app()
     job = get_current_job()
     if job:
         job.meta['progress'] = progress
@@ -27,13 +39,22 @@ def _set_task_progress(progress):
         db.session.commit()
 
 def export_posts(user_id):
+    app = _get_app()
+    with task_timer('export_posts'):
+        _export_posts(app, user_id)
+
+def _export_posts(app, user_id):
     try:
         user = User.query.get(user_id)
         _set_task_progress(0)
         data = []
         i = 0
-        total_posts = user.posts.count()
-        for post in user.posts.order_by(Post.timestamp.asc()):
+        total_posts = user.post_count()
+        # the archive holds the older posts
+        archived = ArchivedPost.query.filter_by(user_id = user.id).order_by(
+            ArchivedPost.timestamp.asc())
+        for post in chain(archived, user.posts.order_by(
+                Post.timestamp.asc())):
             data.append({'body': post.body, 
                         'timestamp': post.timestamp.isoformat() + 'Z'}
             )
@@ -53,4 +74,91 @@ def export_posts(user_id):
         )
     except:
         _set_task_progress(100)
-        app.logger.error('Unhandled exception', exc_info = sys.exc_info())
\ No newline at end of file
+        app.logger.error('Unhandled exception', exc_info = sys.exc_info())
+
+def schedule(app, name, interval):
+    '''run app.tasks.<name> in interval seconds (the rq worker needs
+    --with-scheduler). A redis key keeps a second chain of the same job
+    from being started. Returns False if one is scheduled already'''
+    if not app.redis.set('schedule:' + name, 1, nx = True, ex = interval):
+        return False
+    enqueue_in(app, timedelta(seconds = interval), name)
+    return True
+
+def reschedule(app, name, interval):
+    app.redis.delete('schedule:' + name)
+    schedule(app, name, interval)
+
+def compact_notifications():
+    '''delete task_progress notifications older than NOTIFICATION_RETENTION
+    in batches, then schedule the next run (after a failure too)'''
+    app = _get_app()
+    try:
+        with task_timer('compact_notifications'):
+            deleted = Notification.compact(datetime.utcnow() - timedelta(
+                seconds = app.config['NOTIFICATION_RETENTION']),
+                app.config['NOTIFICATION_COMPACT_BATCH'])
+        app.logger.info('Deleted %d stale notifications', deleted)
+        return deleted
+    finally:
+        reschedule(app, 'compact_notifications',
+            app.config['NOTIFICATION_COMPACT_INTERVAL'])
+
+def janitor():
+    '''reconcile and purge tasks and RQ jobs, then schedule the next run
+    (after a failure too)'''
+    from app.janitor import run
+    app = _get_app()
+    try:
+        with task_timer('janitor'):
+            return run(app)
+    finally:
+        reschedule(app, 'janitor', app.config['JANITOR_INTERVAL'])
+
+def refresh_suggestions():
+    '''recompute stale suggestions, everyone`s once per
+    SUGGESTIONS_FULL_INTERVAL, then schedule the next run (after a
+    failure too)'''
+    from app.suggestions import refresh
+    app = _get_app()
+    try:
+        full = bool(app.redis.set('suggestions:full', 1, nx = True,
+            ex = app.config['SUGGESTIONS_FULL_INTERVAL']))
+        with task_timer('refresh_suggestions'):
+            return refresh(full)
+    finally:
+        reschedule(app, 'refresh_suggestions',
+            app.config['SUGGESTIONS_INTERVAL'])
+
+def rollover_posts():
+    '''move posts past POST_HOT_DAYS to the archive, then schedule the
+    next run (after a failure too)'''
+    from app.partitions import rollover
+    app = _get_app()
+    try:
+        with task_timer('rollover_posts'):
+            return rollover()
+    finally:
+        reschedule(app, 'rollover_posts',
+            app.config['POST_ROLLOVER_INTERVAL'])
+
+def _drain(stage):
+    from app.pipeline import drain
+    app = _get_app()
+    with task_timer('pipeline_' + stage):
+        return drain(app, stage)
+
+def pipeline_language():
+    return _drain('language')
+
+def pipeline_search():
+    return _drain('search')
+
+def pipeline_timeline():
+    return _drain('timeline')
+
+def pipeline_trends():
+    return _drain('trends')
+
+def pipeline_notify():
+    return _drain('notify')
@@ -0,0 +1,93 @@
+'''home timelines in redis: a sorted set per user of the ids of the
+TIMELINE_LENGTH newest posts they see, scored by post time. The
+pipeline`s timeline stage pushes new posts to the timelines of the
+author`s followers (fan-out on write). A timeline that isn`t cached is
+built from followed_posts() on first read, its last page, pages past
+its end and reads while redis is down come from SQL'''
+import calendar
+from flask import current_app
+from redis.exceptions import RedisError
+from app.metrics import observe
+
+# KEYS - timelines, ARGV - score, post id, length. Only timelines that
+# exist get the post, the others are built with it on their next read
+PUSH_LUA = '''
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', key, ARGV[1], ARGV[2])
+        redis.call('ZREMRANGEBYRANK', key, 0, -tonumber(ARGV[3]) - 1)
+    end
+end
+return #KEYS
+'''
+_push = None
+
+def key(user_id):
+    return 'timeline:{}'.format(user_id)
+
+def score(post):
+    return calendar.timegm(post.timestamp.utctimetuple()) + \
+        post.timestamp.microsecond / 1e6
+
+def push(post, user_ids, chunk = 1000):
+    '''add post to the cached timelines of user_ids'''
+    global _push
+    redis = current_app.redis
+    if _push is None:
+        _push = redis.register_script(PUSH_LUA)
+    user_ids = list(user_ids)
+    with observe('redis', 'timelines'):
+        for start in range(0, len(user_ids), chunk):
+            _push(keys = [key(id) for id in user_ids[start:start + chunk]],
+                args = [score(post), post.id,
+                    current_app.config['TIMELINE_LENGTH']], client = redis)
+
+def invalidate(user_id):
+    '''drop a timeline whose follows changed, it`s rebuilt on next read'''
+    try:
+        with observe('redis', 'timelines'):
+            current_app.redis.delete(key(user_id))
+    except RedisError:
+        current_app.logger.warning('Timelines are unavailable')
+
+def build(user):
+    '''cache user`s newest TIMELINE_LENGTH posts, returns their ids'''
+    from app.models import Post
+    rows = user.followed_posts().with_entities(Post.id, Post.timestamp) \
+        .limit(current_app.config['TIMELINE_LENGTH']).all()
+    pipe = current_app.redis.pipeline()
+    pipe.delete(key(user.id))
+    if rows:
+        pipe.zadd(key(user.id), dict((id, calendar.timegm(
+            timestamp.utctimetuple()) + timestamp.microsecond / 1e6)
+            for id, timestamp in rows))
+        pipe.expire(key(user.id), current_app.config['TIMELINE_TTL'])
+    with observe('redis', 'timelines'):
+        pipe.execute()
+    return [id for id, timestamp in rows]
+
+def page(user, page, per_page):
+    '''(post ids, has next) of a page of user`s timeline, None when SQL
+    has to serve it'''
+    length = current_app.config['TIMELINE_LENGTH']
+    start = (page - 1) * per_page
+    # one more id tells if there is a next page
+    if not length or page < 1 or start + per_page >= length:
+        return None
+    try:
+        pipe = current_app.redis.pipeline(transaction = False)
+        pipe.exists(key(user.id))
+        pipe.zrevrange(key(user.id), start, start + per_page)
+        with observe('redis', 'timelines'):
+            exists, ids = pipe.execute()
+        if exists:
+            ids = [int(id) for id in ids]
+        else:
+            ids = build(user)[start:start + per_page + 1]
+    except RedisError:
+        current_app.logger.warning('Timelines are unavailable')
+        return None
+    if len(ids) <= per_page:
+        # the end of the cache, older posts may be in the archive
+        return None
+    return ids[:per_page], True
@@ -2,6 +2,7 @@ import json
 import requests
 from flask import current_app
 from flask_babel import _
+from app.metrics import observe
 
 def translate(text, source_language, dest_language):
     if 'MS_TRANSLATOR_KEY' not in current_app.config or \
@@ -9,15 +10,16 @@ def translate(text, source_language, dest_language):
         return _('Error: the translation service is not configured.')
 
     auth = {'Ocp-Apim-Subscription-Key': current_app.config['MS_TRANSLATOR_KEY']}
-    r = requests.get(
-        'https://api.microsofttranslator.com/v2/Ajax.svc'
-        '/Translate?text={}&from={}&to={}'.format(
-            text, 
-            source_language, 
-            dest_language
-        ),
-        headers = auth
-    )
+    with observe('translator', 'translate'):
+        r = requests.get(
+            'https://api.microsofttranslator.com/v2/Ajax.svc'
+            '/Translate?text={}&from={}&to={}'.format(
+                text, 
+                source_language, 
+                dest_language
+            ),
+            headers = auth
+        )
     if r.status_code != 200:
         return _('Error: the translation is failed.')
     #decode JSON into string 
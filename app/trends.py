@@ -0,0 +1,260 @@
+import heapq
+import re
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+import numpy as np
+from flask import current_app
+from redis.exceptions import RedisError
+from app.metrics import observe
+
+TOKEN = re.compile(r'#?\w{3,}', re.U)
+STOPWORDS = set('''
+    the and for are but not you all any can had her was one our out has
+    have this that with from they will would there their what about which
+    when your just into than then them these some been were also very
+    это как что так все она они его для уже или если был была мне меня
+    '''.split())
+
+# one count-min sketch per window: KEYS[1] sketch (a BITFIELD of depth
+# rows of width u32 counters), KEYS[2] top terms, KEYS[3] top posts.
+# ARGV - width, depth, top k, ttl, post id, then every term followed by
+# its depth counter indexes. Returns the post`s score
+COUNT_LUA = '''
+local width = tonumber(ARGV[1])
+local depth = tonumber(ARGV[2])
+local k = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local total = 0
+local i = 6
+while i <= #ARGV do
+    local ops = {}
+    for d = 0, depth - 1 do
+        local offset = d * width + tonumber(ARGV[i + 1 + d])
+        table.insert(ops, 'INCRBY')
+        table.insert(ops, 'u32')
+        table.insert(ops, '#' .. offset)
+        table.insert(ops, 1)
+    end
+    local counts = redis.call('BITFIELD', KEYS[1], unpack(ops))
+    local estimate = math.min(unpack(counts))
+    redis.call('ZADD', KEYS[2], estimate, ARGV[i])
+    total = total + estimate
+    i = i + 1 + depth
+end
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -k - 1)
+if total > 0 then
+    redis.call('ZADD', KEYS[3], total, ARGV[5])
+    redis.call('ZREMRANGEBYRANK', KEYS[3], 0, -k - 1)
+end
+for j = 1, 3 do
+    redis.call('EXPIRE', KEYS[j], ttl)
+end
+return total
+'''
+
+def tokenize(text, limit = None):
+    '''distinct lowercase words and #tags of 3+ letters, no stopwords'''
+    terms = []
+    for term in TOKEN.findall(text.lower()):
+        if term not in STOPWORDS and term not in terms and \
+                not term.lstrip('#').isdigit():
+            terms.append(term)
+    return terms[:limit]
+
+def indexes(term, width, depth):
+    '''the term`s counter in each sketch row, the same in every process
+    (double hashing of one md5)'''
+    digest = int(md5(term.encode('utf-8')).hexdigest(), 16)
+    h1, h2 = digest & 0xffffffff, (digest >> 32) & 0xffffffff | 1
+    return [(h1 + row * h2) % width for row in range(depth)]
+
+class TopK(object):
+    '''the k largest values by key. Values only grow, so a min-heap with
+    lazily skipped outdated entries is enough'''
+    def __init__(self, k):
+        self.k = k
+        self.values = {}
+        self.heap = []
+
+    def update(self, key, value):
+        if key not in self.values and len(self.values) >= self.k:
+            while self.values.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            if value <= self.heap[0][0]:
+                return
+            del self.values[heapq.heappop(self.heap)[1]]
+        self.values[key] = value
+        heapq.heappush(self.heap, (value, key))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(v, key) for key, v in self.values.items()]
+            heapq.heapify(self.heap)
+
+    def items(self):
+        return sorted(self.values.items(), key = lambda item: -item[1])
+
+class MemoryBackend(object):
+    '''sketches of this worker only, for development and tests'''
+    def __init__(self, width, depth, k, windows):
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.max_windows = windows
+        self.windows = OrderedDict()
+        self.lock = threading.Lock()
+
+    def count(self, window, post_id, terms):
+        with self.lock:
+            if window not in self.windows:
+                self.windows[window] = (np.zeros((self.depth, self.width),
+                    np.uint32), TopK(self.k), TopK(self.k))
+                while len(self.windows) > self.max_windows:
+                    self.windows.popitem(last = False)
+            sketch, top_terms, top_posts = self.windows[window]
+            rows = np.arange(self.depth)
+            total = 0
+            for term, columns in terms:
+                sketch[rows, columns] += 1
+                estimate = int(sketch[rows, columns].min())
+                top_terms.update(term, estimate)
+                total += estimate
+            if total:
+                top_posts.update(str(post_id), total)
+            return total
+
+    def top(self, windows):
+        '''[(terms, posts)] for each window, newest first'''
+        with self.lock:
+            return [(self.windows[w][1].items(), self.windows[w][2].items())
+                if w in self.windows else ([], []) for w in windows]
+
+class RedisBackend(object):
+    '''sketches shared by all workers, each window expires after
+    TRENDS_WINDOWS windows'''
+    def __init__(self, width, depth, k, ttl):
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.ttl = ttl
+        self._script = None
+
+    @staticmethod
+    def keys(window):
+        return ['trends:{}:{}'.format(window, kind)
+            for kind in ('sketch', 'terms', 'posts')]
+
+    def count(self, window, post_id, terms):
+        redis = current_app.redis
+        if self._script is None:
+            self._script = redis.register_script(COUNT_LUA)
+        args = [self.width, self.depth, self.k, self.ttl, post_id]
+        for term, columns in terms:
+            args.append(term)
+            args.extend(columns)
+        with observe('redis', 'trends'):
+            return int(self._script(keys = self.keys(window), args = args,
+                client = redis))
+
+    def top(self, windows):
+        pipe = current_app.redis.pipeline(transaction = False)
+        for window in windows:
+            sketch, terms, posts = self.keys(window)
+            pipe.zrevrange(terms, 0, -1, withscores = True)
+            pipe.zrevrange(posts, 0, -1, withscores = True)
+        with observe('redis', 'trends'):
+            results = pipe.execute()
+        decode = lambda items: [(key.decode('utf-8'), value)
+            for key, value in items]
+        return [(decode(results[i]), decode(results[i + 1]))
+            for i in range(0, len(results), 2)]
+
+class Trends(object):
+    '''approximate trending terms and hot posts. Every new post`s terms
+    are counted in the current window`s count-min sketch (TRENDS_WIDTH
+    x TRENDS_DEPTH counters, overcounting by at most e / width of the
+    window`s terms with probability 1 - e^-depth), and the TRENDS_TOP_K
+    biggest estimates are kept. A post scores the sum of its terms`
+    estimates. Reads add up the last TRENDS_WINDOWS windows, each older
+    one weighted by another TRENDS_DECAY'''
+    def __init__(self, app = None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRENDS_BACKEND', 'redis')
+        app.config.setdefault('TRENDS_WIDTH', 2048)
+        app.config.setdefault('TRENDS_DEPTH', 4)
+        app.config.setdefault('TRENDS_TOP_K', 100)
+        app.config.setdefault('TRENDS_WINDOW', 600)
+        app.config.setdefault('TRENDS_WINDOWS', 12)
+        app.config.setdefault('TRENDS_DECAY', 0.7)
+        app.config.setdefault('TRENDS_MAX_TERMS', 20)
+        config = app.config
+        kind = config['TRENDS_BACKEND']
+        sizes = (config['TRENDS_WIDTH'], config['TRENDS_DEPTH'],
+            config['TRENDS_TOP_K'])
+        if kind == 'memory':
+            self.backend = MemoryBackend(*sizes + (config['TRENDS_WINDOWS'],))
+        elif kind == 'redis':
+            self.backend = RedisBackend(*sizes + (config['TRENDS_WINDOW'] *
+                config['TRENDS_WINDOWS'],))
+        elif kind:
+            raise ValueError('unknown TRENDS_BACKEND {}'.format(kind))
+        app.extensions['trends'] = self
+
+    def window(self, now = None):
+        return int((now or time.time()) // current_app.config['TRENDS_WINDOW'])
+
+    def count(self, post_id, text, now = None):
+        '''count a new post, returns its score (0 if trends are off)'''
+        config = current_app.config
+        terms = tokenize(text, config['TRENDS_MAX_TERMS'])
+        if self.backend is None or not terms:
+            return 0
+        terms = [(term, indexes(term, config['TRENDS_WIDTH'],
+            config['TRENDS_DEPTH'])) for term in terms]
+        try:
+            return self.backend.count(self.window(now), post_id, terms)
+        except RedisError:
+            current_app.logger.warning('Trends are unavailable')
+            return 0
+
+    def top(self, limit, now = None):
+        '''([(term, score)], [(post id, score)]) best first'''
+        if self.backend is None:
+            return [], []
+        config = current_app.config
+        current = self.window(now)
+        windows = [current - age for age in range(config['TRENDS_WINDOWS'])]
+        try:
+            top = self.backend.top(windows)
+        except RedisError:
+            current_app.logger.warning('Trends are unavailable')
+            return [], []
+        terms = {}
+        posts = {}
+        for age, (window_terms, window_posts) in enumerate(top):
+            weight = config['TRENDS_DECAY'] ** age
+            for totals, items in ((terms, window_terms),
+                    (posts, window_posts)):
+                for key, value in items:
+                    totals[key] = totals.get(key, 0) + value * weight
+        best = lambda totals: sorted(totals.items(),
+            key = lambda item: -item[1])[:limit]
+        return best(terms), [(int(id), score) for id, score in best(posts)]
+
+def count_post(post):
+    '''feed a new post into the current window'''
+    return current_app.extensions['trends'].count(post.id, post.body)
+
+def trending(limit = 20):
+    '''(terms, hot posts) as ([(term, score)], [(Post, score)])'''
+    from app.models import Post
+    terms, posts = current_app.extensions['trends'].top(limit)
+    if not posts:
+        return terms, []
+    found = dict((post.id, post) for post in
+        Post.query.filter(Post.id.in_([id for id, score in posts])))
+    return terms, [(found[id], score) for id, score in posts if id in found]
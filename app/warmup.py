@@ -0,0 +1,62 @@
+import time
+from babel import Locale
+from babel.support import Translations
+from app import db
+
+def compile_templates(app):
+    '''compile every template into the jinja cache'''
+    names = [name for name in app.jinja_env.list_templates()
+        if name.endswith('.html') or name.endswith('.txt')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def load_catalogs(app):
+    '''babel locale data (cached by babel) and the compiled .mo files'''
+    babel = app.extensions['babel']
+    for language in app.config['LANGUAGES']:
+        Locale.parse(language)
+        for dirname in babel.translation_directories:
+            Translations.load(dirname, [language], babel.domain)
+    return len(app.config['LANGUAGES'])
+
+def load_language_profiles(app):
+    '''langdetect reads ~55 profiles from disk on its first detect()'''
+    from langdetect.detector_factory import init_factory
+    init_factory()
+    return 1
+
+def prime_db_pool(app):
+    '''open the pool`s connections now rather than on the first requests'''
+    pool = db.engine.pool
+    size = pool.size() if hasattr(pool, 'size') else 1
+    size = min(size, app.config.get('WARM_UP_DB_CONNECTIONS', 5)) or 1
+    connections = [db.engine.connect() for i in range(size)]
+    for connection in connections:
+        connection.execute('SELECT 1')
+        connection.close()
+    return size
+
+WARM_UP_STEPS = [
+    ('templates', compile_templates),
+    ('catalogs', load_catalogs),
+    ('language profiles', load_language_profiles),
+    ('db pool', prime_db_pool)
+]
+
+def warm_up(app):
+    '''run every warm-up step before the worker takes traffic and
+    return [(step, count, seconds)]'''
+    report = []
+    with app.app_context():
+        for name, step in WARM_UP_STEPS:
+            start = time.time()
+            try:
+                count = step(app)
+            except Exception:
+                app.logger.exception('Warm-up step %s failed', name)
+                count = None
+            report.append((name, count, time.time() - start))
+    app.logger.info('Warm-up: ' + ', '.join('{} {:.0f}ms'.format(name,
+        seconds * 1000) for name, count, seconds in report))
+    return report
@@ -0,0 +1,76 @@
+'''benchmark template rendering time of a 25-post feed page with and
+without the _post.html fragment cache
+
+usage: python benchmarks/bench_fragments.py [--authors 10] [--repeat 50]
+'''
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+    os.pardir)))
+
+from flask import g, render_template
+from flask_login import login_user
+from app import create_app, db
+from app.models import User, Post
+from config import Config
+
+class BenchConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    ELASTICSEARCH_URL = None
+    FRAGMENT_CACHE = 'memory'
+
+def seed(authors, per_page):
+    users = [User(username = 'user{}'.format(i),
+        email = 'user{}@example.com'.format(i)) for i in range(authors)]
+    db.session.add_all(users)
+    for i in range(per_page):
+        db.session.add(Post(body = 'post number {}'.format(i),
+            author = users[i % authors], language = 'ru' if i % 3 else 'en'))
+    db.session.commit()
+    return users[0]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--authors', type = int, default = 10)
+    parser.add_argument('--repeat', type = int, default = 50)
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+    cache = app.extensions['fragment_cache']
+    per_page = app.config['POSTS_PER_PAGE']
+    with app.app_context():
+        db.create_all()
+        viewer = seed(args.authors, per_page)
+
+        def render_page():
+            with app.test_request_context('/explore'):
+                login_user(viewer)
+                g.locale = 'en'
+                # a fresh session per page, like a real request
+                db.session.remove()
+                posts = Post.query.order_by(Post.timestamp.desc()).limit(
+                    per_page).all()
+                return render_template('index.html', title = 'Explore',
+                    posts = posts, next_url = None, prev_url = None)
+
+        backend = cache.backend
+        cache.backend = None
+        cold = min(timeit.repeat(render_page, number = args.repeat,
+            repeat = 3)) / args.repeat
+        cache.backend = backend
+        render_page()
+        warm = min(timeit.repeat(render_page, number = args.repeat,
+            repeat = 3)) / args.repeat
+
+        print('{} posts per page by {} authors'.format(per_page, args.authors))
+        print('no fragment cache  {:8.2f} ms/page'.format(cold * 1000))
+        print('warm memory cache  {:8.2f} ms/page  x{:.2f}'.format(
+            warm * 1000, cold / warm))
+        db.drop_all()
+
+if __name__ == '__main__':
+    main()
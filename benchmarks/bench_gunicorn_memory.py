@@ -0,0 +1,104 @@
+'''memory per gunicorn worker with and without preload_app
+
+Starts gunicorn (gunicorn.conf.py) on a database seeded by datagen.py,
+sends some requests to every worker and reads each worker`s memory
+from /proc/<pid>/smaps_rollup (Linux):
+- RSS counts pages shared with the master in every worker
+- PSS splits shared pages between the processes that use them
+- USS (private) is what the worker alone costs
+
+usage: python benchmarks/bench_gunicorn_memory.py [--workers 4]
+'''
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(BENCH_DIR, os.pardir))
+GUNICORN = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+
+def memory(pid):
+    '''{'Rss': kB, 'Pss': kB, 'Private': kB}'''
+    values = {'Rss': 0, 'Pss': 0, 'Private': 0}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            name = parts[0].rstrip(':')
+            if name in ('Rss', 'Pss'):
+                values[name] += int(parts[1])
+            elif name.startswith('Private_'):
+                values['Private'] += int(parts[1])
+    return values
+
+def children(pid):
+    with open('/proc/{}/task/{}/children'.format(pid, pid)) as f:
+        return [int(child) for child in f.read().split()]
+
+def run(preload, workers, requests, port, env):
+    env = dict(env, GUNICORN_PRELOAD = '1' if preload else '0',
+        GUNICORN_WORKERS = str(workers), GUNICORN_BIND = '127.0.0.1:{}'.format(
+            port))
+    master = subprocess.Popen([GUNICORN, '-c', 'gunicorn.conf.py',
+        'microblog:app'], cwd = ROOT, env = env,
+        stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        url = 'http://127.0.0.1:{}'.format(port)
+        for i in range(100):
+            try:
+                urllib.request.urlopen(url + '/auth/login').read()
+                break
+            except OSError:
+                time.sleep(0.2)
+        for i in range(requests):
+            for path in ['/auth/login', '/api/users/{}'.format(i % 50 + 1),
+                    '/explore']:
+                try:
+                    urllib.request.urlopen(url + path).read()
+                except OSError:
+                    pass # 401 and redirects to the login page
+        pids = children(master.pid)
+        return memory(master.pid), [memory(pid) for pid in pids]
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--threads', type = int, default = 1)
+    parser.add_argument('--requests', type = int, default = 200)
+    parser.add_argument('--users', type = int, default = 200)
+    parser.add_argument('--port', type = int, default = 5099)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    env = dict(os.environ, DATABASE_URL = database, FLASK_APP = 'microblog.py',
+        GUNICORN_THREADS = str(args.threads), RATELIMIT_DISABLED = '1',
+        WARM_UP = '1', LOG_TO_STDOUT = '1')
+    env.pop('prometheus_multiproc_dir', None)
+    subprocess.check_call([sys.executable, os.path.join(BENCH_DIR,
+        'datagen.py'), '--database', database, '--users', str(args.users)],
+        cwd = ROOT, env = env, stdout = subprocess.DEVNULL)
+
+    print('{} workers, {} thread(s), {} requests'.format(args.workers,
+        args.threads, args.requests * 3))
+    print('{:<12} {:>12} {:>12} {:>12} {:>14}'.format('', 'master RSS',
+        'worker RSS', 'worker PSS', 'worker USS'))
+    for preload in (False, True):
+        master, workers = run(preload, args.workers,
+            args.requests, args.port, env)
+        mean = lambda key: sum(w[key] for w in workers) / len(workers) / 1024
+        print('{:<12} {:>10.1f}MB {:>10.1f}MB {:>10.1f}MB {:>12.1f}MB'.format(
+            'preload' if preload else 'no preload', master['Rss'] / 1024,
+            mean('Rss'), mean('Pss'), mean('Private')))
+    shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
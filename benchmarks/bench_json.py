@@ -0,0 +1,73 @@
+'''micro-benchmark for serializing User.to_collection_dict pages
+
+Compares the old path (flask.json.dumps with the stdlib encoder) with the
+JSON provider installed in create_app, and shows gzip savings.
+
+usage: python benchmarks/bench_json.py [--users 100] [--repeat 200]
+'''
+import argparse
+import gzip
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+    os.pardir)))
+
+from flask import json as flask_json
+from app import create_app, db
+from app.json_provider import JSONProvider, orjson
+from app.models import User
+from config import Config
+
+class BenchConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    ELASTICSEARCH_URL = None
+
+def make_page(n):
+    for i in range(n):
+        u = User(username = 'user{}'.format(i),
+            email = 'user{}@example.com'.format(i),
+            about_me = 'about user {} — привет'.format(i))
+        db.session.add(u)
+    db.session.commit()
+    return User.to_collection_dict(User.query, 1, n, 'api.get_users')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type = int, default = 100)
+    parser.add_argument('--repeat', type = int, default = 200)
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+    with app.app_context(), app.test_request_context():
+        db.create_all()
+        data = make_page(args.users)
+
+        results = [('flask.json (before)',
+            lambda: flask_json.dumps(data).encode('utf-8'))]
+        stdlib = JSONProvider()
+        stdlib.backend = 'json'
+        results.append(('provider: json', lambda: stdlib.dumps(data)))
+        if orjson is not None:
+            fast = JSONProvider()
+            fast.backend = 'orjson'
+            results.append(('provider: orjson', lambda: fast.dumps(data)))
+
+        print('{} users per page, {} runs'.format(args.users, args.repeat))
+        baseline = None
+        for name, func in results:
+            best = min(timeit.repeat(func, number = args.repeat, repeat = 5))
+            per_call = best / args.repeat * 1e6
+            baseline = baseline or per_call
+            print('{:<22} {:>9.1f} us/page  x{:.2f}'.format(name, per_call,
+                baseline / per_call))
+
+        body = results[-1][1]()
+        print('payload {} bytes, gzip {} bytes'.format(len(body),
+            len(gzip.compress(body, compresslevel = 6))))
+        db.drop_all()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''per-request overhead of the prometheus request metrics
+
+Runs the same requests through the test client with METRICS_ENABLED on
+and off, in single process and in multiprocess (mmap files) mode.
+
+usage: python benchmarks/bench_metrics.py [--requests 2000]
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+def run(enabled, requests):
+    from app import create_app, db
+    from config import Config
+
+    class BenchConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        ELASTICSEARCH_URL = None
+        RATELIMIT_ENABLED = False
+        METRICS_ENABLED = enabled
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        for i in range(100):
+            client.get('/api/users/1')
+        start = time.perf_counter()
+        for i in range(requests):
+            client.get('/api/users/1')
+        elapsed = time.perf_counter() - start
+        db.drop_all()
+    return elapsed / requests * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type = int, default = 2000)
+    parser.add_argument('--multiprocess', action = 'store_true',
+        help = 'write samples to prometheus_multiproc_dir files')
+    args = parser.parse_args()
+
+    directory = None
+    if args.multiprocess:
+        directory = tempfile.mkdtemp()
+        os.environ['prometheus_multiproc_dir'] = directory
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+        os.pardir)))
+
+    off = run(False, args.requests)
+    on = run(True, args.requests)
+    print('{} requests, {} mode'.format(args.requests,
+        'multiprocess' if args.multiprocess else 'single process'))
+    print('metrics off  {:8.1f} us/request'.format(off))
+    print('metrics on   {:8.1f} us/request  (+{:.1f} us)'.format(on, on - off))
+    if directory:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''SQLite write throughput with several worker processes, default
+pragmas against the SQLITE_PRAGMAS profile from config.py
+
+Each process plays gunicorn worker: read the user, update last_seen,
+insert a post and commit, as fast as it can.
+
+usage: python benchmarks/bench_sqlite.py [--workers 4] [--seconds 5]
+'''
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+    os.pardir)))
+
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.models import User, Post
+from config import Config
+
+def make_config(path, tuned):
+    class BenchConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        ELASTICSEARCH_URL = None
+        FRAGMENT_CACHE = ''
+    if not tuned:
+        BenchConfig.SQLITE_PRAGMAS = {}
+        BenchConfig.SQLITE_POOL_SIZE = 0
+    return BenchConfig
+
+def worker(config, user_id, seconds, results):
+    app = create_app(config)
+    writes = errors = 0
+    with app.app_context():
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            try:
+                user = User.query.get(user_id)
+                user.last_seen = datetime.utcnow()
+                db.session.add(Post(body = 'benchmark', author = user))
+                db.session.commit()
+                writes += 1
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+            db.session.remove()
+    results.put((writes, errors))
+
+def run(tuned, workers, seconds):
+    directory = tempfile.mkdtemp()
+    config = make_config(os.path.join(directory, 'bench.db'), tuned)
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        for i in range(workers):
+            db.session.add(User(username = 'user{}'.format(i),
+                email = 'user{}@example.com'.format(i)))
+        db.session.commit()
+        db.engine.dispose()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target = worker,
+        args = (config, i + 1, seconds, results)) for i in range(workers)]
+    for process in processes:
+        process.start()
+    totals = [results.get() for process in processes]
+    for process in processes:
+        process.join()
+    shutil.rmtree(directory)
+    return sum(t[0] for t in totals), sum(t[1] for t in totals)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--seconds', type = float, default = 5)
+    args = parser.parse_args()
+    print('{} worker processes, {}s each'.format(args.workers, args.seconds))
+    for name, tuned in [('default pragmas', False), ('SQLITE_PRAGMAS', True)]:
+        writes, errors = run(tuned, args.workers, args.seconds)
+        print('{:<16} {:>8.0f} commits/s  {} locked errors'.format(name,
+            writes / args.seconds, errors))
+
+if __name__ == '__main__':
+    main()
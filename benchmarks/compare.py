@@ -0,0 +1,40 @@
+'''compare two loadtest.py result files
+
+usage: python benchmarks/compare.py results/before.json results/after.json
+'''
+import argparse
+import json
+
+METRICS = ['throughput', 'p50_ms', 'p95_ms', 'p99_ms']
+
+def change(before, after):
+    if not before or after is None:
+        return '     n/a'
+    return '{:+7.1f}%'.format((after - before) / before * 100)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print('before: {} ({})'.format(before['meta']['revision'],
+        before['meta']['time']))
+    print('after:  {} ({})'.format(after['meta']['revision'],
+        after['meta']['time']))
+    print('{:<14}'.format('') + ''.join('{:>19}'.format(metric)
+        for metric in METRICS))
+    for name in before['results']:
+        if name not in after['results']:
+            continue
+        b = before['results'][name]
+        a = after['results'][name]
+        print('{:<14}'.format(name) + ''.join('{:>10.1f} {}'.format(
+            a[metric], change(b[metric], a[metric])) for metric in METRICS))
+
+if __name__ == '__main__':
+    main()
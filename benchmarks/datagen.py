@@ -0,0 +1,184 @@
+'''realistic synthetic data for benchmarks
+
+- followers: a power-law graph, a few accounts have most of the followers
+- posts: posting rates are skewed (most users post rarely, a few a lot),
+  timestamps spread over the last days, bodies in several languages
+- private messages, mostly between users that follow each other
+
+usage: python benchmarks/datagen.py --database sqlite:///bench.db --users 2000
+'''
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+    os.pardir)))
+
+import numpy as np
+from werkzeug.security import generate_password_hash
+# the vocabulary and distributions of `flask seed`, for post and message
+# bodies too
+from app.seed import VOCABULARY, LANGUAGE_WEIGHTS, pareto, reset_sequence
+
+PASSWORD = 'benchmark'
+
+def numpy_rng(rng):
+    '''a numpy generator for app.seed`s helpers, seeded from rng'''
+    return np.random.default_rng(rng.getrandbits(32))
+
+def sentence(rng, words, length):
+    return ' '.join(rng.choice(words) for i in range(length)).capitalize()
+
+def generate_users(rng, count):
+    password_hash = generate_password_hash(PASSWORD)
+    now = datetime.utcnow()
+    return [{
+        'id': i + 1,
+        'username': 'user{}'.format(i + 1),
+        'email': 'user{}@example.com'.format(i + 1),
+        'password_hash': password_hash,
+        'about_me': 'Synthetic user {}'.format(i + 1),
+        'last_seen': now - timedelta(minutes = rng.randint(0, 60 * 24 * 7))
+    } for i in range(count)]
+
+def generate_follows(rng, count, alpha = 1.1, mean_degree = 20):
+    '''target popularity ~ 1 / rank^alpha, out-degree is pareto'''
+    weights = [1.0 / (rank + 1) ** alpha for rank in range(count)]
+    ids = list(range(1, count + 1))
+    rng.shuffle(ids) # popularity isn`t tied to the user id
+    edges = set()
+    degrees = pareto(numpy_rng(rng), 1.5, mean_degree, count, count - 1)
+    for follower, degree in zip(range(1, count + 1), degrees.tolist()):
+        for followed in rng.choices(ids, weights, k = degree):
+            if followed != follower:
+                edges.add((follower, followed))
+    return [{'follower_id': a, 'followed_id': b} for a, b in edges]
+
+def generate_posts(rng, users, mean_posts = 10, days = 30):
+    now = datetime.utcnow()
+    posts = []
+    counts = pareto(numpy_rng(rng), 1.2, mean_posts, len(users), 5000)
+    for user, count in zip(users, counts.tolist()):
+        for i in range(count):
+            language, words = rng.choices(VOCABULARY, LANGUAGE_WEIGHTS)[0]
+            posts.append({
+                'body': sentence(rng, words, rng.randint(3, 18))[:140],
+                'timestamp': now - timedelta(seconds = rng.randint(0,
+                    days * 86400)),
+                'user_id': user['id'],
+                'language': language
+            })
+    posts.sort(key = lambda post: post['timestamp'])
+    return posts
+
+def generate_messages(rng, follows, users, count):
+    now = datetime.utcnow()
+    messages = []
+    for i in range(count):
+        if follows and rng.random() < 0.8:
+            edge = rng.choice(follows)
+            sender, recipient = edge['follower_id'], edge['followed_id']
+        else:
+            sender, recipient = rng.sample(range(1, len(users) + 1), 2)
+        language, words = rng.choices(VOCABULARY, LANGUAGE_WEIGHTS)[0]
+        messages.append({
+            'sender_id': sender,
+            'recipient_id': recipient,
+            'body': sentence(rng, words, rng.randint(3, 30))[:280],
+            'timestamp': now - timedelta(seconds = rng.randint(0, 7 * 86400))
+        })
+    return messages
+
+def generate_conversations(messages):
+    '''a conversation per pair of users and both inbox rows, sets
+    id and conversation_id of the messages'''
+    messages.sort(key = lambda message: message['timestamp'])
+    conversations = {}
+    last = {}
+    for i, message in enumerate(messages):
+        message['id'] = i + 1
+        pair = tuple(sorted([message['sender_id'], message['recipient_id']]))
+        if pair not in conversations:
+            conversations[pair] = {'id': len(conversations) + 1,
+                'user1_id': pair[0], 'user2_id': pair[1]}
+        message['conversation_id'] = conversations[pair]['id']
+        last[pair] = message
+    participants = []
+    for pair, conversation in conversations.items():
+        for user, other in [pair, pair[::-1]]:
+            participants.append({
+                'conversation_id': conversation['id'],
+                'user_id': user,
+                'other_id': other,
+                'last_message_id': last[pair]['id'],
+                'timestamp': last[pair]['timestamp'],
+                'unread': 0
+            })
+    return list(conversations.values()), participants
+
+def insert(db, table, rows, chunk = 5000):
+    for i in range(0, len(rows), chunk):
+        db.session.execute(table.insert(), rows[i:i + chunk])
+    db.session.commit()
+
+def generate(db, users = 1000, mean_posts = 10, mean_degree = 20,
+        messages = None, seed = 42):
+    '''fill an empty database, returns row counts'''
+    from app.models import User, Post, Message, Conversation, Participant, \
+        followers
+    from app.pipeline import DONE
+    rng = random.Random(seed)
+    user_rows = generate_users(rng, users)
+    follow_rows = generate_follows(rng, users, mean_degree = mean_degree)
+    post_rows = generate_posts(rng, user_rows, mean_posts)
+    message_rows = generate_messages(rng, follow_rows, user_rows,
+        users * 2 if messages is None else messages)
+    conversation_rows, participant_rows = generate_conversations(message_rows)
+    insert(db, User.__table__, user_rows)
+    insert(db, followers, follow_rows)
+    # existing posts, nothing left for the ingestion pipeline
+    insert(db, Post.__table__, [dict(row, pipeline = DONE)
+        for row in post_rows])
+    insert(db, Conversation.__table__, conversation_rows)
+    insert(db, Message.__table__, message_rows)
+    insert(db, Participant.__table__, participant_rows)
+    # users, conversations and messages were given their ids
+    with db.engine.begin() as connection:
+        for table in [User.__table__, Conversation.__table__,
+                Message.__table__]:
+            reset_sequence(connection, table)
+    return {'users': len(user_rows), 'follows': len(follow_rows),
+        'posts': len(post_rows), 'messages': len(message_rows),
+        'conversations': len(conversation_rows)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', required = True,
+        help = 'SQLAlchemy URL of an empty database')
+    parser.add_argument('--users', type = int, default = 1000)
+    parser.add_argument('--posts', type = int, default = 10,
+        help = 'mean posts per user')
+    parser.add_argument('--degree', type = int, default = 20,
+        help = 'mean number of followed accounts')
+    parser.add_argument('--seed', type = int, default = 42)
+    args = parser.parse_args()
+
+    from app import create_app, db
+    from config import Config
+
+    class SeedConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database
+        ELASTICSEARCH_URL = None
+
+    app = create_app(SeedConfig)
+    with app.app_context():
+        db.create_all()
+        counts = generate(db, args.users, args.posts, args.degree,
+            seed = args.seed)
+    print(', '.join('{} {}'.format(count, name)
+        for name, count in counts.items()))
+
+if __name__ == '__main__':
+    main()
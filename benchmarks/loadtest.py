@@ -0,0 +1,254 @@
+'''throughput and p50/p95/p99 latency of the main endpoints
+
+Runs in-process through the Flask test client (default, seeds its own
+SQLite database with datagen.py) or against a running server with --url,
+e.g. a local gunicorn started with RATELIMIT_DISABLED=1 on a database
+filled by datagen.py. Results are written as JSON for compare.py.
+Without ELASTICSEARCH_URL search answers with a redirect to explore.
+
+usage: python benchmarks/loadtest.py [--users 1000] [--requests 200]
+       python benchmarks/loadtest.py --url http://127.0.0.1:5001 \\
+           --concurrency 8
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCH_DIR, os.pardir)))
+
+import datagen
+
+# name, url template. {username}, {id} and {word} are filled per request
+SCENARIOS = [
+    ('index', '/index'),
+    ('explore', '/explore'),
+    ('user', '/user/{username}'),
+    ('search', '/search?q={word}'),
+    ('messages', '/messages'),
+    ('conversation', '/messages/{username}'),
+    ('notifications', '/notifications?since=0'),
+    ('api_user', '/api/users/{id}'),
+    ('api_users', '/api/users?per_page=25'),
+    ('api_followers', '/api/users/{id}/followers'),
+    ('api_batch', '/api/users?ids={ids}')
+]
+API_PREFIX = '/api/'
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def summarize(latencies, statuses, elapsed):
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'statuses': dict((str(code), statuses.count(code))
+            for code in sorted(set(statuses)))
+    }
+
+def fill(template, rng, users):
+    words = [word for language, vocabulary in datagen.VOCABULARY
+        for word in vocabulary]
+    user_id = rng.randint(1, users)
+    return template.format(username = 'user{}'.format(user_id), id = user_id,
+        word = rng.choice(words), ids = ','.join(str(rng.randint(1, users))
+            for i in range(25)))
+
+class TestClientDriver(object):
+    '''requests through app.test_client(), one thread'''
+    def __init__(self, app, user_id, token):
+        self.app = app
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        self.headers = {'Authorization': 'Bearer ' + token}
+
+    def get(self, url):
+        headers = self.headers if url.startswith(API_PREFIX) else None
+        return self.client.get(url, headers = headers).status_code
+
+class HTTPDriver(object):
+    '''requests to a running server, one requests.Session per thread'''
+    def __init__(self, base_url, username):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.requests = requests
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            session = self.requests.Session()
+            page = session.get(self.base_url + '/auth/login').text
+            csrf = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"',
+                page)
+            session.post(self.base_url + '/auth/login', data = {
+                'csrf_token': csrf.group(1) if csrf else '',
+                'username': self.username, 'password': datagen.PASSWORD})
+            token = session.post(self.base_url + '/api/tokens',
+                auth = (self.username, datagen.PASSWORD)).json()['token']
+            self.local.token = token
+            self.local.session = session
+        return self.local.session
+
+    def get(self, url):
+        session = self.session()
+        headers = {'Authorization': 'Bearer ' + self.local.token} \
+            if url.startswith(API_PREFIX) else None
+        return session.get(self.base_url + url, headers = headers,
+            allow_redirects = False).status_code
+
+def run_scenario(driver, template, requests, concurrency, users, seed):
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+
+    def worker(worker_id, count):
+        rng = random.Random(seed + worker_id)
+        for i in range(count):
+            url = fill(template, rng, users)
+            start = time.perf_counter()
+            status = driver.get(url)
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                statuses.append(status)
+
+    per_worker = max(1, requests // concurrency)
+    threads = [threading.Thread(target = worker, args = (i, per_worker))
+        for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+            'HEAD'], cwd = BENCH_DIR, universal_newlines = True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def make_app(database):
+    from app import create_app
+    from config import Config
+
+    class LoadTestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = database
+        ELASTICSEARCH_URL = None
+        RATELIMIT_ENABLED = False
+        WTF_CSRF_ENABLED = False
+
+    app = create_app(LoadTestConfig)
+    # slow request / N+1 warnings would drown the report
+    app.logger.setLevel(logging.ERROR)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help = 'benchmark a running server')
+    parser.add_argument('--database', help = 'seeded database to use '
+        'in-process, instead of generating a temporary one')
+    parser.add_argument('--users', type = int, default = 1000)
+    parser.add_argument('--requests', type = int, default = 200,
+        help = 'requests per scenario')
+    parser.add_argument('--warmup', type = int, default = 10)
+    parser.add_argument('--concurrency', type = int, default = 1)
+    parser.add_argument('--only', help = 'comma separated scenario names')
+    parser.add_argument('--seed', type = int, default = 42)
+    parser.add_argument('--output', help = 'result file, default '
+        'benchmarks/results/<time>.json')
+    args = parser.parse_args()
+
+    scenarios = [(name, template) for name, template in SCENARIOS
+        if not args.only or name in args.only.split(',')]
+    directory = None
+    context = None
+    if args.url:
+        driver = HTTPDriver(args.url, 'user1')
+        mode = 'http'
+    else:
+        from app import db
+        from app.models import User
+        database = args.database
+        if database is None:
+            directory = tempfile.mkdtemp()
+            database = 'sqlite:///' + os.path.join(directory, 'bench.db')
+        app = make_app(database)
+        context = app.app_context()
+        context.push()
+        if args.database is None:
+            db.create_all()
+            print('seeded', datagen.generate(db, args.users, seed = args.seed))
+        user = User.query.get(1)
+        token = user.get_token()
+        db.session.commit()
+        driver = TestClientDriver(app, user.id, token)
+        db.session.remove()
+        mode = 'test_client'
+        if args.concurrency != 1:
+            print('the test client runs one request at a time')
+            args.concurrency = 1
+
+    results = {}
+    for name, template in scenarios:
+        run_scenario(driver, template, args.warmup, args.concurrency,
+            args.users, args.seed)
+        results[name] = run_scenario(driver, template, args.requests,
+            args.concurrency, args.users, args.seed)
+        r = results[name]
+        print('{:<14} {:>8.1f} req/s  p50 {:>7.1f}ms  p95 {:>7.1f}ms  '
+            'p99 {:>7.1f}ms  {}'.format(name, r['throughput'], r['p50_ms'],
+                r['p95_ms'], r['p99_ms'], r['statuses']))
+
+    report = {
+        'meta': {
+            'time': datetime.utcnow().isoformat() + 'Z',
+            'revision': git_revision(),
+            'mode': mode,
+            'url': args.url,
+            'users': args.users,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'python': platform.python_version()
+        },
+        'results': results
+    }
+    output = args.output or os.path.join(BENCH_DIR, 'results',
+        datetime.utcnow().strftime('%Y%m%d-%H%M%S') + '.json')
+    if not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent = 2)
+    print('results written to', output)
+
+    if context is not None:
+        context.pop()
+    if directory:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
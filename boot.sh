@@ -1,4 +1,4 @@
-#!/bin/sh
+#!/bin/bash
 
 source myvenv/bin/activate
 
@@ -11,4 +11,10 @@ while true; do
     sleep 5
 done
 flask translate compile
-exec gunicorn -b :5001 --access-logfile - --error-logfile - microblog:app
\ No newline at end of file
+export WARM_UP=1
+# prometheus samples of all gunicorn workers, cleared on every start
+export prometheus_multiproc_dir=${prometheus_multiproc_dir:-/tmp/microblog-metrics}
+rm -rf $prometheus_multiproc_dir
+mkdir -p $prometheus_multiproc_dir
+# settings and fork hooks are in gunicorn.conf.py
+exec gunicorn -c gunicorn.conf.py microblog:app
\ No newline at end of file
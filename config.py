@@ -13,9 +13,170 @@ class Config(object):
     'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # SQLite profile, see app/sqlite.py: WAL lets readers run next to the
+    # writer, busy_timeout makes writers wait instead of failing with
+    # "database is locked"
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL', # durable at checkpoints, safe with WAL
+        'cache_size': -64000, # KiB, per connection
+        'mmap_size': 256 * 1024 * 1024,
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000),
+        'temp_store': 'MEMORY'
+    }
+    SQLITE_POOL_SIZE = 5
+
+    # don`t write User.last_seen more often than this (seconds)
+    LAST_SEEN_INTERVAL = 60
+
+    # browsers reuse a user popup for this long (seconds) before they
+    # revalidate it with its ETag
+    USER_POPUP_MAX_AGE = 300
+
+    # task_progress notifications not updated for this long (seconds) are
+    # deleted by the compaction job, batch by batch
+    NOTIFICATION_RETENTION = 24 * 3600
+    NOTIFICATION_COMPACT_BATCH = 1000
+    NOTIFICATION_COMPACT_INTERVAL = 3600
+
+    # the janitor closes tasks whose RQ job died or expired and deletes
+    # complete tasks older than TASK_RETENTION (seconds)
+    TASK_RETENTION = 7 * 24 * 3600
+    JANITOR_BATCH = 500
+    JANITOR_INTERVAL = 600
+
+    # "who to follow" (app/suggestions.py): users whose follows changed
+    # are refreshed every SUGGESTIONS_INTERVAL seconds, everyone every
+    # SUGGESTIONS_FULL_INTERVAL. Scores sample SUGGESTIONS_SAMPLE followed
+    # accounts per user and SUGGESTIONS_FANOUT of theirs
+    SUGGESTIONS_PER_USER = 10
+    SUGGESTIONS_BATCH = 500
+    SUGGESTIONS_SAMPLE = 200
+    SUGGESTIONS_FANOUT = 100
+    SUGGESTIONS_INTERVAL = 600
+    SUGGESTIONS_FULL_INTERVAL = 24 * 3600
+
+    # read replicas (comma separated URLs) serve the reads of GET requests
+    REPLICA_URLS = [url for url in
+        (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url]
+    SQLALCHEMY_BINDS = dict(('replica{}'.format(i), url)
+        for i, url in enumerate(REPLICA_URLS))
+    SQLALCHEMY_REPLICAS = sorted(SQLALCHEMY_BINDS)
+    # after a write the user reads from the primary for this long
+    REPLICA_STICKY_SECONDS = 5
+    # replicas lagging more than this many seconds are skipped
+    REPLICA_MAX_LAG = 2
+    REPLICA_LAG_CHECK_INTERVAL = 5
+
+    # per-request SQL stats: warn above SQL_QUERY_THRESHOLD queries or when
+    # one statement runs SQL_N_PLUS_ONE_THRESHOLD times, X-DB-Queries and
+    # Server-Timing headers with SQL_STATS_HEADER (always in debug mode)
+    SQL_STATS_ENABLED = True
+    SQL_STATS_HEADER = os.environ.get('SQL_STATS_HEADER') is not None
+    SQL_QUERY_THRESHOLD = 30
+    SQL_N_PLUS_ONE_THRESHOLD = 5
+
+    # prometheus /metrics, set prometheus_multiproc_dir for gunicorn and
+    # rq workers (boot.sh does). METRICS_TOKEN protects the endpoint
+    METRICS_ENABLED = os.environ.get('METRICS_DISABLED') is None
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
     # Pagination options
     POSTS_PER_PAGE = 25
 
+    # JSON backend: 'auto' (orjson if installed), 'orjson' or 'json'
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER') or 'auto'
+
+    # gzip/brotli compression of responses
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_DISABLED') is None
+    COMPRESS_MIMETYPES = ['application/json']
+    COMPRESS_MIN_SIZE = 500
+
+    # trending terms and hot posts (app/trends.py): 'redis' (shared),
+    # 'memory' (per worker) or ''. Each TRENDS_WINDOW seconds gets a
+    # count-min sketch of TRENDS_WIDTH x TRENDS_DEPTH counters (4 bytes
+    # each) and keeps the TRENDS_TOP_K best terms and posts, reads add up
+    # TRENDS_WINDOWS windows with TRENDS_DECAY per window of age
+    TRENDS_BACKEND = os.environ.get('TRENDS_BACKEND', 'redis')
+    TRENDS_WIDTH = 2048
+    TRENDS_DEPTH = 4
+    TRENDS_TOP_K = 100
+    TRENDS_WINDOW = 600
+    TRENDS_WINDOWS = 12
+    TRENDS_DECAY = 0.7
+    TRENDS_MAX_TERMS = 20
+
+    # posts older than POST_HOT_DAYS move from post to post_archive
+    # (app/partitions.py), POST_ROLLOVER_BATCH at a time, every
+    # POST_ROLLOVER_INTERVAL seconds
+    POST_HOT_DAYS = int(os.environ.get('POST_HOT_DAYS') or 30)
+    POST_ROLLOVER_BATCH = 1000
+    POST_ROLLOVER_INTERVAL = 24 * 3600
+
+    # post ingestion (app/pipeline.py): each stage takes PIPELINE_BATCH
+    # posts at a time, with up to PIPELINE_DRAINERS[stage] jobs at once.
+    # A job does PIPELINE_MAX_BATCHES batches before it makes room for
+    # others. The janitor queues posts unfinished PIPELINE_STALL seconds
+    # after posting again, looking PIPELINE_SWEEP_AGE seconds back
+    PIPELINE_BATCH = 100
+    PIPELINE_MAX_BATCHES = 50
+    PIPELINE_DRAINERS = {
+        'language': 4,
+        'search': 2,
+        'timeline': 4,
+        'trends': 1,
+        'notify': 2
+    }
+    PIPELINE_DRAINER_TTL = 900
+    PIPELINE_STALL = 300
+    PIPELINE_SWEEP_AGE = 24 * 3600
+
+    # home timelines cached in redis (app/timelines.py): the newest
+    # TIMELINE_LENGTH post ids per user, 0 turns them off
+    TIMELINE_LENGTH = 800
+    TIMELINE_TTL = 7 * 24 * 3600
+
+    # 'flask assets build' output, served at /assets with a year long
+    # immutable Cache-Control. Without a build the first page builds it
+    ASSETS_OUTPUT = os.environ.get('ASSETS_OUTPUT') or \
+        os.path.join(basedir, 'app', 'static', 'dist')
+    ASSETS_MAX_AGE = 365 * 24 * 3600
+    ASSETS_AUTO_BUILD = os.environ.get('ASSETS_AUTO_BUILD', '1') != '0'
+
+    # max number of ids in one GET /api/users?ids= call
+    API_BATCH_MAX_IDS = 100
+    # POST /api/posts/bulk limits
+    API_BULK_MAX_POSTS = 5000
+    API_BULK_MAX_BYTES = 4 * 1024 * 1024
+
+    # token bucket budgets per endpoint: (requests, per seconds), counted
+    # per API token or logged in user. Buckets live in redis and fall back
+    # to worker memory when redis is down
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_DISABLED') is None
+    RATELIMITS = {
+        'main.search': (30, 60),
+        'main.translate_text': (20, 60),
+        'main.export_posts': (5, 3600),
+        'api.get_users': (120, 60),
+        'api.create_posts_bulk': (10, 60)
+    }
+    # concurrent requests to rate limited endpoints per worker before
+    # shedding load with 503, 0 means no limit
+    RATELIMIT_MAX_CONCURRENT = int(os.environ.get('RATELIMIT_MAX_CONCURRENT')
+        or 32)
+
+    # cache for rendered posts: 'memory' (per worker), 'redis' or ''.
+    # Shared by the workers in redis when REDIS_URL is set, a profile
+    # change only reaches the worker that made it in memory
+    FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE',
+        'redis' if os.environ.get('REDIS_URL') else 'memory')
+    FRAGMENT_CACHE_SIZE = 10000
+    FRAGMENT_CACHE_TTL = 3600
+
+    # run app/warmup.py when microblog.py is imported (set by boot.sh
+    # for gunicorn, off for flask cli commands)
+    WARM_UP = os.environ.get('WARM_UP') is not None
+
     # Available languages for flask-babel
     LANGUAGES = ['en','ru']
 
@@ -28,6 +189,35 @@ class Config(object):
     # enable Redis for RQ
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
 
+    # RQ queues, most urgent first. A worker of one queue also takes jobs
+    # from the queues before it, never from those after it
+    TASK_QUEUES = ['interactive', 'email', 'indexing', 'bulk']
+    # task name: (queue, job timeout, result ttl), times in seconds
+    TASK_ROUTES = {
+        'export_posts': ('bulk', 3600, 3600),
+        'compact_notifications': ('bulk', 900, 0),
+        'janitor': ('bulk', 900, 0),
+        'refresh_suggestions': ('bulk', 3600, 0),
+        'rollover_posts': ('bulk', 3 * 3600, 0),
+        # what users see next goes first, the rest with the indexing
+        'pipeline_language': ('interactive', 600, 0),
+        'pipeline_search': ('indexing', 600, 0),
+        'pipeline_timeline': ('interactive', 600, 0),
+        'pipeline_trends': ('indexing', 600, 0),
+        'pipeline_notify': ('email', 600, 0)
+    }
+    TASK_DEFAULT_ROUTE = ('interactive', 180, 500)
+    # 'flask rq supervise' runs (min, max) workers per queue, one per
+    # RQ_JOBS_PER_WORKER waiting jobs. A max of 0 is one per CPU core
+    RQ_WORKERS = {
+        'interactive': (1, 2),
+        'email': (1, 1),
+        'indexing': (0, 2),
+        'bulk': (1, 0)
+    }
+    RQ_JOBS_PER_WORKER = 10
+    RQ_SCALE_INTERVAL = 15
+
     #Enable email notifications
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
@@ -0,0 +1,55 @@
+'''gunicorn settings, read from ./gunicorn.conf.py when gunicorn starts.
+Every value can be overridden with the GUNICORN_* environment variables'''
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND') or ':5001'
+accesslog = '-'
+errorlog = '-'
+
+# import the app once in the master. Workers share its memory pages
+# (copy-on-write) and start faster, app/clients.py makes connections
+# fork-safe
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+workers = int(os.environ.get('GUNICORN_WORKERS') or
+    multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.environ.get('GUNICORN_THREADS') or 4)
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 30)
+
+# recycle workers after max_requests (jitter keeps them from restarting
+# together) or when their RSS grows past GUNICORN_MAX_WORKER_MB
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS') or 2000)
+max_requests_jitter = max_requests // 10
+MAX_WORKER_MEMORY = int(os.environ.get('GUNICORN_MAX_WORKER_MB') or 300) \
+    * 1024 * 1024
+
+def rss():
+    '''resident memory of this process in bytes'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource # peak, not current, outside of Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def pre_fork(server, worker):
+    if server.cfg.preload_app:
+        from app.clients import before_fork
+        before_fork(server.app.wsgi())
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app.clients import after_fork
+        after_fork(server.app.wsgi())
+
+def post_request(worker, req, environ, resp):
+    if worker.alive and rss() > MAX_WORKER_MEMORY:
+        worker.log.info('Worker %s uses %dMB, restarting it', worker.pid,
+            rss() // (1024 * 1024))
+        worker.alive = False
+
+def child_exit(server, worker):
+    from app.metrics import worker_exit
+    worker_exit(worker.pid)
@@ -7,6 +7,11 @@ app = create_app()
 # gain access to cli module
 cli.register(app)
 
+# compile templates, load catalogs etc. before the worker takes traffic
+if app.config['WARM_UP']:
+    from app.warmup import warm_up
+    warm_up(app)
+
 @app.shell_context_processor
 def make_shell_context():
 	'''default import modules for flask shell'''
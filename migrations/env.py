@@ -78,11 +78,18 @@ def run_migrations_online():
         poolclass=pool.NullPool,
     )
 
+    # monthly partitions of post_archive are created by app/partitions.py,
+    # not by migrations
+    def include_object(object, name, type_, reflected, compare_to):
+        return not (type_ == 'table' and reflected and
+            name.startswith('post_archive_'))
+
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
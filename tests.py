@@ -1,13 +1,29 @@
 from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
-from app import db, create_app
-from app.models import User, Post
+import numpy as np
+from flask import g, session
+from app import db, create_app, limiter
+from app.assets import BUNDLES, build
+from app.clients import reset_clients, before_fork, after_fork
+from app.models import User, Post, ArchivedPost, Message, Conversation, \
+    Notification, Task, Suggestion
+from app.queryplan import assert_no_full_scans
+from app.sqlstats import assert_max_queries, statement_shape
+from app.suggestions import Graph, refresh
+from app.trends import TopK, indexes, tokenize
 from config import Config
 
 class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
     ELASTICSEARCH_URL = None
+    FRAGMENT_CACHE = 'memory'
 
 class UserModelCase(unittest.TestCase):
     def setUp(self):
@@ -97,5 +113,1018 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+class APICase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        # buckets are per user now and user ids repeat across tests
+        limiter.local.buckets.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def auth_headers(self, user):
+        token = user.get_token()
+        db.session.commit()
+        return {'Authorization': 'Bearer ' + token}
+
+    def test_datetime_format(self):
+        provider = self.app.extensions['json_provider']
+        when = datetime(2021, 1, 20, 14, 42, 46, 476004)
+        self.assertEqual(provider.loads(provider.dumps({'t': when})),
+            {'t': '2021-01-20T14:42:46.476004Z'})
+
+    def test_compression(self):
+        for i in range(20):
+            db.session.add(User(username='user{}'.format(i),
+                email='user{}@example.com'.format(i)))
+        db.session.commit()
+        u = User.query.first()
+        headers = self.auth_headers(u)
+        rv = self.client.get('/api/users', headers=headers)
+        self.assertIsNone(rv.headers.get('Content-Encoding'))
+        self.assertEqual(rv.get_json()['items'][0]['last_seen'][-1], 'Z')
+
+        headers['Accept-Encoding'] = 'gzip'
+        rv = self.client.get('/api/users', headers=headers)
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', rv.headers['Vary'])
+        data = json.loads(gzip.decompress(rv.data).decode('utf-8'))
+        self.assertEqual(data['_meta']['total_items'], 20)
+
+        rv = self.client.get('/api/users/{}'.format(u.id), headers=headers)
+        self.assertIsNone(rv.headers.get('Content-Encoding'))
+
+    def test_users_batch(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.add(Post(body='post from susan', author=u2))
+        u1.follow(u2)
+        u3.follow(u2)
+        db.session.commit()
+        headers = self.auth_headers(u1)
+
+        rv = self.client.get('/api/users?ids={},{},999'.format(u2.id, u1.id),
+            headers=headers)
+        self.assertEqual(rv.status_code, 200)
+        data = rv.get_json()
+        self.assertEqual(sorted(data['items']), sorted([str(u1.id),
+            str(u2.id)]))
+        self.assertEqual(data['missing'], [999])
+        susan = data['items'][str(u2.id)]
+        self.assertEqual(susan['_links']['self'], '/api/users/{}'.format(u2.id))
+        self.assertEqual((susan['post_count'], susan['follower_count'],
+            susan['followed_count']), (1, 2, 0))
+        self.assertEqual(data['items'][str(u1.id)]['followed_count'], 1)
+
+        # one round trip, independent of the number of ids (post counts
+        # take one grouped query per tier)
+        url = '/api/users?ids={},{},{}'.format(u1.id, u2.id, u3.id)
+        with assert_max_queries(6, n_plus_one=2):
+            self.client.get(url, headers=headers)
+
+        rv = self.client.get('/api/users?ids=1,x', headers=headers)
+        self.assertEqual(rv.status_code, 400)
+        ids = ','.join(str(i) for i in range(
+            self.app.config['API_BATCH_MAX_IDS'] + 1))
+        rv = self.client.get('/api/users?ids=' + ids, headers=headers)
+        self.assertEqual(rv.status_code, 400)
+
+    def test_sparse_fields(self):
+        for i in range(3):
+            db.session.add(User(username='user{}'.format(i),
+                email='user{}@example.com'.format(i)))
+        db.session.commit()
+        headers = self.auth_headers(User.query.first())
+
+        rv = self.client.get('/api/users?per_page=2&fields=username',
+            headers=headers)
+        data = rv.get_json()
+        self.assertEqual(data['items'][0], {'id': 1, 'username': 'user0'})
+        self.assertIn('fields=username', data['_links']['next'])
+
+        rv = self.client.get('/api/users/2?fields=post_count,_links',
+            headers=headers)
+        self.assertEqual(sorted(rv.get_json()), ['_links', 'id', 'post_count'])
+
+        rv = self.client.get('/api/users?ids=1,2&fields=username',
+            headers=headers)
+        self.assertEqual(rv.get_json()['items']['2'],
+            {'id': 2, 'username': 'user1'})
+
+        rv = self.client.get('/api/users?fields=password_hash',
+            headers=headers)
+        self.assertEqual(rv.status_code, 400)
+
+    def test_posts_bulk(self):
+        from app.pipeline import run
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        headers = self.auth_headers(u)
+        posts = [{'body': 'the first imported post'},
+            {'body': ''},
+            {'body': 'an old one', 'timestamp': '2019-05-17T10:00:00Z',
+                'language': 'en'},
+            {'body': 'the first imported post'},
+            {'body': 'bad time', 'timestamp': 'yesterday'}]
+        with assert_max_queries(8):
+            rv = self.client.post('/api/posts/bulk', headers=headers,
+                json={'posts': posts})
+        self.assertEqual(rv.status_code, 200)
+        data = rv.get_json()
+        self.assertEqual((data['created'], data['errors']), (3, 2))
+        self.assertEqual([item['status'] for item in data['items']],
+            [201, 400, 201, 201, 400])
+        ids = [item['id'] for item in data['items'] if 'id' in item]
+        self.assertEqual(len(set(ids)), 3)
+        old = Post.query.get(ids[1])
+        self.assertEqual((old.body, old.timestamp, old.author),
+            ('an old one', datetime(2019, 5, 17, 10), u))
+        # left to the pipeline`s language stage
+        self.assertEqual(Post.query.get(ids[0]).language, None)
+        self.assertEqual(Post.query.get(ids[1]).language, 'en')
+        run('language', ids)
+        self.assertEqual(Post.query.get(ids[0]).language, 'en')
+
+        ndjson = '{"body": "from a file"}\nnot json\n\n{"body": "more"}\n'
+        rv = self.client.post('/api/posts/bulk', headers=headers,
+            data=ndjson, content_type='application/x-ndjson')
+        data = rv.get_json()
+        self.assertEqual([item['status'] for item in data['items']],
+            [201, 400, 201])
+        self.assertEqual(data['items'][1]['error'], 'invalid JSON')
+        self.assertEqual(u.posts.count(), 5)
+
+        self.app.config['API_BULK_MAX_POSTS'] = 2
+        rv = self.client.post('/api/posts/bulk', headers=headers,
+            json=posts)
+        self.assertEqual(rv.status_code, 400)
+        rv = self.client.post('/api/posts/bulk', headers=headers,
+            json={'body': 'not a list'})
+        self.assertEqual(rv.status_code, 400)
+
+    def test_rate_limit(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        headers = self.auth_headers(u)
+        self.app.config['RATELIMITS'] = {'api.get_users': (2, 60)}
+        for i in range(2):
+            rv = self.client.get('/api/users', headers=headers)
+            self.assertEqual(rv.status_code, 200)
+        rv = self.client.get('/api/users', headers=headers)
+        self.assertEqual(rv.status_code, 429)
+        self.assertEqual(rv.headers['Retry-After'], '30')
+        self.assertEqual(rv.get_json()['error'], 'Too Many Requests')
+        # other endpoints and other tokens have their own buckets
+        rv = self.client.get('/api/users/1', headers=headers)
+        self.assertEqual(rv.status_code, 200)
+
+        # made up tokens don`t get buckets of their own
+        self.app.config['RATELIMITS'] = {'api.get_user': (2, 60)}
+        for i in range(2):
+            rv = self.client.get('/api/users/1', headers={
+                'Authorization': 'Bearer made-up-{}'.format(i)})
+            self.assertEqual(rv.status_code, 401)
+        rv = self.client.get('/api/users/1', headers={
+            'Authorization': 'Bearer made-up-2'})
+        self.assertEqual(rv.status_code, 429)
+
+class FragmentCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.cache = self.app.extensions['fragment_cache']
+        self.cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def render(self, posts, locale='en'):
+        with self.app.test_request_context():
+            g.locale = locale
+            return [str(html) for html in self.cache.render_posts(posts)]
+
+    def test_post_fragments(self):
+        u = User(username='john', email='john@example.com')
+        p = Post(body='hello', author=u, language='ru')
+        db.session.add_all([u, p])
+        db.session.commit()
+
+        html = self.render([p])[0]
+        self.assertIn('john', html)
+        self.assertIn('translation{}'.format(p.id), html)
+        key = self.cache.key(p.id, 'ru', 'en', 0)
+        self.assertEqual(self.cache.backend.get_many([key]), [html])
+        self.assertEqual(self.render([p]), [html])
+        self.assertNotIn('translation', self.render([p], 'ru')[0])
+
+        # a profile change re-renders the author`s posts
+        u.last_seen = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(self.render([p]), [html])
+        u.username = 'johnny'
+        db.session.commit()
+        self.assertIn('johnny', self.render([p])[0])
+
+        # the pipeline detects the language after the first render
+        q = Post(body='hello again', author=u)
+        db.session.add(q)
+        db.session.commit()
+        self.assertNotIn('translation', self.render([q])[0])
+        q.language = 'ru'
+        db.session.commit()
+        self.assertIn('translation', self.render([q])[0])
+
+class ClientsCase(unittest.TestCase):
+    def test_lazy_clients(self):
+        app = create_app(TestConfig)
+        self.assertNotIn('_clients', app.__dict__)
+        self.assertIsNone(app.elasticsearch)
+        redis = app.redis
+        self.assertIs(app.task_queue.connection, redis)
+        self.assertIs(app.redis, redis)
+        # a forked worker sees another pid and connects again
+        pid, client = app._clients['redis']
+        app._clients['redis'] = (pid + 1, client)
+        self.assertIsNot(app.redis, redis)
+        reset_clients(app)
+        self.assertNotIn('_clients', app.__dict__)
+
+    def test_fork_hooks(self):
+        app = create_app(TestConfig)
+        with app.app_context():
+            connection = db.engine.connect()
+            record = connection.connection._connection_record
+            dbapi_connection = connection.connection.connection
+            connection.close()
+            # a pooled connection opened by the preloaded master
+            record.info['pid'] += 1
+            connection = db.engine.connect()
+            self.assertIsNot(connection.connection.connection,
+                dbapi_connection)
+            connection.close()
+            redis = app.redis
+            before_fork(app)
+            after_fork(app)
+            self.assertIsNot(app.redis, redis)
+
+class ReplicaCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+        class ReplicaConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.dir,
+                'primary.db')
+            SQLALCHEMY_BINDS = {'replica0': 'sqlite:///' + os.path.join(
+                self.dir, 'replica.db')}
+            SQLALCHEMY_REPLICAS = ['replica0']
+
+        self.app = create_app(ReplicaConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.replica = db.get_engine(self.app, 'replica0')
+        db.Model.metadata.create_all(self.replica)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.dir)
+
+    def test_routing(self):
+        # the replica hasn`t caught up with the rename yet
+        db.session.add_all([User(username='john', email='john@example.com'),
+            User(username='susan', email='susan@example.com')])
+        db.session.commit()
+        self.replica.execute("INSERT INTO user (id, username, email) "
+            "VALUES (1, 'old-john', 'john@example.com'), "
+            "(2, 'susan', 'susan@example.com')")
+        db.session.remove()
+
+        with self.app.test_request_context('/', method='POST'):
+            self.assertEqual(User.query.get(1).username, 'john')
+            db.session.remove()
+        with self.app.test_request_context('/'):
+            u = User.query.get(1)
+            self.assertEqual(u.username, 'old-john')
+            # last_seen writes don`t pin the user to the primary
+            u.last_seen = datetime.utcnow()
+            db.session.commit()
+            self.assertEqual(User.query.get(1).username, 'old-john')
+            self.assertNotIn('db_primary_until', session)
+            # other writes do, for the rest of the request and after it
+            u.follow(User.query.get(2))
+            db.session.commit()
+            self.assertEqual(User.query.get(1).username, 'john')
+            self.assertIn('db_primary_until', session)
+            db.session.remove()
+
+        # API clients are pinned by token, without redis to the primary
+        with self.app.test_request_context('/api/users/1',
+                headers={'Authorization': 'Bearer token'}):
+            self.assertEqual(User.query.get(1).username, 'john')
+            db.session.remove()
+
+        # a replica lagging too much is skipped
+        self.app.config['REPLICA_MAX_LAG'] = -1
+        db.replicas.lag.clear()
+        with self.app.test_request_context('/'):
+            self.assertEqual(User.query.get(1).username, 'john')
+            db.session.remove()
+
+class SQLiteCase(unittest.TestCase):
+    def test_pragmas(self):
+        directory = tempfile.mkdtemp()
+
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory,
+                'app.db')
+
+        app = create_app(FileConfig)
+        with app.app_context():
+            self.assertEqual(db.engine.pool.__class__.__name__, 'QueuePool')
+            with db.engine.connect() as connection:
+                pragma = lambda name: connection.execute(
+                    'PRAGMA ' + name).scalar()
+                self.assertEqual(pragma('journal_mode'), 'wal')
+                self.assertEqual(pragma('synchronous'), 1) # NORMAL
+                self.assertEqual(pragma('busy_timeout'),
+                    FileConfig.SQLITE_PRAGMAS['busy_timeout'])
+            db.engine.dispose()
+        shutil.rmtree(directory)
+
+class SQLStatsCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app.config['SQL_STATS_HEADER'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_statement_shape(self):
+        self.assertEqual(statement_shape(
+            'SELECT id FROM user\n WHERE id IN (?, ?, ?)'),
+            'SELECT id FROM user WHERE id IN (?)')
+
+    def test_n_plus_one(self):
+        users = [User(username='user{}'.format(i),
+            email='user{}@example.com'.format(i)) for i in range(5)]
+        db.session.add_all(users)
+        db.session.add_all([Post(body='post', author=u) for u in users])
+        db.session.commit()
+        db.session.expire_all()
+        with self.assertRaises(AssertionError):
+            with assert_max_queries(10, n_plus_one=3):
+                [p.author.username for p in Post.query.all()]
+        db.session.expire_all()
+        with assert_max_queries(1):
+            Post.query.options(db.joinedload(Post.author)).all()
+
+    def test_header(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        token = u.get_token()
+        db.session.commit()
+        rv = self.app.test_client().get('/api/users/1',
+            headers={'Authorization': 'Bearer ' + token})
+        self.assertGreater(int(rv.headers['X-DB-Queries']), 0)
+        self.assertIn('db;dur=', rv.headers['Server-Timing'])
+
+class SeedCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_seed(self):
+        from app.seed import seed
+        db.session.add(User(username='john', email='john@example.com'))
+        db.session.commit()
+        counts = seed(50, mean_posts=5, mean_degree=5, chunk=20,
+            random_seed=1)
+        self.assertEqual(User.query.count(), 51)
+        self.assertEqual(Post.query.count(), counts['posts'])
+        self.assertEqual(User.query.get(2).username, 'seed2')
+        edges = [tuple(row) for row in db.session.execute(
+            'SELECT follower_id, followed_id FROM followers')]
+        self.assertEqual(len(edges), counts['follows'])
+        self.assertEqual(len(set(edges)), len(edges))
+        self.assertFalse([a for a, b in edges if a == b or b == 1])
+        # the ORM assigns the next id after the seeded ones
+        u = User(username='susan', email='susan@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(u.id, 52)
+
+class UserPopupCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_popup(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        u1.follow(u2)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(u1.id)
+
+        rv = client.get('/user/susan/popup')
+        self.assertIn(b'1 followers', rv.data)
+        self.assertNotIn(b'csrf_token', rv.data)
+        self.assertIn('private', rv.headers['Cache-Control'])
+        self.assertIn('max-age=', rv.headers['Cache-Control'])
+        etag = rv.headers['ETag']
+        rv = client.get('/user/susan/popup', headers = {'If-None-Match': etag})
+        self.assertEqual(rv.status_code, 304)
+        self.assertEqual(rv.data, b'')
+
+        state = client.get('/user/susan/follow_state')
+        self.assertIn('no-store', state.headers['Cache-Control'])
+        data = state.get_json()
+        self.assertTrue(data['following'])
+        self.assertEqual(data['url'], '/unfollow/susan')
+        self.assertTrue(data['csrf_token'])
+        self.assertEqual(client.get('/user/john/follow_state').get_json(),
+            {'self': True})
+
+        # following changes the counts and so the ETag
+        u1.unfollow(u2)
+        db.session.commit()
+        rv = client.get('/user/susan/popup', headers = {'If-None-Match': etag})
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn(b'0 followers', rv.data)
+        self.assertFalse(client.get('/user/susan/follow_state').get_json()[
+            'following'])
+
+class SuggestionsCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_sampling(self):
+        follower = np.array([1] * 50 + [2] * 3)
+        followed = np.array(list(range(3, 53)) + [3, 4, 5])
+        graph = Graph(follower, followed, 53)
+        owner, account, weight = graph.neighbours(np.array([1, 2]), 10,
+            np.random.default_rng(1))
+        self.assertEqual(list(np.bincount(owner)), [10, 3])
+        self.assertEqual(len(set(account[:10].tolist())), 10)
+        self.assertEqual(weight.tolist(), [5.0] * 10 + [1.0] * 3)
+
+    def test_refresh(self):
+        john, susan, mary, david, anna = [User(username=name,
+            email='{}@example.com'.format(name)) for name in
+            ['john', 'susan', 'mary', 'david', 'anna']]
+        db.session.add_all([john, susan, mary, david, anna])
+        db.session.commit()
+        john.follow(susan)
+        john.follow(david)
+        susan.follow(mary)
+        susan.follow(david)
+        david.follow(mary)
+        david.follow(anna)
+        db.session.commit()
+
+        self.assertEqual(refresh(), 5)
+        self.assertEqual(john.suggestions(), [mary, anna])
+        self.assertEqual(Suggestion.query.get((john.id, mary.id)).score, 2)
+        # popular accounts for users who follow nobody
+        self.assertEqual(anna.suggestions(2), [mary, david])
+        self.assertEqual(refresh(), 0)
+
+        john.follow(mary)
+        db.session.commit()
+        self.assertEqual(john.suggestions(), [anna])
+        self.assertEqual(refresh(), 1)
+        self.assertEqual(john.suggestions(), [anna])
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(john.id)
+        with assert_max_queries(12):
+            rv = client.get('/index')
+        self.assertIn(b'Who to follow', rv.data)
+
+class TrendsCase(unittest.TestCase):
+    def setUp(self):
+        class TrendsConfig(TestConfig):
+            TRENDS_BACKEND = 'memory'
+            TRENDS_WIDTH = 256
+            TRENDS_TOP_K = 3
+        self.app = create_app(TrendsConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('The #Flask and flask, 2021 Flask ok'),
+            ['#flask', 'flask'])
+        self.assertEqual(indexes('flask', 64, 4), indexes('flask', 64, 4))
+
+    def test_top_k(self):
+        top = TopK(2)
+        for key, value in [('a', 1), ('b', 2), ('c', 3), ('a', 4),
+                ('d', 1), ('b', 5)]:
+            top.update(key, value)
+        self.assertEqual(top.items(), [('b', 5), ('a', 4)])
+
+    def test_trends(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        now = time.time()
+        window = self.app.config['TRENDS_WINDOW']
+        bodies = ['coffee time'] * 5 + ['music and coffee'] * 2 + \
+            ['rain today'] + ['word{}'.format(i) for i in range(100)]
+        posts = [Post(body=body, author=u) for body in bodies]
+        db.session.add_all(posts)
+        db.session.commit()
+        trends = self.app.extensions['trends']
+        for post in posts:
+            trends.count(post.id, post.body, now)
+        # an older window counts less
+        for i in range(3):
+            trends.count(posts[-1].id, 'weather', now - window)
+
+        terms, top_posts = trends.top(3, now)
+        self.assertEqual(terms[0][0], 'coffee')
+        self.assertGreaterEqual(terms[0][1], 7)
+        self.assertLessEqual(len(terms), 3)
+        self.assertEqual(top_posts[0][0], posts[4].id)
+        weather = dict(trends.top(10, now + window)[0]).get('weather')
+        self.assertAlmostEqual(weather, 3 * 0.7 ** 2)
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(u.id)
+        rv = client.get('/explore/trending')
+        self.assertIn(b'coffee', rv.data)
+        headers = {'Authorization': 'Bearer ' + u.get_token()}
+        db.session.commit()
+        data = client.get('/api/trends?limit=2', headers=headers).get_json()
+        self.assertEqual(data['terms'][0]['term'], 'coffee')
+        self.assertEqual(data['posts'][0]['id'], posts[4].id)
+
+class PipelineCase(unittest.TestCase):
+    def setUp(self):
+        class PipelineConfig(TestConfig):
+            TRENDS_BACKEND = 'memory'
+            TIMELINE_LENGTH = 0
+            WTF_CSRF_ENABLED = False
+        self.app = create_app(PipelineConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_stages(self):
+        from app.pipeline import DONE, STAGES, run
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        db.session.add_all([john, susan])
+        db.session.commit()
+
+        # the write path is the INSERT, redis being down loses nothing
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(john.id)
+        rv = client.post('/index', data={'post': 'coffee with @susan'})
+        self.assertEqual(rv.status_code, 302)
+        post = Post.query.one()
+        self.assertEqual((post.language, post.pipeline), (None, 0))
+        self.assertIn(b'coffee with', client.get('/index').data)
+
+        ids = [post.id]
+        for stage in STAGES:
+            self.assertEqual(run(stage, ids), 1)
+        db.session.refresh(post)
+        self.assertEqual(post.pipeline, DONE)
+        self.assertEqual(post.language, 'en')
+        self.assertEqual(
+            Notification.query.filter_by(user_id=susan.id).one().get_data(),
+            {'post_id': post.id, 'username': 'john'})
+        terms = dict(self.app.extensions['trends'].top(5)[0])
+        self.assertEqual(terms['coffee'], 1)
+
+        # queued again: every stage skips it
+        for stage in STAGES:
+            self.assertEqual(run(stage, ids), 0)
+        terms = dict(self.app.extensions['trends'].top(5)[0])
+        self.assertEqual(terms['coffee'], 1)
+
+class PartitionsCase(unittest.TestCase):
+    def setUp(self):
+        class PartitionsConfig(TestConfig):
+            POSTS_PER_PAGE = 2
+            POST_HOT_DAYS = 30
+        self.app = create_app(PartitionsConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_rollover(self):
+        from app.partitions import rollover
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        db.session.add_all([john, susan])
+        john.follow(susan)
+        now = datetime.utcnow()
+        # three posts of the last POST_HOT_DAYS days, seven older ones
+        posts = [Post(body='post {}'.format(i), author=susan,
+            timestamp=now - timedelta(days=i * 10)) for i in range(10)]
+        db.session.add_all(posts)
+        db.session.commit()
+        ids = [post.id for post in posts]
+
+        self.assertEqual(rollover(batch_size=2), 7)
+        self.assertEqual(rollover(), 0)
+        self.assertEqual(Post.query.count(), 3)
+        self.assertEqual([p.id for p in ArchivedPost.query.order_by(
+            ArchivedPost.timestamp.desc())], ids[3:])
+        self.assertEqual(ArchivedPost.query.get(ids[5]).author, susan)
+        self.assertEqual(susan.post_count(), 10)
+        self.assertEqual(User.get_counts([susan.id])[susan.id]['post_count'],
+            10)
+        # search hits are found in either tier, in relevance order
+        self.assertEqual([p.id for p in Post.hydrate([ids[6], ids[0], 999])],
+            [ids[6], ids[0]])
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(john.id)
+        # the first page only reads the hot tier
+        with assert_max_queries(12) as stats:
+            client.get('/explore')
+        self.assertFalse([shape for shape in stats.shapes
+            if 'post_archive' in shape or
+                shape.startswith('SELECT count') and 'post.' in shape])
+        for url in ['/explore', '/index', '/user/susan']:
+            pages = []
+            for page in range(1, 7):
+                data = client.get('{}?page={}'.format(url, page)).data
+                pages.append([i for i in range(10)
+                    if 'post {}<'.format(i).encode() in data])
+            self.assertEqual(pages, [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9],
+                []])
+
+class ConversationCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app.config['POSTS_PER_PAGE'] = 2
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_conversations(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        now = datetime.utcnow()
+        for i, (sender, recipient) in enumerate([(u2, u1), (u1, u2),
+                (u2, u1), (u3, u1)]):
+            m = sender.send_message(recipient, 'message {}'.format(i))
+            m.timestamp = now + timedelta(seconds=i)
+            db.session.commit()
+        self.assertEqual(Conversation.query.count(), 2)
+        inbox = u1.inbox().all()
+        self.assertEqual([p.other for p in inbox], [u3, u2])
+        self.assertEqual([p.unread for p in inbox], [1, 2])
+        self.assertEqual(inbox[1].last_message.body, 'message 2')
+        self.assertEqual(u2.inbox().first().unread, 1)
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(u1.id)
+        rv = client.get('/messages/susan')
+        self.assertIn(b'message 2', rv.data)
+        self.assertNotIn(b'message 0', rv.data)
+        self.assertEqual(u1.inbox().all()[1].unread, 0)
+        before = Message.query.filter_by(body='message 1').first().timestamp
+        rv = client.get('/messages/susan?before=' +
+            before.strftime('%Y-%m-%dT%H:%M:%S.%f'))
+        self.assertIn(b'message 0', rv.data)
+        self.assertNotIn(b'message 1', rv.data)
+        self.assertEqual(client.get('/messages/mary').status_code, 200)
+
+    def test_note_to_self(self):
+        u1 = User(username='john', email='john@example.com')
+        db.session.add(u1)
+        db.session.commit()
+        u1.send_message(u1, 'note 0')
+        db.session.commit()
+        u1.send_message(u1, 'note 1')
+        db.session.commit()
+        self.assertEqual(Conversation.query.count(), 1)
+        inbox = u1.inbox().all()
+        self.assertEqual([p.other for p in inbox], [u1])
+        self.assertEqual(inbox[0].unread, 0)
+        self.assertEqual(inbox[0].last_message.body, 'note 1')
+
+    def test_same_timestamp_pages(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        now = datetime.utcnow()
+        for i in range(3):
+            m = u2.send_message(u1, 'message {}'.format(i))
+            m.timestamp = now
+            db.session.commit()
+        conversation = Conversation.between(u1, u2, create=False)
+        first = conversation.page(per_page=2)
+        self.assertEqual([m.body for m in first], ['message 2', 'message 1'])
+        rest = conversation.page(first[-1].timestamp, 2, first[-1].id)
+        self.assertEqual([m.body for m in rest], ['message 0'])
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(u1.id)
+        rv = client.get('/messages/susan')
+        self.assertIn(b'before_id=', rv.data)
+
+class NotificationCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_upsert(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        u.add_notification('unread_message_count', 1)
+        db.session.commit()
+        n = u.notifications.one()
+        version = n.version
+        u.add_notification('unread_message_count', 2)
+        db.session.commit()
+        db.session.refresh(n)
+        self.assertEqual(u.notifications.count(), 1)
+        self.assertEqual(n.get_data(), 2)
+        self.assertGreater(n.version, version)
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(u.id)
+        rv = client.get('/notifications?since={}'.format(version))
+        self.assertEqual([n['data'] for n in rv.get_json()], [2])
+        rv = client.get('/notifications?since={}'.format(n.version))
+        self.assertEqual(rv.get_json(), [])
+
+    def test_compact(self):
+        users = [User(username='user{}'.format(i),
+            email='user{}@example.com'.format(i)) for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+        for u in users:
+            u.add_notification('task_progress', {'progress': 100})
+            u.add_notification('unread_message_count', 0)
+        db.session.commit()
+        Notification.query.filter_by(name='task_progress').filter(
+            Notification.user_id < 5).update(
+                {'timestamp': datetime.utcnow() - timedelta(days=2)})
+        db.session.commit()
+        deleted = Notification.compact(
+            datetime.utcnow() - timedelta(days=1), batch_size=3)
+        self.assertEqual(deleted, 4)
+        self.assertEqual(Notification.query.filter_by(
+            name='task_progress').count(), 1)
+        self.assertEqual(Notification.query.filter_by(
+            name='unread_message_count').count(), 5)
+
+class JanitorCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_purge_tasks(self):
+        from app.janitor import purge_tasks
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        old = datetime.utcnow() - timedelta(days=30)
+        db.session.add_all([
+            Task(id='old', name='export_posts', user=u, complete=True,
+                timestamp=old),
+            Task(id='running', name='export_posts', user=u, timestamp=old),
+            Task(id='recent', name='export_posts', user=u, complete=True)
+        ])
+        db.session.commit()
+        self.assertEqual(purge_tasks(datetime.utcnow() - timedelta(days=7),
+            batch_size=1), 1)
+        self.assertEqual(sorted(t.id for t in Task.query),
+            ['recent', 'running'])
+
+class QueuesCase(unittest.TestCase):
+    def test_routes(self):
+        from app.queues import Supervisor, listens_to, route
+        app = create_app(TestConfig)
+        app.config['RQ_WORKERS'] = {'interactive': (1, 3), 'bulk': (0, 2)}
+        queue, options = route(app, 'export_posts')
+        self.assertEqual(queue.name, 'microblog-bulk')
+        self.assertEqual(options['job_timeout'], 3600)
+        self.assertEqual(route(app, 'unknown')[0].name,
+            'microblog-interactive')
+        self.assertEqual(listens_to(app, 'interactive'), ['interactive'])
+        self.assertEqual(listens_to(app, 'bulk')[0], 'interactive')
+        supervisor = Supervisor(app)
+        self.assertEqual(supervisor.wanted('interactive', 0), 1)
+        self.assertEqual(supervisor.wanted('interactive', 25), 3)
+        self.assertEqual(supervisor.wanted('bulk', 0), 0)
+        self.assertEqual(supervisor.wanted('bulk', 5), 1)
+
+class QueryPlanCase(unittest.TestCase):
+    def setUp(self):
+        from app.seed import seed
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        seed(100, random_seed=1)
+        User.query.get(2).send_message(User.query.get(1), 'hi')
+        self.token = User.query.get(1).get_token()
+        db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as s:
+            s['_user_id'] = '1'
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_models(self):
+        u1 = User.query.get(1)
+        u2 = User.query.get(2)
+        with assert_no_full_scans():
+            u1.is_following(u2)
+            u1.followed_posts().limit(25).all()
+            u1.new_messages()
+            u1.get_tasks_in_progress()
+            u2.followers.count()
+            User.check_token(self.token)
+            Post.query.filter(Post.pipeline < 31,
+                Post.timestamp > datetime.utcnow() - timedelta(days=1)).all()
+
+    def test_pages(self):
+        with assert_no_full_scans():
+            for url in ['/index', '/user/seed2', '/messages',
+                    '/messages/seed2', '/notifications?since=0']:
+                self.assertEqual(self.client.get(url).status_code, 200)
+        # the global timeline reads posts by the timestamp index
+        with assert_no_full_scans(allow=['post']):
+            self.client.get('/explore')
+
+    def test_api(self):
+        headers = {'Authorization': 'Bearer ' + self.token}
+        with assert_no_full_scans():
+            for url in ['/api/users/2', '/api/users/2/followers',
+                    '/api/users/2/followed', '/api/users?ids=1,2,3']:
+                self.assertEqual(self.client.get(url,
+                    headers=headers).status_code, 200)
+
+class AssetsCase(unittest.TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        class AssetsConfig(TestConfig):
+            ASSETS_OUTPUT = self.output
+        self.app = create_app(AssetsConfig)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def test_build(self):
+        manifest = build(self.app)
+        self.assertRegex(manifest['app.js'], r'^app\.[0-9a-f]{12}\.js$')
+        with open(os.path.join(self.output, manifest['vendor.css'])) as f:
+            css = f.read()
+        font = manifest['bootstrap/fonts/glyphicons-halflings-regular.woff']
+        self.assertIn('url({})'.format(font), css)
+        self.assertTrue(os.path.exists(os.path.join(self.output,
+            manifest['app.js'] + '.gz')))
+        self.assertEqual(build(self.app), manifest)
+
+        # a changed bundle replaces the old files
+        bundles = dict(BUNDLES, **{'app.js': ['js/translate.js']})
+        changed = build(self.app, bundles = bundles)
+        self.assertNotEqual(changed['app.js'], manifest['app.js'])
+        self.assertFalse(os.path.exists(os.path.join(self.output,
+            manifest['app.js'])))
+
+    def test_serve(self):
+        rv = self.client.get('/auth/login')
+        manifest = self.app.extensions['assets'].manifest(self.app)
+        url = '/assets/' + manifest['app.js']
+        self.assertIn('src="{}"'.format(url), rv.get_data(as_text = True))
+
+        rv = self.client.get(url, headers = {'Accept-Encoding': 'gzip'})
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', rv.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', rv.headers['Vary'])
+        self.assertIn(b'function translate',
+            gzip.decompress(rv.get_data()))
+        rv.close()
+        rv = self.client.get(url)
+        self.assertIsNone(rv.headers.get('Content-Encoding'))
+        self.assertIn('javascript', rv.mimetype)
+        rv.close()
+        self.assertEqual(self.client.get('/assets/manifest.json').status_code,
+            404)
+
+class MetricsCase(unittest.TestCase):
+    def test_metrics_endpoint(self):
+        app = create_app(TestConfig)
+        with app.app_context():
+            db.create_all()
+            client = app.test_client()
+            client.get('/auth/login')
+            rv = client.get('/metrics')
+            self.assertEqual(rv.status_code, 200)
+            text = rv.get_data(as_text=True)
+            self.assertIn('microblog_request_duration_seconds_count{'
+                'endpoint="auth.login",method="GET"}', text)
+            self.assertIn('microblog_db_queries_per_request', text)
+            self.assertIn('microblog_requests_in_flight 0.0', text)
+            app.config['METRICS_TOKEN'] = 'secret'
+            self.assertEqual(client.get('/metrics').status_code, 403)
+            db.session.remove()
+            db.drop_all()
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file